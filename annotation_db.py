@@ -0,0 +1,316 @@
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from PIL import Image
+from folder_index import FolderIndex, IMAGE_EXTENSIONS, CACHE_DIRNAME
+from image_meta import MetadataCache
+from annotation_io import read_text_file
+import rectangle_log
+
+DB_FILENAME = 'annotations.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    filename TEXT PRIMARY KEY,
+    latitude REAL,
+    longitude REAL,
+    altitude REAL,
+    gimbal_roll REAL,
+    gimbal_pitch REAL,
+    gimbal_yaw REAL,
+    width INTEGER,
+    height INTEGER,
+    source_mtime_ns INTEGER,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS points (
+    filename TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    target INTEGER,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    PRIMARY KEY (filename, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_points_target ON points(target);
+CREATE TABLE IF NOT EXISTS rectangles (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    corners TEXT NOT NULL,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_rectangles_filename ON rectangles(filename);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+GEO_COLUMNS = {
+    'latitude': 'Latitude', 'longitude': 'Longitude', 'altitude': 'Altitude',
+    'gimbal_roll': 'GimbalRoll', 'gimbal_pitch': 'GimbalPitch', 'gimbal_yaw': 'GimbalYaw'
+}
+
+
+def source_mtime_ns(folder_path, image_filename):
+    """
+    返回图像对应的TXT和矩形文件中最新的修改时间，用于判断数据库中的记录是否需要重新同步
+    :return: 纳秒时间戳，都不存在时返回0
+    """
+    image_path = os.path.join(folder_path, image_filename)
+    txt_path = os.path.join(folder_path, f"{os.path.splitext(image_filename)[0]}.txt")
+    sources = [txt_path, rectangle_log.snapshot_path(image_path), rectangle_log.log_path(image_path)]
+    return max((os.stat(p).st_mtime_ns for p in sources if os.path.exists(p)), default=0)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class AnnotationDB:
+    """
+    整个文件夹的标注数据库（SQLite）：图像元数据、靶标点和矩形记录
+    每次保存时增量更新，也可以从TXT/JSON文件全量同步，并导出为CSV或COCO格式JSON
+    """
+
+    def __init__(self, db_path, folder_path=None):
+        """
+        :param db_path: SQLite数据库文件路径
+        :param folder_path: 对应的图像文件夹路径
+        """
+        self.db_path = db_path
+        self.folder_path = folder_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _upsert_image(self, filename, geo_info, width=None, height=None, source_mtime_ns=None):
+        values = {column: _to_float(geo_info.get(key)) for column, key in GEO_COLUMNS.items()}
+        self._conn.execute(
+            """INSERT INTO images (filename, latitude, longitude, altitude, gimbal_roll, gimbal_pitch, gimbal_yaw,
+                                   width, height, source_mtime_ns, updated_at)
+               VALUES (:filename, :latitude, :longitude, :altitude, :gimbal_roll, :gimbal_pitch, :gimbal_yaw,
+                       :width, :height, :source_mtime_ns, :updated_at)
+               ON CONFLICT(filename) DO UPDATE SET
+                   latitude=excluded.latitude, longitude=excluded.longitude, altitude=excluded.altitude,
+                   gimbal_roll=excluded.gimbal_roll, gimbal_pitch=excluded.gimbal_pitch, gimbal_yaw=excluded.gimbal_yaw,
+                   width=COALESCE(excluded.width, images.width), height=COALESCE(excluded.height, images.height),
+                   source_mtime_ns=COALESCE(excluded.source_mtime_ns, images.source_mtime_ns),
+                   updated_at=excluded.updated_at""",
+            dict(values, filename=filename, width=width, height=height, source_mtime_ns=source_mtime_ns,
+                 updated_at=time.strftime("%Y-%m-%d %H:%M:%S")))
+
+    def _replace_points(self, filename, coordinates):
+        self._conn.execute('DELETE FROM points WHERE filename = ?', (filename,))
+        rows = []
+        for seq, coord in enumerate(c for c in coordinates if c is not None):
+            target = coord[2] if len(coord) >= 3 else None
+            rows.append((filename, seq, target, float(coord[0]), float(coord[1])))
+        self._conn.executemany('INSERT INTO points (filename, seq, target, x, y) VALUES (?, ?, ?, ?, ?)', rows)
+
+    def _add_rectangle(self, filename, rectangle):
+        self._conn.execute(
+            'INSERT OR IGNORE INTO rectangles (id, filename, corners, timestamp) VALUES (?, ?, ?, ?)',
+            (rectangle.get('id') or f"{filename}:{rectangle.get('timestamp')}:{json.dumps(rectangle.get('corners'))}",
+             filename, json.dumps(rectangle.get('corners')), rectangle.get('timestamp')))
+
+    def save_points(self, filename, geo_info, coordinates):
+        """
+        保存坐标时的增量更新：更新图像元数据并替换该图像的全部靶标点，第一次保存该图像时补充图像尺寸
+        已从文件同步过的图像同时更新来源文件修改时间，之后的全量同步可以跳过它；尚未同步过的图像不记录，
+        全量同步时仍会读取其矩形文件
+        :param filename: 图像文件名
+        :param geo_info: 地理信息字典
+        :param coordinates: (x, y) 或 (x, y, target_number) 元组或 None 的列表
+        """
+        width = height = mtime_ns = None
+        if self.folder_path:
+            with self._lock:
+                row = self._conn.execute('SELECT width, source_mtime_ns FROM images WHERE filename = ?',
+                                         (filename,)).fetchone()
+            if row is None or row[0] is None:
+                with Image.open(os.path.join(self.folder_path, filename)) as img:
+                    width, height = img.size
+            if row is not None and row[1] is not None:
+                mtime_ns = source_mtime_ns(self.folder_path, filename)
+        with self._lock, self._conn:
+            self._upsert_image(filename, geo_info, width, height, mtime_ns)
+            self._replace_points(filename, coordinates)
+
+    def add_rectangle(self, filename, rectangle):
+        """
+        保存矩形时的增量更新
+        :param filename: 图像文件名
+        :param rectangle: 矩形记录字典（含 id、corners、timestamp）
+        """
+        with self._lock, self._conn:
+            self._add_rectangle(filename, rectangle)
+
+    def folder_synced(self):
+        """是否已从整个文件夹全量同步过（之前只有增量更新的记录时，导出会缺少其他图像已有的标注）"""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta WHERE key = 'folder_synced'").fetchone() is not None
+
+    def sync_files(self, folder_path, image_files, metadata_cache):
+        """
+        从TXT/JSON文件同步指定的图像，TXT和矩形文件都未修改过的图像会被跳过
+        :param folder_path: 图像文件夹路径
+        :param image_files: 图像文件名列表
+        :param metadata_cache: MetadataCache 实例
+        :return: 实际更新的图像数量
+        """
+        with self._lock:
+            known = dict(self._conn.execute('SELECT filename, source_mtime_ns FROM images'))
+        updated = 0
+        for image_filename in image_files:
+            image_path = os.path.join(folder_path, image_filename)
+            txt_path = os.path.join(folder_path, f"{os.path.splitext(image_filename)[0]}.txt")
+            mtime_ns = source_mtime_ns(folder_path, image_filename)
+            if image_filename in known and known[image_filename] == mtime_ns:
+                continue
+            coordinates = read_text_file(txt_path)[1] if os.path.exists(txt_path) else [None]
+            rectangles = rectangle_log.read_rectangles(image_path)
+            geo_info = metadata_cache.get(image_filename)
+            with Image.open(image_path) as img:
+                width, height = img.size
+            with self._lock, self._conn:
+                self._upsert_image(image_filename, geo_info, width, height, mtime_ns)
+                self._replace_points(image_filename, coordinates)
+                self._conn.execute('DELETE FROM rectangles WHERE filename = ?', (image_filename,))
+                for rectangle in rectangles:
+                    if isinstance(rectangle, dict):
+                        self._add_rectangle(image_filename, rectangle)
+            updated += 1
+        return updated
+
+    def sync_folder(self, folder_path, image_files, metadata_cache):
+        """
+        从TXT/JSON文件全量同步，并删除文件夹中已不存在的图像；每张图像都要检查文件修改时间，
+        图像较多时较慢，只在显式同步或数据库为空时使用
+        :param folder_path: 图像文件夹路径
+        :param image_files: 文件夹中全部图像文件名列表
+        :param metadata_cache: MetadataCache 实例
+        :return: 实际更新的图像数量
+        """
+        updated = self.sync_files(folder_path, image_files, metadata_cache)
+        with self._lock:
+            known = [row[0] for row in self._conn.execute('SELECT filename FROM images')]
+        existing = set(image_files)
+        stale = [name for name in known if name not in existing]
+        with self._lock, self._conn:
+            for table in ('images', 'points', 'rectangles'):
+                self._conn.executemany(f'DELETE FROM {table} WHERE filename = ?', [(name,) for name in stale])
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('folder_synced', ?)",
+                               (time.strftime("%Y-%m-%d %H:%M:%S"),))
+        return updated
+
+    def query(self, sql, params=()):
+        """执行只读查询，返回行列表"""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def target_centers(self, target):
+        """
+        返回每张标注了该靶标的图像中靶标点的中心
+        :param target: 靶标编号
+        :return: {文件名: (x, y)}
+        """
+        rows = self.query('SELECT filename, AVG(x), AVG(y) FROM points WHERE target = ? GROUP BY filename', (target,))
+        return {filename: (x, y) for filename, x, y in rows}
+
+    def export_csv(self, output):
+        """
+        导出为CSV，每个靶标点一行，附带图像的GPS和云台信息
+        :param output: 文本文件对象
+        """
+        rows = self.query(
+            """SELECT i.filename, p.target, p.x, p.y, i.latitude, i.longitude, i.altitude,
+                      i.gimbal_roll, i.gimbal_pitch, i.gimbal_yaw
+               FROM points p JOIN images i ON i.filename = p.filename
+               ORDER BY i.filename, p.seq""")
+        writer = csv.writer(output)
+        writer.writerow(['filename', 'target', 'x', 'y', 'latitude', 'longitude', 'altitude',
+                         'gimbal_roll', 'gimbal_pitch', 'gimbal_yaw'])
+        writer.writerows(rows)
+
+    def export_coco(self):
+        """
+        导出为COCO风格的关键点标注：每张图像中每个靶标编号对应一条标注
+        :return: 可直接 json.dump 的字典
+        """
+        images = self.query(
+            """SELECT filename, width, height, latitude, longitude, altitude, gimbal_roll, gimbal_pitch, gimbal_yaw
+               FROM images ORDER BY filename""")
+        image_ids = {}
+        coco_images = []
+        for image_id, row in enumerate(images, start=1):
+            image_ids[row[0]] = image_id
+            coco_images.append({
+                'id': image_id, 'file_name': row[0], 'width': row[1], 'height': row[2],
+                'latitude': row[3], 'longitude': row[4], 'altitude': row[5],
+                'gimbal_roll': row[6], 'gimbal_pitch': row[7], 'gimbal_yaw': row[8]
+            })
+        grouped = {}
+        for filename, target, x, y in self.query('SELECT filename, target, x, y FROM points ORDER BY filename, seq'):
+            grouped.setdefault((filename, target or 0), []).append((x, y))
+        annotations = []
+        for annotation_id, ((filename, target), points) in enumerate(sorted(grouped.items()), start=1):
+            keypoints = []
+            for x, y in points:
+                keypoints.extend([x, y, 2])
+            xs = [p[0] for p in points]
+            ys = [p[1] for p in points]
+            annotations.append({
+                'id': annotation_id, 'image_id': image_ids[filename], 'category_id': target,
+                'keypoints': keypoints, 'num_keypoints': len(points),
+                'bbox': [min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)]
+            })
+        categories = [{'id': target, 'name': f'靶标 {target}' if target else '未编号'}
+                      for target in sorted({key[1] for key in grouped})]
+        return {'images': coco_images, 'annotations': annotations, 'categories': categories}
+
+
+def open_folder_db(folder_path, cache_dir=None):
+    """打开文件夹对应的标注数据库（.label_cache/annotations.sqlite）"""
+    cache_dir = cache_dir or os.path.join(folder_path, CACHE_DIRNAME)
+    return AnnotationDB(os.path.join(cache_dir, DB_FILENAME), folder_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="将图像文件夹的标注同步到SQLite数据库并导出")
+    parser.add_argument('folder', help="图像文件夹路径")
+    parser.add_argument('--csv', help="导出CSV文件路径")
+    parser.add_argument('--coco', help="导出COCO格式JSON文件路径")
+    args = parser.parse_args()
+    if not os.path.isdir(args.folder):
+        print(f"Error: 未找到图像文件夹 '{args.folder}'")
+        sys.exit(1)
+    cache_dir = os.path.join(args.folder, CACHE_DIRNAME)
+    db = open_folder_db(args.folder, cache_dir)
+    image_files = FolderIndex(args.folder, IMAGE_EXTENSIONS, cache_dir=cache_dir).files()
+    updated = db.sync_folder(args.folder, image_files, MetadataCache(args.folder, cache_dir=cache_dir))
+    print(f"已同步 {updated} 张图像的标注到 {db.db_path}")
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8-sig', newline='') as f:
+            db.export_csv(f)
+        print(f"已导出CSV: {args.csv}")
+    if args.coco:
+        with open(args.coco, 'w', encoding='utf-8') as f:
+            json.dump(db.export_coco(), f, ensure_ascii=False)
+        print(f"已导出COCO JSON: {args.coco}")
+    db.close()
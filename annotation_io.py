@@ -0,0 +1,246 @@
+import os
+import io
+import re
+import logging
+import threading
+from itertools import islice
+
+ENCODING_SNIFF_BYTES = 4096  # 非UTF-8文件只用前4KB检测编码
+
+logger = logging.getLogger(__name__)
+
+_parsed_cache = {}
+_parsed_cache_lock = threading.Lock()
+
+def decode_text(raw):
+    """
+    解码文本文件内容：优先按UTF-8解码（本程序写入的文件都是UTF-8），失败时只用开头一小段检测编码
+    :param raw: 文件的原始字节
+    :return: 解码后的字符串
+    """
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        import chardet  # 只有非UTF-8的旧文件才需要编码检测
+        detector = chardet.detect(raw[:ENCODING_SNIFF_BYTES])
+        encoding = detector['encoding'] if detector['encoding'] else 'utf-8'
+        try:
+            return raw.decode(encoding, errors='replace')
+        except LookupError:
+            return raw.decode('utf-8', errors='replace')
+
+def parse_text_lines(lines):
+    """
+    将文本行拆分为前8行头部和坐标列表
+    :param lines: 文本行列表（保留换行符）
+    :return: (header_lines, coordinates_list)
+    """
+    header = lines[:8]
+    valid_coordinates = []
+    for line in islice(lines, 8, None):
+        coord = parse_coordinate_line(line.strip())
+        if coord is not None:
+            valid_coordinates.append(coord)
+    coordinates = valid_coordinates if valid_coordinates else [None]
+    return header, coordinates
+
+def _cache_parsed(txt_file_path, header, coordinates):
+    try:
+        stat = os.stat(txt_file_path)
+    except OSError:
+        return
+    with _parsed_cache_lock:
+        _parsed_cache[txt_file_path] = (stat.st_mtime_ns, stat.st_size, header, coordinates)
+
+def read_text_file(txt_file_path):
+    """
+    读取文本文件，返回前8行和坐标列表
+    解析结果按文件修改时间和大小缓存在内存中，文件未变化时不再读取磁盘
+    :param txt_file_path: 文本文件的完整路径
+    :return: (header_lines, coordinates_list)
+    """
+    try:
+        stat = os.stat(txt_file_path)
+        cached = _parsed_cache.get(txt_file_path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return list(cached[2]), list(cached[3])
+        with open(txt_file_path, 'rb') as raw_file:
+            raw = raw_file.read()
+        # 与文本模式读取一致：统一换行符为 \n
+        header, coordinates = parse_text_lines(io.StringIO(decode_text(raw), newline=None).readlines())
+    except FileNotFoundError:
+        logger.debug("未找到文本文件: %s，返回空数据", txt_file_path)
+        return [], [None]
+    except Exception as e:
+        logger.error("读取文本文件 %s 时出错: %s", txt_file_path, e)
+        return [], [None]
+
+    with _parsed_cache_lock:
+        _parsed_cache[txt_file_path] = (stat.st_mtime_ns, stat.st_size, header, coordinates)
+    return list(header), list(coordinates)
+
+def format_text_file(header, coordinates):
+    """
+    生成文本文件内容
+    :param header: 包含前8行的字符串列表
+    :param coordinates: (x, y) 或 (x, y, target_number) 元组或 None 的列表
+    :return: 文件内容字符串
+    """
+    lines = list(header)
+    valid_coords_to_write = [coord for coord in coordinates if coord is not None]
+    if not valid_coords_to_write:
+        lines.append("x none y none\n")
+    else:
+        for coord in valid_coords_to_write:
+            if len(coord) >= 3:
+                lines.append(f"靶标 {coord[2]}: x {coord[0]} y {coord[1]}\n")
+            else:
+                lines.append(f"x {coord[0]} y {coord[1]}\n")
+    return ''.join(lines)
+
+def write_text_file(txt_file_path, header, coordinates):
+    """
+    将头部信息和坐标列表写入文本文件
+    先写入同目录下的临时文件再重命名替换，写入中途崩溃不会留下不完整的文件
+    :param txt_file_path: 文本文件的完整路径
+    :param header: 包含前8行的字符串列表
+    :param coordinates: (x, y) 或 (x, y, target_number) 元组或 None 的列表
+    :return: 写入成功时返回True
+    """
+    tmp_path = f"{txt_file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        content = format_text_file(header, coordinates)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, txt_file_path)
+        # 直接用写入的内容更新解析缓存，下一次读取无需访问磁盘
+        parsed_header, parsed_coordinates = parse_text_lines(io.StringIO(content, newline=None).readlines())
+        _cache_parsed(txt_file_path, parsed_header, parsed_coordinates)
+        return True
+    except Exception as e:
+        logger.error("写入文本文件 %s 时出错: %s", txt_file_path, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+def parse_number(value):
+    """
+    解析坐标数值：整数保持为int，角点检测得到的亚像素坐标解析为float
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+def parse_coordinate_line(line):
+    """
+    解析坐标字符串行，如 "x 123 y 456 target 1" 或 "x none y none"
+    :return: (x, y, target_number) 元组，或如果行表示 '无注释' 或解析失败则返回 None
+    """
+    parts = line.strip().split()
+    if len(parts) >= 4 and parts[2] == "x" and parts[4] == "y":
+        x_val = parts[3].lower()
+        y_val = parts[5].lower()
+        if x_val == "none" and y_val == "none":
+            return None
+        try:
+            x = parse_number(x_val)
+            y = parse_number(y_val)
+            target_number = None
+            if len(parts) >= 6:
+                try:
+                    target_number = int(re.findall(r'\d+', parts[1])[0])
+                except ValueError:
+                    logger.debug("坐标行中靶标号码格式无效: %s", line.strip())
+            if target_number is not None:
+                return (x, y, target_number)
+            else:
+                return (x, y)
+        except ValueError:
+            logger.debug("坐标行中数字格式无效: %s", line.strip())
+            return None
+    return None
+
+
+def build_header(image_filename, geo_info):
+    """
+    根据图像的地理信息生成TXT文件头部
+    :param image_filename: 图像文件名
+    :param geo_info: extract_geo_info 返回的字典
+    :return: 头部行列表
+    """
+    return [
+        f"Filename: {image_filename}\n",
+        f"Latitude: {geo_info['Latitude'] if geo_info['Latitude'] is not None else 'N/A'}\n",
+        f"Longitude: {geo_info['Longitude'] if geo_info['Longitude'] is not None else 'N/A'}\n",
+        f"Altitude: {geo_info['Altitude'] if geo_info['Altitude'] is not None else 'N/A'} meters\n",
+        "Gimbal Orientation:\n",
+        f"  Roll:  {geo_info['GimbalRoll'] if geo_info['GimbalRoll'] is not None else 'N/A'}°\n",
+        f"  Pitch: {geo_info['GimbalPitch'] if geo_info['GimbalPitch'] is not None else 'N/A'}°\n",
+        f"  Yaw:   {geo_info['GimbalYaw'] if geo_info['GimbalYaw'] is not None else 'N/A'}°\n",
+        "\n"
+    ]
+
+def ensure_text_header(txt_path, image_filename, geo_info):
+    """
+    TXT文件不存在、为空或头部不足8行时，写入地理信息头部并保留已有坐标
+    :param txt_path: 文本文件的完整路径
+    :param image_filename: 图像文件名
+    :param geo_info: extract_geo_info 返回的字典
+    :return: 是否写入了新的头部
+    """
+    if os.path.exists(txt_path) and os.path.getsize(txt_path) > 0:
+        header, coordinates = read_text_file(txt_path)
+        if len(header) >= 8:
+            return False
+    else:
+        coordinates = [None]
+    write_text_file(txt_path, build_header(image_filename, geo_info), coordinates)
+    return True
+
+def _resolve_point(coordinates, op):
+    """按 index（列表位置）或 target + point（该靶标的第几个点）定位要修改的点"""
+    if op.get('index') is not None:
+        position = int(op['index'])
+        if not 0 <= position < len(coordinates):
+            raise ValueError(f"坐标索引 {position} 超出范围")
+        return position
+    if op.get('target') is None:
+        raise ValueError(f"操作 {op.get('op')} 需要 index 或 target")
+    positions = [i for i, coord in enumerate(coordinates) if len(coord) >= 3 and coord[2] == int(op['target'])]
+    point = int(op.get('point', 0))
+    if not 0 <= point < len(positions):
+        raise ValueError(f"靶标 {op['target']} 没有第 {point} 个点")
+    return positions[point]
+
+def apply_coordinate_ops(coordinates, ops):
+    """
+    对坐标列表依次应用增量修改操作
+    支持的操作:
+        {'op': 'add', 'x', 'y', 'target'}                        追加一个点
+        {'op': 'move', 'x', 'y', 'index' 或 'target' [+ 'point']}  移动一个点
+        {'op': 'delete', 'index' 或 'target' [+ 'point']}          删除一个点；只给 target 时删除该靶标的所有点
+        {'op': 'clear'}                                          删除所有点
+    :param coordinates: (x, y) 或 (x, y, target_number) 元组或 None 的列表
+    :param ops: 操作字典列表
+    :return: 新的坐标列表，没有点时为 [None]
+    """
+    result = [tuple(coord) for coord in coordinates if coord is not None]
+    for op in ops:
+        kind = op.get('op')
+        if kind == 'add':
+            point = (parse_number(str(op['x'])), parse_number(str(op['y'])))
+            result.append(point + (int(op['target']),) if op.get('target') is not None else point)
+        elif kind == 'move':
+            position = _resolve_point(result, op)
+            result[position] = (parse_number(str(op['x'])), parse_number(str(op['y']))) + tuple(result[position][2:])
+        elif kind == 'delete':
+            if op.get('index') is None and op.get('point') is None and op.get('target') is not None:
+                result = [coord for coord in result if not (len(coord) >= 3 and coord[2] == int(op['target']))]
+            else:
+                del result[_resolve_point(result, op)]
+        elif kind == 'clear':
+            result = []
+        else:
+            raise ValueError(f"未知的坐标操作: {kind}")
+    return result if result else [None]
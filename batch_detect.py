@@ -0,0 +1,405 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import get_cheese_point as gp
+from folder_index import FolderIndex, IMAGE_EXTENSIONS, CACHE_DIRNAME
+from image_meta import MetadataCache
+from annotation_io import read_text_file, write_text_file, build_header
+from undistort import undistort_roi, undistort_image
+from file_lock import locked_file
+import rectangle_log
+from PIL import Image
+from batch_ingest import build_flight_table
+from annotation_db import open_folder_db
+from geo_projection import localize_target
+from propagate import propagate_sequence, SEARCH_RADIUS
+
+REPORT_FILENAME = 'batch_detect_report.csv'
+PROPAGATE_REPORT_FILENAME = 'propagate_report.csv'
+SCAN_REPORT_FILENAME = 'scan_detect_report.csv'
+MAX_TARGET_NUMBER = 9  # 自动分配的最大靶标编号（与标注界面允许输入的范围一致）
+ROI_MARGIN = 64
+
+logger = logging.getLogger(__name__)
+
+
+def infer_target(corners, coordinates):
+    """
+    为没有记录靶标编号的旧矩形推断编号：取TXT中落在矩形内的已有点的编号
+    :param corners: 矩形四个角点
+    :param coordinates: read_text_file 返回的坐标列表
+    :return: 靶标编号，无法推断时返回None
+    """
+    points = np.asarray(corners, dtype=np.float64)
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    for coord in coordinates:
+        if coord is not None and len(coord) >= 3 and x0 <= coord[0] <= x1 and y0 <= coord[1] <= y1:
+            return coord[2]
+    return None
+
+
+def assign_targets(boards, coordinates, max_target=MAX_TARGET_NUMBER):
+    """
+    为整幅图像检测到的靶标分配编号：候选区域内有TXT中已标注的点时沿用该点的编号，
+    其余靶标按从上到下、从左到右的顺序依次使用未被占用的最小编号
+    :param boards: get_cheese_point.detect_all_boards 返回的列表
+    :param coordinates: read_text_file 返回的坐标列表
+    :param max_target: 最大靶标编号
+    :return: [(靶标编号, 角点列表)]，编号用完时编号为None
+    """
+    used = set()
+    assigned = []
+    for board in boards:
+        target = infer_target(board['region'], coordinates)
+        target = int(target) if target is not None and int(target) not in used else None
+        if target is not None:
+            used.add(target)
+        assigned.append([target, board['points']])
+    taken = used | {int(coord[2]) for coord in coordinates if coord is not None and len(coord) >= 3}
+    free = (n for n in range(1, max_target + 1) if n not in taken)
+    for item in assigned:
+        if item[0] is None:
+            item[0] = next(free, None)
+    return [tuple(item) for item in assigned]
+
+
+def collect_jobs(folder_path, image_files, propagate=False):
+    """
+    从每张图像保存的矩形记录生成检测任务，同一靶标只取最新的矩形
+    :param folder_path: 图像文件夹路径
+    :param image_files: 图像文件名列表
+    :param propagate: 为True时，没有矩形的图像沿用前一张有矩形的图像的矩形
+    :return: (任务列表 [(文件名, [(靶标编号, 角点), ...])], 无法处理的记录列表)
+    """
+    jobs = []
+    skipped = []
+    previous_regions = None
+    for image_filename in image_files:
+        image_path = os.path.join(folder_path, image_filename)
+        base_name = os.path.splitext(image_filename)[0]
+        txt_path = os.path.join(folder_path, f"{base_name}.txt")
+        rectangles = rectangle_log.read_rectangles(image_path)
+        regions = {}
+        coordinates = None
+        for rectangle in rectangles:
+            if not isinstance(rectangle, dict) or not rectangle.get('corners'):
+                continue
+            target = rectangle.get('target')
+            if target is None:
+                if coordinates is None:
+                    coordinates = read_text_file(txt_path)[1] if os.path.exists(txt_path) else [None]
+                target = infer_target(rectangle['corners'], coordinates)
+            if target is None:
+                skipped.append((image_filename, None, '矩形没有靶标编号且无法从TXT推断'))
+                continue
+            regions[int(target)] = rectangle['corners']
+        if regions:
+            previous_regions = regions
+        elif propagate and previous_regions:
+            regions = dict(previous_regions)
+        if regions:
+            jobs.append((image_filename, sorted(regions.items())))
+    return jobs, skipped
+
+
+def _detect_image(task):
+    """
+    工作进程：读取图像，对每个矩形做局部去畸变 + 棋盘格角点检测
+    :param task: (文件夹路径, 图像文件名, [(靶标编号, 角点), ...], ROI边距, 是否抑制背景)
+    :return: (图像文件名, [(靶标编号, 检测到的点列表或None, 错误信息或None), ...])
+    """
+    folder_path, image_filename, regions, margin, suppress_background = task
+    img = cv2.imread(os.path.join(folder_path, image_filename))
+    if img is None:
+        return image_filename, [(target, None, '无法读取图像') for target, _ in regions]
+    results = []
+    for target, corners in regions:
+        try:
+            roi_img, (x0, y0) = undistort_roi(img, gp.cam_matrix, gp.dist_coeffs, corners, margin)
+            local_corners = [[x - x0, y - y0] for x, y in corners]
+            points = gp.auto_detect_corners(roi_img, local_corners, suppress_background=suppress_background) \
+                + np.array([x0, y0], dtype=np.float32)
+            results.append((target, points.tolist(), None))
+        except Exception as e:
+            results.append((target, None, str(e) or type(e).__name__))
+    return image_filename, results
+
+
+def _scan_image(task):
+    """
+    工作进程：读取图像，对整幅图像去畸变后一次检测所有靶标
+    :param task: (文件夹路径, 图像文件名)
+    :return: (图像文件名, detect_all_boards 返回的列表或None, 错误信息或None)
+    """
+    folder_path, image_filename = task
+    img = cv2.imread(os.path.join(folder_path, image_filename))
+    if img is None:
+        return image_filename, None, '无法读取图像'
+    try:
+        undistorted = undistort_image(img, gp.cam_matrix, gp.dist_coeffs)
+        return image_filename, gp.detect_all_boards(undistorted, workers=1), None
+    except Exception as e:
+        return image_filename, None, str(e) or type(e).__name__
+
+
+def write_detected_points(folder_path, image_filename, detected, metadata_cache, lock_dir=None):
+    """
+    将检测结果写回TXT：替换对应靶标编号的旧点，保留其他靶标的点
+    :param detected: {靶标编号: 点列表}
+    """
+    base_name = os.path.splitext(image_filename)[0]
+    txt_path = os.path.join(folder_path, f"{base_name}.txt")
+    with locked_file(txt_path, lock_dir):
+        header, coordinates = read_text_file(txt_path) if os.path.exists(txt_path) else ([], [None])
+        if len(header) < 8:
+            header = build_header(image_filename, metadata_cache.get(image_filename))
+        kept = [coord for coord in coordinates
+                if coord is not None and not (len(coord) >= 3 and coord[2] in detected)]
+        for target, points in sorted(detected.items()):
+            kept.extend((x, y, target) for x, y in points)
+        write_text_file(txt_path, header, kept if kept else [None])
+
+
+def _run_detection_pool(folder_path, jobs, workers, dry_run, metadata_cache, cache_dir, report,
+                        suppress_background=False):
+    """
+    在进程池中执行检测任务，写回TXT并把结果追加到报告
+    :param jobs: [(文件名, [(靶标编号, 角点), ...])]
+    :param suppress_background: 检测前是否把区域内的背景替换为绿色
+    :return: {文件名: {靶标编号: 点列表}} 检测成功的结果
+    """
+    detected_all = {}
+    tasks = [(folder_path, name, regions, ROI_MARGIN, suppress_background) for name, regions in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for image_filename, results in executor.map(_detect_image, tasks):
+            detected = {target: points for target, points, error in results if points is not None}
+            for target, points, error in results:
+                if points is not None:
+                    report.append((image_filename, target, 'ok', f'{len(points)} 个点'))
+                else:
+                    report.append((image_filename, target, 'failed', error))
+            if detected:
+                detected_all[image_filename] = detected
+                if not dry_run:
+                    write_detected_points(folder_path, image_filename, detected, metadata_cache,
+                                          os.path.join(cache_dir, 'locks'))
+    return detected_all
+
+
+def _write_report(cache_dir, report, report_filename=REPORT_FILENAME):
+    """将报告行写入缓存目录下的CSV文件，返回文件路径"""
+    os.makedirs(cache_dir, exist_ok=True)
+    report_path = os.path.join(cache_dir, report_filename)
+    with open(report_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['filename', 'target', 'status', 'detail'])
+        writer.writerows(report)
+    return report_path
+
+
+def run_batch_detection(folder_path, workers=None, propagate=False, dry_run=False, cache_dir=None,
+                        suppress_background=False):
+    """
+    用进程池对文件夹中所有保存过矩形的图像批量检测角点并写回TXT
+    :param folder_path: 图像文件夹路径
+    :param workers: 进程数，默认使用全部CPU核心
+    :param propagate: 没有矩形的图像是否沿用前一张图像的矩形
+    :param dry_run: 为True时只检测不写回TXT
+    :param cache_dir: 缓存目录，默认为 文件夹/.label_cache
+    :param suppress_background: 检测前是否把区域内的背景替换为绿色
+    :return: 报告行列表 [(文件名, 靶标编号, 状态, 说明)]
+    """
+    start_time = time.perf_counter()
+    cache_dir = cache_dir or os.path.join(folder_path, CACHE_DIRNAME)
+    image_files = FolderIndex(folder_path, IMAGE_EXTENSIONS, cache_dir=cache_dir).files()
+    metadata_cache = MetadataCache(folder_path, cache_dir=cache_dir)
+    jobs, skipped = collect_jobs(folder_path, image_files, propagate)
+    report = [(name, target, 'skipped', reason) for name, target, reason in skipped]
+
+    _run_detection_pool(folder_path, jobs, workers, dry_run, metadata_cache, cache_dir, report, suppress_background)
+    report_path = _write_report(cache_dir, report)
+    ok_count = sum(1 for row in report if row[2] == 'ok')
+    elapsed = time.perf_counter() - start_time
+    logger.info("批量角点检测完成: %s 张图像，成功 %s 个靶标，失败/跳过 %s 个，用时 %.2f 秒，报告保存到 %s",
+                len(jobs), ok_count, len(report) - ok_count, elapsed, report_path)
+    return report
+
+
+def run_scan_detection(folder_path, workers=None, dry_run=False, cache_dir=None):
+    """
+    不使用保存的矩形，对文件夹中每张图像扫描整幅图像检测所有靶标并自动分配编号后写回TXT
+    :param folder_path: 图像文件夹路径
+    :param workers: 进程数，默认使用全部CPU核心
+    :param dry_run: 为True时只检测不写回TXT
+    :param cache_dir: 缓存目录，默认为 文件夹/.label_cache
+    :return: 报告行列表 [(文件名, 靶标编号, 状态, 说明)]
+    """
+    start_time = time.perf_counter()
+    cache_dir = cache_dir or os.path.join(folder_path, CACHE_DIRNAME)
+    image_files = FolderIndex(folder_path, IMAGE_EXTENSIONS, cache_dir=cache_dir).files()
+    metadata_cache = MetadataCache(folder_path, cache_dir=cache_dir)
+    report = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for image_filename, boards, error in executor.map(_scan_image, [(folder_path, name) for name in image_files]):
+            if boards is None:
+                report.append((image_filename, None, 'failed', error))
+                continue
+            txt_path = os.path.join(folder_path, f"{os.path.splitext(image_filename)[0]}.txt")
+            coordinates = read_text_file(txt_path)[1] if os.path.exists(txt_path) else [None]
+            detected = {}
+            for target, points in assign_targets(boards, coordinates):
+                if target is None:
+                    report.append((image_filename, None, 'skipped', f'靶标编号已用完（最大 {MAX_TARGET_NUMBER}）'))
+                    continue
+                detected[target] = points
+                report.append((image_filename, target, 'ok', f'{len(points)} 个点'))
+            if detected and not dry_run:
+                write_detected_points(folder_path, image_filename, detected, metadata_cache,
+                                      os.path.join(cache_dir, 'locks'))
+    report_path = _write_report(cache_dir, report, SCAN_REPORT_FILENAME)
+    ok_count = sum(1 for row in report if row[2] == 'ok')
+    elapsed = time.perf_counter() - start_time
+    logger.info("整幅图像靶标检测完成: %s 张图像，检测到 %s 个靶标，用时 %.2f 秒，报告保存到 %s",
+                len(image_files), ok_count, elapsed, report_path)
+    return report
+
+
+def run_localized_detection(folder_path, target, workers=None, dry_run=False, ground_altitude=None,
+                            detect=True, cam_matrix=gp.cam_matrix, cache_dir=None, metadata_cache=None):
+    """
+    由已标注帧中的靶标位置和每帧的GPS/云台姿态，把靶标投影到整次飞行的其他帧中，
+    只在投影得到的搜索区域内检测角点，不需要手动画矩形
+    :param folder_path: 图像文件夹路径
+    :param target: 靶标编号
+    :param workers: 进程数，默认使用全部CPU核心
+    :param dry_run: 为True时只检测不写回TXT
+    :param ground_altitude: 地面海拔高度（米），只有一帧标注时必需
+    :param detect: 为False时只计算搜索区域，不检测角点
+    :param cam_matrix: 相机内参矩阵
+    :param cache_dir: 缓存目录，默认为 文件夹/.label_cache
+    :param metadata_cache: 可复用的 MetadataCache 实例
+    :return: {'target_position', 'proposals', 'detected', 'report'}
+    """
+    start_time = time.perf_counter()
+    cache_dir = cache_dir or os.path.join(folder_path, CACHE_DIRNAME)
+    image_files = FolderIndex(folder_path, IMAGE_EXTENSIONS, cache_dir=cache_dir).files()
+    metadata_cache = metadata_cache or MetadataCache(folder_path, cache_dir=cache_dir)
+    db = open_folder_db(folder_path, cache_dir)
+    try:
+        db.sync_folder(folder_path, image_files, metadata_cache)
+        observations = db.target_centers(target)
+    finally:
+        db.close()
+    if not observations:
+        raise ValueError(f"还没有任何图像标注了靶标 {target}")
+
+    flight = build_flight_table(image_files, [metadata_cache.get(name) for name in image_files])
+    with Image.open(os.path.join(folder_path, image_files[0])) as img:
+        image_size = img.size
+    position, proposals = localize_target(flight, observations, cam_matrix, image_size, ground_altitude)
+
+    jobs = []
+    for proposal in proposals:
+        if proposal['filename'] in observations:
+            continue
+        x0, y0, x1, y1 = proposal['roi']
+        jobs.append((proposal['filename'], [(target, [[x0, y0], [x1, y0], [x1, y1], [x0, y1]])]))
+    report = []
+    detected = {}
+    if not detect:
+        return {'target_position': position.tolist(), 'proposals': proposals, 'detected': detected, 'report': report}
+    detected = _run_detection_pool(folder_path, jobs, workers, dry_run, metadata_cache, cache_dir, report)
+    report_path = _write_report(cache_dir, report, f'localize_target_{target}_report.csv')
+    ok_count = sum(1 for row in report if row[2] == 'ok')
+    elapsed = time.perf_counter() - start_time
+    logger.info("靶标 %s 自动定位完成: 估计位置 %s，%s 帧可见，检测 %s 帧，成功 %s 帧，用时 %.2f 秒，报告保存到 %s",
+                target, np.round(position, 2).tolist(), len(proposals), len(jobs), ok_count, elapsed, report_path)
+    detected = {name: points[target] for name, points in detected.items()}
+    return {'target_position': position.tolist(), 'proposals': proposals, 'detected': detected, 'report': report}
+
+
+def run_propagation(folder_path, targets=None, start=0, overwrite=False, dry_run=False,
+                    search_radius=SEARCH_RADIUS, cache_dir=None):
+    """
+    从已标注的帧开始，按拍摄顺序把靶标角点逐帧跟踪到后续帧，用棋盘格检测验证后写回TXT
+    后一帧依赖前一帧的结果，因此按顺序处理；每帧图像只解码一次，供该帧的所有靶标共用
+    :param folder_path: 图像文件夹路径
+    :param targets: 只传播这些编号的靶标，None表示全部
+    :param start: 从图像列表中的第几张开始
+    :param overwrite: 是否覆盖已标注的同编号靶标
+    :param dry_run: 为True时只跟踪不写回TXT
+    :param search_radius: 相邻帧之间的搜索半径（像素）
+    :param cache_dir: 缓存目录，默认为 文件夹/.label_cache
+    :return: 报告行列表 [(文件名, 靶标编号, 状态, 说明)]
+    """
+    start_time = time.perf_counter()
+    cache_dir = cache_dir or os.path.join(folder_path, CACHE_DIRNAME)
+    image_files = FolderIndex(folder_path, IMAGE_EXTENSIONS, cache_dir=cache_dir).files()[start:]
+    metadata_cache = MetadataCache(folder_path, cache_dir=cache_dir)
+
+    def load_points(image_filename):
+        txt_path = os.path.join(folder_path, f"{os.path.splitext(image_filename)[0]}.txt")
+        return read_text_file(txt_path)[1] if os.path.exists(txt_path) else [None]
+
+    def load_image(image_filename):
+        return cv2.imread(os.path.join(folder_path, image_filename))
+
+    report = []
+    for image_filename, detected, rows in propagate_sequence(image_files, load_image, load_points, targets,
+                                                             overwrite, search_radius):
+        report.extend(rows)
+        if detected and not dry_run:
+            write_detected_points(folder_path, image_filename, detected, metadata_cache,
+                                  os.path.join(cache_dir, 'locks'))
+    report_path = _write_report(cache_dir, report, PROPAGATE_REPORT_FILENAME)
+    ok_count = sum(1 for row in report if row[2] == 'ok')
+    elapsed = time.perf_counter() - start_time
+    logger.info("逐帧传播完成: %s 张图像，成功 %s 个靶标，失败 %s 个，用时 %.2f 秒，报告保存到 %s",
+                len(image_files), ok_count, len(report) - ok_count, elapsed, report_path)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="使用保存的矩形批量检测棋盘格角点并写回TXT")
+    parser.add_argument('folder', help="图像文件夹路径")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认使用全部CPU核心")
+    parser.add_argument('--propagate', action='store_true', help="没有矩形的图像沿用前一张图像的矩形")
+    parser.add_argument('--dry-run', action='store_true', help="只检测并生成报告，不写回TXT")
+    parser.add_argument('--suppress-background', action='store_true',
+                        help="检测角点前把矩形区域内的草地等背景替换为绿色")
+    parser.add_argument('--localize', type=int, metavar='TARGET',
+                        help="根据GPS/云台姿态把该编号的靶标投影到所有帧并自动检测，不使用保存的矩形")
+    parser.add_argument('--ground-altitude', type=float, default=None,
+                        help="地面海拔高度（米），--localize 只有一帧标注时需要")
+    parser.add_argument('--scan', action='store_true',
+                        help="不使用保存的矩形，扫描整幅图像检测所有靶标并自动分配编号")
+    parser.add_argument('--track', type=int, nargs='*', metavar='TARGET',
+                        help="从已标注的帧开始把靶标逐帧跟踪到后续帧（模板匹配+光流）并用棋盘格检测验证，"
+                             "可指定靶标编号，不指定时传播全部靶标")
+    parser.add_argument('--start', type=int, default=0, help="--track 从图像列表中的第几张开始")
+    parser.add_argument('--overwrite', action='store_true', help="--track 时覆盖已标注的同编号靶标")
+    parser.add_argument('--search-radius', type=int, default=SEARCH_RADIUS,
+                        help="--track 时相邻帧之间靶标的最大位移（像素）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if not os.path.isdir(args.folder):
+        print(f"Error: 未找到图像文件夹 '{args.folder}'")
+        sys.exit(1)
+    if args.scan:
+        run_scan_detection(args.folder, workers=args.workers, dry_run=args.dry_run)
+    elif args.track is not None:
+        run_propagation(args.folder, targets=args.track or None, start=args.start, overwrite=args.overwrite,
+                        dry_run=args.dry_run, search_radius=args.search_radius)
+    elif args.localize is not None:
+        run_localized_detection(args.folder, args.localize, workers=args.workers, dry_run=args.dry_run,
+                                ground_altitude=args.ground_altitude)
+    else:
+        run_batch_detection(args.folder, workers=args.workers, propagate=args.propagate, dry_run=args.dry_run,
+                            suppress_background=args.suppress_background)
@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from folder_index import FolderIndex, IMAGE_EXTENSIONS, CACHE_DIRNAME
+from image_meta import MetadataCache, extract_geo_info, GEO_KEYS
+from annotation_io import ensure_text_header
+
+FLIGHT_TABLE_FILENAME = 'flight_meta.npz'
+
+logger = logging.getLogger(__name__)
+
+
+def _ingest_one(task):
+    """
+    工作进程：解析单张图像的元数据（缓存未命中时）并补写缺失的TXT头部
+    :param task: (文件夹路径, 图像文件名, 缓存的地理信息或None, 是否写TXT头部)
+    :return: (图像文件名, 地理信息, 是否新解析, 是否写入TXT头部)
+    """
+    folder_path, image_filename, geo_info, write_headers = task
+    parsed = geo_info is None
+    if parsed:
+        geo_info = extract_geo_info(os.path.join(folder_path, image_filename))
+    wrote_header = False
+    if write_headers:
+        base_name = os.path.splitext(image_filename)[0]
+        txt_path = os.path.join(folder_path, f"{base_name}.txt")
+        wrote_header = ensure_text_header(txt_path, image_filename, geo_info)
+    return image_filename, geo_info, parsed, wrote_header
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def build_flight_table(image_files, geo_infos):
+    """
+    将逐张图像的地理信息转换为按列存储的数组，无法解析为数字的值记为NaN
+    :param image_files: 图像文件名列表
+    :param geo_infos: 与 image_files 对应的地理信息字典列表
+    :return: {'filename': 文件名数组, 列名: float64数组}
+    """
+    columns = {key: np.array([_to_float(g[key]) for g in geo_infos], dtype=np.float64) for key in GEO_KEYS}
+    columns['filename'] = np.array(image_files, dtype=np.str_)
+    return columns
+
+
+def save_flight_table(cache_dir, image_files, geo_infos):
+    """
+    将整次飞行的元数据按列保存为 .npz 文件
+    :param cache_dir: 缓存目录
+    :param image_files: 图像文件名列表
+    :param geo_infos: 与 image_files 对应的地理信息字典列表
+    :return: 保存的文件路径
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    table_path = os.path.join(cache_dir, FLIGHT_TABLE_FILENAME)
+    tmp_path = table_path + '.tmp.npz'
+    np.savez(tmp_path, **build_flight_table(image_files, geo_infos))
+    os.replace(tmp_path, table_path)
+    return table_path
+
+
+def load_flight_table(cache_dir):
+    """
+    读取按列保存的飞行元数据
+    :param cache_dir: 缓存目录
+    :return: {列名: numpy数组} 字典，文件不存在时返回None
+    """
+    table_path = os.path.join(cache_dir, FLIGHT_TABLE_FILENAME)
+    if not os.path.exists(table_path):
+        return None
+    with np.load(table_path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def ingest_folder(folder_path, workers=None, write_headers=True, cache_dir=None, metadata_cache=None):
+    """
+    使用进程池预先提取整个文件夹的GPS/云台信息，补写缺失的TXT头部，并生成按列存储的飞行元数据
+    :param folder_path: 图像文件夹路径
+    :param workers: 进程数，默认使用全部CPU核心
+    :param write_headers: 是否为缺失或不完整的TXT文件写入头部
+    :param cache_dir: 缓存目录，默认为 文件夹/.label_cache
+    :param metadata_cache: 可复用的 MetadataCache 实例
+    :return: 统计信息字典
+    """
+    start_time = time.perf_counter()
+    cache_dir = cache_dir or os.path.join(folder_path, CACHE_DIRNAME)
+    image_files = FolderIndex(folder_path, IMAGE_EXTENSIONS, cache_dir=cache_dir).files()
+    metadata_cache = metadata_cache or MetadataCache(folder_path, cache_dir=cache_dir)
+
+    tasks = [(folder_path, name, metadata_cache.lookup(name), write_headers) for name in image_files]
+    geo_by_name = {}
+    parsed_count = 0
+    header_count = 0
+    chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 8))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for image_filename, geo_info, parsed, wrote_header in executor.map(_ingest_one, tasks, chunksize=chunksize):
+            geo_by_name[image_filename] = geo_info
+            if parsed:
+                metadata_cache.store(image_filename, geo_info)
+                parsed_count += 1
+            header_count += wrote_header
+
+    table_path = save_flight_table(cache_dir, image_files, [geo_by_name[name] for name in image_files])
+    elapsed = time.perf_counter() - start_time
+    logger.info("元数据预处理完成: %s 张图像，新解析 %s 张，写入TXT头部 %s 个，用时 %.2f 秒，结果保存到 %s",
+                len(image_files), parsed_count, header_count, elapsed, table_path)
+    return {
+        'images': len(image_files),
+        'parsed': parsed_count,
+        'headers_written': header_count,
+        'seconds': elapsed,
+        'table_path': table_path
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="批量预处理图像文件夹的GPS/云台元数据")
+    parser.add_argument('folder', help="图像文件夹路径")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认使用全部CPU核心")
+    parser.add_argument('--no-headers', action='store_true', help="不写入缺失的TXT头部")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if not os.path.isdir(args.folder):
+        print(f"Error: 未找到图像文件夹 '{args.folder}'")
+        sys.exit(1)
+    ingest_folder(args.folder, workers=args.workers, write_headers=not args.no_headers)
@@ -0,0 +1,273 @@
+"""
+标注服务器和角点检测的基准测试
+
+生成带EXIF GPS、DJI XMP云台信息和棋盘格靶标的合成无人机图像（默认 5472x3648），
+通过 Flask 测试客户端测量各API的延迟和吞吐量，并直接测量 auto_detect_corners 的单次耗时。
+
+用法:
+    python benchmark.py                          # 在临时目录生成图像并运行
+    python benchmark.py --output result.json     # 保存结果
+    python benchmark.py --baseline result.json   # 与之前的结果比较，p50变慢超过容差时返回非零退出码
+"""
+import os
+import io
+import sys
+import json
+import time
+import struct
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import cv2
+from PIL import Image
+
+BOARD_SQUARES = 4      # 4x4棋盘格（3x3内角点）
+SQUARE_SIZE = 60       # 棋盘格方块边长（像素）
+TARGETS_PER_FRAME = 3  # 每张图像中的靶标数量
+RECT_MARGIN = 40       # 模拟手动框选时矩形比棋盘格外扩的像素数
+
+
+def _dji_xmp_segment(roll, pitch, yaw):
+    xmp = ('<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+           '<rdf:Description rdf:about="DJI Meta Data" xmlns:drone-dji="http://www.dji.com/drone-dji/1.0/"\n'
+           f'    drone-dji:GimbalRollDegree="{roll:+.2f}"\n'
+           f'    drone-dji:GimbalPitchDegree="{pitch:+.2f}"\n'
+           f'    drone-dji:GimbalYawDegree="{yaw:+.2f}"\n'
+           '    drone-dji:FlightYawDegree="+0.00">\n'
+           '</rdf:Description>\n</rdf:RDF></x:xmpmeta>\n')
+    payload = b'http://ns.adobe.com/xap/1.0/\x00' + xmp.encode('ascii')
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def _insert_after_app_segments(jpeg_bytes, segment):
+    """把一个APP段插入到JPEG已有的APP0/APP1段之后"""
+    pos = 2
+    while jpeg_bytes[pos:pos + 2] in (b'\xff\xe0', b'\xff\xe1'):
+        pos += 2 + struct.unpack('>H', jpeg_bytes[pos + 2:pos + 4])[0]
+    return jpeg_bytes[:pos] + segment + jpeg_bytes[pos:]
+
+
+def _to_dms(value):
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round(((value - degrees) * 60 - minutes) * 60, 4)
+    return (float(degrees), float(minutes), seconds)
+
+
+def generate_frame(path, frame_index, size, rng):
+    """
+    生成一张合成无人机图像
+    :param path: 输出JPEG路径
+    :param frame_index: 帧序号，用于生成沿航线变化的GPS和云台角
+    :param size: (宽, 高)
+    :param rng: numpy随机数生成器
+    :return: [(靶标编号, [[x0, y0], [x1, y1]])] 每个靶标对应的框选矩形
+    """
+    width, height = size
+    # 带噪声的草地背景，使JPEG大小和解码耗时接近真实航拍图像
+    small = rng.integers(60, 160, size=(height // 16, width // 16, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+    img[:, :, 1] = np.clip(img[:, :, 1].astype(np.int16) + 40, 0, 255).astype(np.uint8)
+    img = cv2.add(img, rng.integers(0, 20, size=img.shape, dtype=np.uint8))
+
+    board_size = BOARD_SQUARES * SQUARE_SIZE
+    rectangles = []
+    for target in range(1, TARGETS_PER_FRAME + 1):
+        x0 = int(width * target / (TARGETS_PER_FRAME + 1)) - board_size // 2 + 30 * frame_index
+        y0 = height // 2 - board_size // 2 + int(rng.integers(-height // 4, height // 4))
+        # 实际靶标印刷在白色底板上，棋盘格外留一圈白边
+        border = SQUARE_SIZE // 2
+        img[y0 - border:y0 + board_size + border, x0 - border:x0 + board_size + border] = 255
+        for row in range(BOARD_SQUARES):
+            for col in range(BOARD_SQUARES):
+                color = 255 if (row + col) % 2 == 0 else 0
+                img[y0 + row * SQUARE_SIZE:y0 + (row + 1) * SQUARE_SIZE,
+                    x0 + col * SQUARE_SIZE:x0 + (col + 1) * SQUARE_SIZE] = color
+        rectangles.append((target, [[x0 - RECT_MARGIN, y0 - RECT_MARGIN],
+                                    [x0 + board_size + RECT_MARGIN, y0 + board_size + RECT_MARGIN]]))
+
+    pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    exif = Image.Exif()
+    latitude = 39.1083 + 0.0003 * frame_index
+    longitude = 117.1680
+    exif[0x8825] = {1: 'N', 2: _to_dms(latitude), 3: 'E', 4: _to_dms(longitude), 5: 0, 6: 120.5}
+    buffer = io.BytesIO()
+    pil_img.save(buffer, 'JPEG', exif=exif.tobytes(), quality=92)
+    data = _insert_after_app_segments(buffer.getvalue(), _dji_xmp_segment(0.0, -90.0 + frame_index % 5, 10.0))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return rectangles
+
+
+def summarize(samples):
+    """
+    :param samples: 单次耗时列表（秒）
+    :return: 统计字典（毫秒）
+    """
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        'n': int(ms.size),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'max_ms': float(ms.max()),
+        'per_second': float(1000 / ms.mean()) if ms.mean() > 0 else None
+    }
+
+
+def measure(func, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.path} 返回 {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def run_benchmarks(folder, frames, repeat):
+    """
+    :param folder: 合成图像所在文件夹
+    :param frames: {文件名: 矩形列表}
+    :param repeat: 每项测量的次数
+    :return: {测量项: 统计字典}
+    """
+    os.environ['LABEL_FOLDER'] = folder
+    import label_exe
+    import get_cheese_point as gp
+    from undistort import undistort_roi
+
+    label_exe.FOLDER_PATH = folder
+    label_exe.SHUTDOWN_ON_CLIENT_EXIT = False
+    label_exe.prefetcher.radius = 0  # 预取会在后台提前完成部分工作，测量时关闭以得到稳定结果
+    client = label_exe.app.test_client()
+    names = sorted(frames)
+    count = len(names)
+    results = {}
+
+    start = time.perf_counter()
+    _check(client.get('/api/images'))
+    results['api_images_cold'] = summarize([time.perf_counter() - start])
+    results['api_images'] = measure(lambda i: _check(client.get('/api/images')), repeat)
+
+    start = time.perf_counter()
+    for index in range(count):
+        _check(client.get(f'/api/image/{index}'))
+    results['api_image_cold'] = summarize([(time.perf_counter() - start) / count])
+    results['api_image'] = measure(lambda i: _check(client.get(f'/api/image/{i % count}')), repeat)
+
+    label_exe.image_cache.clear()
+    results['api_image_preview_cold'] = measure(
+        lambda i: _check(client.get(f'/api/image_preview/{i % count}?size={512 + 64 * (i // count)}')),
+        count)
+    # 先不计时地生成每张图像的默认尺寸预览图，之后的测量全部命中预览缓存，与上面未命中的冷启动测量分开
+    for index in range(count):
+        _check(client.get(f'/api/image_preview/{index}'))
+    results['api_image_preview'] = measure(lambda i: _check(client.get(f'/api/image_preview/{i % count}')), repeat)
+
+    coordinates = [[float(x), float(y), 1 + x % 3] for x, y in zip(range(0, 1000, 10), range(0, 2000, 20))]
+    header = client.get('/api/image/0').get_json()['header_lines']
+    results['api_save_coordinates'] = measure(
+        lambda i: _check(client.post(f'/api/save_coordinates/{i % count}',
+                                     json={'header_lines': header, 'coordinates': coordinates})), repeat)
+
+    def process_rectangle(i):
+        name = names[i % count]
+        target, rectangle = frames[name][i % len(frames[name])]
+        _check(client.post('/api/process_rectangle',
+                           json={'rectangle': rectangle, 'index': i % count, 'filename': name, 'target': target}))
+    results['api_process_rectangle'] = measure(process_rectangle, repeat)
+
+    # 直接测量角点检测（不含解码和去畸变）
+    crops = []
+    for name in names:
+        img = cv2.imread(os.path.join(folder, name))
+        for target, ((x0, y0), (x1, y1)) in frames[name]:
+            corners = [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+            roi_img, (ox, oy) = undistort_roi(img, gp.cam_matrix, gp.dist_coeffs, corners, 64)
+            crops.append((roi_img, [[x - ox, y - oy] for x, y in corners]))
+    results['auto_detect_corners'] = measure(lambda i: gp.auto_detect_corners(*crops[i % len(crops)]), repeat)
+    results['auto_detect_corners_fullscale'] = measure(
+        lambda i: gp.auto_detect_corners(*crops[i % len(crops)], multiscale=False), repeat)
+    results['auto_detect_corners_suppress_bg'] = measure(
+        lambda i: gp.auto_detect_corners(*crops[i % len(crops)], suppress_background=True), repeat)
+
+    results['server_stages'] = label_exe.metrics_registry.snapshot()
+    label_exe.prefetcher.shutdown()
+    return results
+
+
+def print_results(results):
+    print(f"{'测量项':<32}{'次数':>6}{'平均ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'最大ms':>10}{'次/秒':>10}")
+    for name, stats in results.items():
+        if name == 'server_stages':
+            continue
+        print(f"{name:<32}{stats['n']:>6}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['max_ms']:>10.2f}{stats['per_second'] or 0:>10.1f}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    与基线结果比较 p50，返回变慢超过容差的测量项
+    :param tolerance: 允许变慢的比例，如 0.2 表示 20%
+    :return: [(测量项, 基线p50, 当前p50)]
+    """
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if name == 'server_stages' or not base or not base.get('p50_ms'):
+            continue
+        if stats['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append((name, base['p50_ms'], stats['p50_ms']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="标注服务器和角点检测的基准测试")
+    parser.add_argument('--frames', type=int, default=6, help="生成的图像数量")
+    parser.add_argument('--size', default='5472x3648', help="图像尺寸，宽x高")
+    parser.add_argument('--repeat', type=int, default=30, help="每项测量的次数")
+    parser.add_argument('--seed', type=int, default=0, help="随机数种子")
+    parser.add_argument('--workdir', help="图像生成目录，默认使用临时目录并在结束后删除")
+    parser.add_argument('--output', help="将结果保存为JSON文件")
+    parser.add_argument('--baseline', help="与之前保存的JSON结果比较")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="允许的p50变慢比例")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    workdir = args.workdir or tempfile.mkdtemp(prefix='label_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        rng = np.random.default_rng(args.seed)
+        start = time.perf_counter()
+        frames = {}
+        for i in range(args.frames):
+            name = f'DJI_{i:04d}.JPG'
+            frames[name] = generate_frame(os.path.join(workdir, name), i, (width, height), rng)
+        print(f"已生成 {args.frames} 张 {width}x{height} 合成图像，用时 {time.perf_counter() - start:.1f} 秒: {workdir}")
+
+        results = run_benchmarks(workdir, frames, args.repeat)
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'size': [width, height], 'frames': args.frames, 'repeat': args.repeat,
+                           'results': results}, f, ensure_ascii=False, indent=2)
+            print(f"结果已保存到 {args.output}")
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)['results']
+            regressions = compare(results, baseline, args.tolerance)
+            for name, base, current in regressions:
+                print(f"性能退化: {name} p50 {base:.2f} ms -> {current:.2f} ms")
+            if regressions:
+                sys.exit(1)
+            print(f"与基线相比没有超过 {args.tolerance:.0%} 的性能退化")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,83 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+_thread_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _get_thread_lock(path):
+    with _registry_lock:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = _thread_locks[path] = threading.RLock()
+        return lock
+
+
+def _lock_handle(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_handle(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked_file(path, lock_dir=None):
+    """
+    对文件的读-改-写过程加锁
+    同一进程内的线程使用线程锁；提供 lock_dir 时再对锁文件加系统级锁，保证多进程部署时也互斥
+    :param path: 被保护的文件路径
+    :param lock_dir: 存放锁文件的目录
+    """
+    path = os.path.abspath(path)
+    with _get_thread_lock(path):
+        if lock_dir is None:
+            yield
+            return
+        os.makedirs(lock_dir, exist_ok=True)
+        lock_path = os.path.join(lock_dir, os.path.basename(path) + '.lock')
+        with open(lock_path, 'a+b') as f:
+            _lock_handle(f)
+            try:
+                yield
+            finally:
+                _unlock_handle(f)
+
+
+def try_acquire_exclusive(path):
+    """
+    以非阻塞方式对锁文件加系统级排他锁，并一直持有到返回的文件对象被关闭或进程退出
+    用于保证同一个文件夹只由一个进程提供服务
+    :param path: 锁文件路径
+    :return: 打开的锁文件对象，锁已被其他进程持有时返回None
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    f = open(path, 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
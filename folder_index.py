@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import logging
+import threading
+
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png')
+CACHE_DIRNAME = '.label_cache'  # 图像文件夹下存放索引等缓存文件的子目录
+INDEX_CACHE_FILENAME = 'folder_index.json'
+
+logger = logging.getLogger(__name__)
+
+
+class FolderIndex:
+    """
+    图像文件夹索引：启动时构建一次，之后只通过检查目录修改时间判断是否需要重新扫描，
+    避免每个请求都执行 os.listdir + 过滤 + 排序；保存TXT/JSON标注也会改变目录修改时间，
+    因此重新扫描后只在图像文件集合变化时才重新排序和写入索引缓存
+    """
+
+    def __init__(self, folder_path, extensions, check_interval=2.0, cache_dir=None):
+        """
+        :param folder_path: 图像文件夹路径
+        :param extensions: 允许的图像扩展名元组（小写）
+        :param check_interval: 两次目录修改时间检查之间的最小间隔（秒）
+        :param cache_dir: 索引缓存目录，提供时将索引保存为 folder_index.json 以便重启时跳过扫描；
+                          应为子目录，写入缓存不会改变图像文件夹本身的修改时间
+        """
+        self.folder_path = folder_path
+        self.extensions = extensions
+        self.check_interval = check_interval
+        self.cache_dir = cache_dir
+        self.use_disk_cache = cache_dir is not None
+        self._lock = threading.Lock()
+        self._files = []
+        self._positions = {}
+        self._dir_mtime_ns = None
+        self._last_check = 0.0
+        self._load_or_build()
+
+    @property
+    def cache_path(self):
+        return os.path.join(self.cache_dir, INDEX_CACHE_FILENAME)
+
+    def _set_files(self, files, dir_mtime_ns):
+        self._files = files
+        self._positions = {name: i for i, name in enumerate(files)}
+        self._dir_mtime_ns = dir_mtime_ns
+        self._last_check = time.monotonic()
+
+    def _scan(self):
+        """扫描文件夹并返回图像文件名集合"""
+        return {entry.name for entry in os.scandir(self.folder_path)
+                if entry.name.lower().endswith(self.extensions) and entry.is_file()}
+
+    def _load_or_build(self):
+        """优先从磁盘缓存加载索引（目录修改时间一致时），否则重新扫描"""
+        dir_mtime_ns = os.stat(self.folder_path).st_mtime_ns
+        if self.use_disk_cache:
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                if (cached.get('dir_mtime_ns') == dir_mtime_ns
+                        and cached.get('extensions') == list(self.extensions)):
+                    self._set_files(cached['files'], dir_mtime_ns)
+                    return
+            except (OSError, ValueError, KeyError):
+                pass
+        self._rebuild(dir_mtime_ns)
+
+    def _rebuild(self, dir_mtime_ns):
+        files = sorted(self._scan())
+        self._set_files(files, dir_mtime_ns)
+        logger.info("已建立图像索引: %s（%s 张图像）", self.folder_path, len(files))
+        if self.use_disk_cache:
+            self._save_cache()
+
+    def _update(self, dir_mtime_ns):
+        """目录修改时间变化后重新扫描，图像文件集合没有变化（例如只是保存了标注）时保留现有索引"""
+        names = self._scan()
+        if names == self._positions.keys():
+            self._dir_mtime_ns = dir_mtime_ns
+            self._last_check = time.monotonic()
+            return
+        added, removed = len(names - self._positions.keys()), len(self._positions.keys() - names)
+        self._set_files(sorted(names), dir_mtime_ns)
+        logger.info("图像索引已更新: %s（新增 %s 张，删除 %s 张，共 %s 张）",
+                    self.folder_path, added, removed, len(self._files))
+        if self.use_disk_cache:
+            self._save_cache()
+
+    def _save_cache(self):
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'dir_mtime_ns': self._dir_mtime_ns,
+                    'extensions': list(self.extensions),
+                    'files': self._files
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning("无法写入索引缓存 %s: %s", self.cache_path, e)
+
+    def refresh(self, force=False):
+        """
+        检查目录修改时间，目录内容变化时重新扫描并更新索引
+        :param force: 为True时忽略检查间隔并强制重新扫描
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_check < self.check_interval:
+                return
+            dir_mtime_ns = os.stat(self.folder_path).st_mtime_ns
+            if force:
+                self._rebuild(dir_mtime_ns)
+            elif dir_mtime_ns != self._dir_mtime_ns:
+                self._update(dir_mtime_ns)
+            else:
+                self._last_check = now
+
+    def files(self):
+        """返回当前排序后的图像文件名列表"""
+        self.refresh()
+        return self._files
+
+    def __len__(self):
+        return len(self.files())
+
+    def filename(self, index):
+        """
+        按索引返回文件名
+        :param index: 图像列表中的索引
+        :return: 文件名，索引超出范围时返回None
+        """
+        files = self.files()
+        if 0 <= index < len(files):
+            return files[index]
+        return None
+
+    def index_of(self, filename):
+        """
+        返回文件名对应的索引
+        :return: 索引，不存在时返回None
+        """
+        self.refresh()
+        return self._positions.get(filename)
+
+    def page(self, offset, limit):
+        """
+        分页返回文件名
+        :param offset: 起始索引
+        :param limit: 每页数量
+        :return: (总数, 当前页文件名列表)
+        """
+        files = self.files()
+        offset = max(0, offset)
+        return len(files), files[offset:offset + max(0, limit)]
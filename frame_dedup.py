@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+from folder_index import FolderIndex, IMAGE_EXTENSIONS, CACHE_DIRNAME
+from image_meta import MetadataCache
+from annotation_io import read_text_file
+from propagate import group_targets
+from batch_detect import write_detected_points
+
+HASH_CACHE_FILENAME = 'phash.json'
+HASH_DECODE_SIZE = 64    # 计算感知哈希时JPEG降采样解码的目标尺寸（draft 模式按1/2、1/4、1/8缩放解码）
+HASH_SIZE = 8            # 感知哈希取DCT低频系数的边长，哈希共 HASH_SIZE*HASH_SIZE 位
+MAX_HASH_DISTANCE = 6    # 汉明距离不超过该值的相邻帧视为几乎相同
+
+logger = logging.getLogger(__name__)
+
+
+def perceptual_hash(image_path, hash_size=HASH_SIZE):
+    """
+    计算图像的感知哈希（pHash）：降采样解码为灰度图，缩放到 4*hash_size 见方后做DCT，
+    取左上角 hash_size 见方的低频系数与其中位数比较得到各位
+    :param image_path: 图像文件路径
+    :param hash_size: 低频系数块边长
+    :return: 十六进制哈希字符串，无法读取图像时返回None
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.draft('L', (HASH_DECODE_SIZE, HASH_DECODE_SIZE))
+            gray = np.asarray(img.convert('L'), dtype=np.float32)
+    except (OSError, ValueError):
+        return None
+    size = hash_size * 4
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small)[:hash_size, :hash_size].flatten()
+    bits = low > np.median(low[1:])  # 直流分量只反映整体亮度，不参与中位数
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def hash_distance(hash_a, hash_b):
+    """两个十六进制哈希的汉明距离"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def _hash_one(task):
+    """
+    工作进程：计算单张图像的感知哈希
+    :param task: (文件夹路径, 图像文件名)
+    :return: (图像文件名, 哈希或None)
+    """
+    folder_path, image_filename = task
+    return image_filename, perceptual_hash(os.path.join(folder_path, image_filename))
+
+
+def _file_key(folder_path, image_filename):
+    stat = os.stat(os.path.join(folder_path, image_filename))
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def compute_hashes(folder_path, image_files, cache_dir=None, workers=None):
+    """
+    用进程池计算所有图像的感知哈希，结果以 文件名+修改时间+大小 为键缓存，未变化的图像不再解码
+    :param folder_path: 图像文件夹路径
+    :param image_files: 图像文件名列表
+    :param cache_dir: 缓存目录，默认为 文件夹/.label_cache
+    :param workers: 进程数，默认使用全部CPU核心
+    :return: {文件名: 哈希或None}
+    """
+    cache_dir = cache_dir or os.path.join(folder_path, CACHE_DIRNAME)
+    cache_path = os.path.join(cache_dir, HASH_CACHE_FILENAME)
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+
+    hashes = {}
+    entries = {}
+    missing = []
+    for name in image_files:
+        key = _file_key(folder_path, name)
+        entry = cached.get(name)
+        if entry and entry[:2] == key:
+            hashes[name] = entry[2]
+            entries[name] = entry
+        else:
+            missing.append(name)
+            entries[name] = key + [None]
+    if missing:
+        chunksize = max(1, len(missing) // ((workers or os.cpu_count() or 1) * 8))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for name, value in executor.map(_hash_one, [(folder_path, name) for name in missing],
+                                            chunksize=chunksize):
+                hashes[name] = value
+                entries[name][2] = value
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning("无法写入感知哈希缓存 %s: %s", cache_path, e)
+    return hashes
+
+
+def cluster_frames(image_files, hashes, max_distance=MAX_HASH_DISTANCE):
+    """
+    把拍摄顺序上连续、几乎相同的帧（悬停时连拍）归为一组
+    每帧与当前组的第一帧（代表帧）比较而不是与前一帧比较，缓慢漂移的画面不会被一直串进同一组
+    :param image_files: 按拍摄顺序排列的图像文件名列表
+    :param hashes: {文件名: 哈希或None}，无法计算哈希的图像单独成组
+    :param max_distance: 视为几乎相同的最大汉明距离
+    :return: [[代表帧文件名, 其余文件名...], ...]
+    """
+    clusters = []
+    for name in image_files:
+        value = hashes.get(name)
+        if clusters and value is not None:
+            representative = hashes.get(clusters[-1][0])
+            if representative is not None and hash_distance(value, representative) <= max_distance:
+                clusters[-1].append(name)
+                continue
+        clusters.append([name])
+    return clusters
+
+
+def copy_cluster_annotations(folder_path, cluster, metadata_cache, lock_dir=None, overwrite=False, source=None):
+    """
+    把组内一帧（默认为代表帧）的靶标点复制到同组的其余帧：相同编号的靶标被替换，保留其他编号的点，
+    各帧的TXT头部使用其自身的地理信息
+    :param folder_path: 图像文件夹路径
+    :param cluster: [代表帧文件名, 其余文件名...]
+    :param metadata_cache: MetadataCache 实例
+    :param lock_dir: 锁文件目录
+    :param overwrite: 为False时跳过已有标注点的帧
+    :param source: 作为复制来源的组内文件名，默认为代表帧 cluster[0]
+    :return: 写入的文件名列表
+    """
+    def read_points(image_filename):
+        txt_path = os.path.join(folder_path, f"{os.path.splitext(image_filename)[0]}.txt")
+        return read_text_file(txt_path)[1] if os.path.exists(txt_path) else [None]
+
+    source = source or cluster[0]
+    detected = group_targets(read_points(source))
+    if not detected:
+        return []
+    written = []
+    for image_filename in cluster:
+        if image_filename == source:
+            continue
+        if not overwrite and any(coord is not None for coord in read_points(image_filename)):
+            continue
+        write_detected_points(folder_path, image_filename, detected, metadata_cache, lock_dir)
+        written.append(image_filename)
+    return written
+
+
+def deduplicate_folder(folder_path, max_distance=MAX_HASH_DISTANCE, workers=None, copy_annotations=False,
+                       overwrite=False, cache_dir=None):
+    """
+    计算整个文件夹的感知哈希并把几乎相同的连续帧分组，可选把每组代表帧的标注复制到同组其余帧
+    :param folder_path: 图像文件夹路径
+    :param max_distance: 视为几乎相同的最大汉明距离
+    :param workers: 进程数，默认使用全部CPU核心
+    :param copy_annotations: 是否复制代表帧的标注
+    :param overwrite: 复制时是否覆盖已有标注的帧
+    :param cache_dir: 缓存目录，默认为 文件夹/.label_cache
+    :return: 分组列表 [[代表帧文件名, 其余文件名...], ...]
+    """
+    start_time = time.perf_counter()
+    cache_dir = cache_dir or os.path.join(folder_path, CACHE_DIRNAME)
+    image_files = FolderIndex(folder_path, IMAGE_EXTENSIONS, cache_dir=cache_dir).files()
+    clusters = cluster_frames(image_files, compute_hashes(folder_path, image_files, cache_dir, workers), max_distance)
+    copied = 0
+    if copy_annotations:
+        metadata_cache = MetadataCache(folder_path, cache_dir=cache_dir)
+        for cluster in clusters:
+            if len(cluster) > 1:
+                copied += len(copy_cluster_annotations(folder_path, cluster, metadata_cache,
+                                                       os.path.join(cache_dir, 'locks'), overwrite))
+    elapsed = time.perf_counter() - start_time
+    logger.info("近重复帧分组完成: %s 张图像分为 %s 组，复制标注到 %s 张图像，用时 %.2f 秒",
+                len(image_files), len(clusters), copied, elapsed)
+    return clusters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="用感知哈希把悬停时连拍的几乎相同的图像分组")
+    parser.add_argument('folder', help="图像文件夹路径")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认使用全部CPU核心")
+    parser.add_argument('--max-distance', type=int, default=MAX_HASH_DISTANCE,
+                        help="视为几乎相同的最大汉明距离（共64位）")
+    parser.add_argument('--copy-annotations', action='store_true', help="把每组代表帧的标注复制到同组其余帧")
+    parser.add_argument('--overwrite', action='store_true', help="复制标注时覆盖已有标注的帧")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if not os.path.isdir(args.folder):
+        print(f"Error: 未找到图像文件夹 '{args.folder}'")
+        sys.exit(1)
+    for group in deduplicate_folder(args.folder, args.max_distance, args.workers, args.copy_annotations,
+                                    args.overwrite):
+        if len(group) > 1:
+            print(f"{group[0]}: {len(group) - 1} 张几乎相同的图像 ({group[1]} ... {group[-1]})")
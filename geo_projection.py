@@ -0,0 +1,157 @@
+import numpy as np
+
+EARTH_RADIUS_M = 6378137.0
+TARGET_RADIUS_M = 0.5          # 靶标半径（米），用于估计投影后的搜索区域大小
+POSITION_UNCERTAINTY_M = 3.0   # GPS/云台误差导致的靶标位置不确定度（米）
+MIN_ROI_HALF_SIZE = 48         # 搜索区域最小半边长（像素）
+
+# 零姿态（偏航0、俯仰0、横滚0，镜头朝正北水平）时相机坐标轴在 东-北-天 坐标系中的方向：
+# 相机x轴（图像向右）=东，相机y轴（图像向下）=天的反方向，相机z轴（光轴）=北
+_CAMERA_TO_BODY = np.array([
+    [1.0, 0.0, 0.0],
+    [0.0, 0.0, 1.0],
+    [0.0, -1.0, 0.0]
+])
+
+
+def geodetic_to_local(latitude, longitude, altitude, origin):
+    """
+    将经纬度和高度转换为以 origin 为原点的局部 东-北-天 坐标（米），小范围内使用等距圆柱近似
+    :param latitude: 纬度数组（度）
+    :param longitude: 经度数组（度）
+    :param altitude: 高度数组（米）
+    :param origin: (纬度, 经度, 高度) 原点
+    :return: (N, 3) 坐标数组
+    """
+    lat0, lon0, alt0 = origin
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    east = np.radians(longitude - lon0) * EARTH_RADIUS_M * np.cos(np.radians(lat0))
+    north = np.radians(latitude - lat0) * EARTH_RADIUS_M
+    up = np.asarray(altitude, dtype=np.float64) - alt0
+    return np.stack([east, north, up], axis=-1)
+
+
+def gimbal_rotations(roll, pitch, yaw):
+    """
+    由DJI云台角计算相机到 东-北-天 坐标系的旋转矩阵（向量化）
+    偏航角自正北顺时针为正，俯仰角向上为正（-90为垂直向下），横滚角右侧向下为正
+    :return: (N, 3, 3) 旋转矩阵数组
+    """
+    roll = np.radians(np.asarray(roll, dtype=np.float64))
+    pitch = np.radians(np.asarray(pitch, dtype=np.float64))
+    yaw = -np.radians(np.asarray(yaw, dtype=np.float64))
+    n = roll.shape[0]
+    zeros, ones = np.zeros(n), np.ones(n)
+    cz, sz = np.cos(yaw), np.sin(yaw)
+    cx, sx = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(roll), np.sin(roll)
+    rz = np.stack([cz, -sz, zeros, sz, cz, zeros, zeros, zeros, ones], axis=-1).reshape(n, 3, 3)
+    rx = np.stack([ones, zeros, zeros, zeros, cx, -sx, zeros, sx, cx], axis=-1).reshape(n, 3, 3)
+    ry = np.stack([cy, zeros, sy, zeros, ones, zeros, -sy, zeros, cy], axis=-1).reshape(n, 3, 3)
+    return rz @ rx @ ry @ _CAMERA_TO_BODY
+
+
+def pixel_rays(pixels, rotations, cam_matrix):
+    """
+    计算像素对应的视线方向（世界坐标系单位向量）
+    :param pixels: (N, 2) 去畸变图像中的像素坐标
+    :param rotations: (N, 3, 3) 相机到世界的旋转矩阵
+    :return: (N, 3) 单位方向向量
+    """
+    pixels = np.asarray(pixels, dtype=np.float64)
+    homogeneous = np.concatenate([pixels, np.ones((pixels.shape[0], 1))], axis=1)
+    camera_dirs = homogeneous @ np.linalg.inv(cam_matrix).T
+    world_dirs = np.einsum('nij,nj->ni', rotations, camera_dirs)
+    return world_dirs / np.linalg.norm(world_dirs, axis=1, keepdims=True)
+
+
+def triangulate(centers, directions, ground_altitude=None):
+    """
+    由多条视线求靶标的三维位置（到所有视线距离平方和最小的点）
+    只有一条视线时需要提供地面高度，取视线与该水平面的交点
+    :param centers: (N, 3) 相机位置
+    :param directions: (N, 3) 单位视线方向
+    :param ground_altitude: 局部坐标系中的地面高度
+    :return: (3,) 靶标位置
+    """
+    if len(centers) == 1 or ground_altitude is not None:
+        if ground_altitude is None:
+            raise ValueError("只有一帧标注时需要提供地面高度")
+        t = (ground_altitude - centers[:, 2]) / directions[:, 2]
+        valid = t > 0
+        if not valid.any():
+            raise ValueError("视线与地面没有交点，请检查云台角")
+        return (centers[valid] + t[valid, None] * directions[valid]).mean(axis=0)
+    projectors = np.eye(3)[None, :, :] - directions[:, :, None] * directions[:, None, :]
+    a = projectors.sum(axis=0)
+    b = np.einsum('nij,nj->i', projectors, centers)
+    return np.linalg.lstsq(a, b, rcond=None)[0]
+
+
+def project_point(point, centers, rotations, cam_matrix):
+    """
+    将一个世界坐标点投影到所有帧（向量化）
+    :param point: (3,) 世界坐标
+    :param centers: (N, 3) 相机位置
+    :param rotations: (N, 3, 3) 相机到世界的旋转矩阵
+    :return: ((N, 2) 像素坐标, (N,) 深度)，深度<=0 表示点在相机后方
+    """
+    camera_points = np.einsum('nji,nj->ni', rotations, point[None, :] - centers)
+    depth = camera_points[:, 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = camera_points[:, :2] / depth[:, None]
+    pixels = normalized * np.array([cam_matrix[0, 0], cam_matrix[1, 1]]) + np.array([cam_matrix[0, 2], cam_matrix[1, 2]])
+    return pixels, depth
+
+
+def localize_target(flight, observations, cam_matrix, image_size, ground_altitude=None):
+    """
+    根据少数几帧中的靶标标注估计其地面位置，并投影到整次飞行的每一帧，给出搜索区域
+    :param flight: 列存储的飞行元数据 {'filename', 'Latitude', 'Longitude', 'Altitude',
+                   'GimbalRoll', 'GimbalPitch', 'GimbalYaw'}
+    :param observations: {文件名: (u, v)} 已标注帧中靶标中心的像素坐标
+    :param cam_matrix: 相机内参矩阵
+    :param image_size: 图像尺寸 (宽, 高)
+    :param ground_altitude: 地面海拔高度（米），只有一帧标注时必需
+    :return: (靶标局部坐标, [{'filename', 'center', 'roi', 'depth'}, ...]) 投影落在图像内的帧
+    """
+    filenames = np.asarray(flight['filename'])
+    columns = [np.asarray(flight[key], dtype=np.float64)
+               for key in ('Latitude', 'Longitude', 'Altitude', 'GimbalRoll', 'GimbalPitch', 'GimbalYaw')]
+    valid = np.all([np.isfinite(column) for column in columns], axis=0)
+    if not valid.any():
+        raise ValueError("没有可用的GPS/云台数据")
+    latitude, longitude, altitude, roll, pitch, yaw = [column[valid] for column in columns]
+    filenames = filenames[valid]
+    origin = (latitude[0], longitude[0], 0.0)
+    centers = geodetic_to_local(latitude, longitude, altitude, origin)
+    rotations = gimbal_rotations(roll, pitch, yaw)
+
+    positions = {name: i for i, name in enumerate(filenames.tolist())}
+    observed = [(positions[name], uv) for name, uv in observations.items() if name in positions]
+    if not observed:
+        raise ValueError("已标注的帧中没有可用的GPS/云台数据")
+    rows = np.array([row for row, _ in observed])
+    pixels = np.array([uv for _, uv in observed], dtype=np.float64)
+    directions = pixel_rays(pixels, rotations[rows], cam_matrix)
+    target = triangulate(centers[rows], directions, ground_altitude)
+
+    projected, depth = project_point(target, centers, rotations, cam_matrix)
+    focal = (cam_matrix[0, 0] + cam_matrix[1, 1]) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half_size = np.maximum(MIN_ROI_HALF_SIZE, focal * (TARGET_RADIUS_M + POSITION_UNCERTAINTY_M) / depth)
+    width, height = image_size
+    inside = ((depth > 0) & (projected[:, 0] >= 0) & (projected[:, 0] < width)
+              & (projected[:, 1] >= 0) & (projected[:, 1] < height))
+    proposals = []
+    for i in np.flatnonzero(inside):
+        u, v = projected[i]
+        h = half_size[i]
+        proposals.append({
+            'filename': str(filenames[i]),
+            'center': [float(u), float(v)],
+            'roi': [int(max(0, u - h)), int(max(0, v - h)), int(min(width, u + h)), int(min(height, v + h))],
+            'depth': float(depth[i])
+        })
+    return target, proposals
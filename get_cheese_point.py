@@ -1,7 +1,12 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.widgets import PolygonSelector
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import timed, registry
+
+logger = logging.getLogger(__name__)
 # 从图片数据中提取参数（使用优化后的值）
 cam_matrix = np.array([
     [3700.086, 0, 2684.688],   # 焦距fx, 0, Cx
@@ -17,36 +22,75 @@ dist_coeffs = np.array([
     0.002083274     # K3
 ])
 
-def replace_background_with_green(img):
+# 角点检测参数
+SEARCH_MAX_SIZE = 480          # 多尺度搜索时缩小后图像的最长边像素数
+MAX_SUBPIX_WINDOW = 11         # 由缩小图像映射回来的角点使用的最大亚像素搜索半窗口
+FAST_SEARCH_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE + cv2.CALIB_CB_FAST_CHECK
+DETECT_LATENCY_TARGET_MS = 50  # 单个矩形角点检测的目标耗时（毫秒）
 
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    
-    lower_white = np.array([0, 0, 220])
-    upper_white = np.array([180, 30, 255])
-    mask_white = cv2.inRange(hsv, lower_white, upper_white)
-    
-    lower_black = np.array([0, 0, 0])
-    upper_black = np.array([180, 255, 255])
-    mask_black = cv2.inRange(hsv, lower_black, upper_black)
-    
-    mask_target = cv2.bitwise_or(mask_white, mask_black)
-    
-    kernel = np.ones((5, 5), np.uint8)
-    mask_target = cv2.morphologyEx(mask_target, cv2.MORPH_CLOSE, kernel)
-    mask_target = cv2.morphologyEx(mask_target, cv2.MORPH_OPEN, kernel)
-    
-    green_background = np.zeros_like(img)
-    green_background[:] = [0, 125, 0]
-    
-    target_only = cv2.bitwise_and(img, img, mask=mask_target)
-    
-    mask_background = cv2.bitwise_not(mask_target)
-    background_only = cv2.bitwise_and(green_background, green_background, mask=mask_background)
-    
-    return cv2.add(target_only, background_only)
+# 背景抑制参数（HSV，H范围0-180）
+WHITE_LOWER = np.array([0, 0, 220])      # 白色方格和底板：低饱和度、高亮度
+WHITE_UPPER = np.array([180, 30, 255])
+BLACK_LOWER = np.array([0, 0, 0])        # 黑色方格：低亮度
+BLACK_UPPER = np.array([180, 255, 80])
+BACKGROUND_COLOR = (0, 125, 0)           # 替换背景使用的颜色（BGR）
+BACKGROUND_KERNEL = np.ones((5, 5), np.uint8)
+_buffers = threading.local()
+
+# 整幅图像多靶标检测参数
+PROPOSAL_MAX_SIZE = 1600       # 候选区域搜索时缩小后图像的最长边像素数
+PROPOSAL_WINDOW = 7            # 局部对比度（标准差）的窗口边长（缩小图像上的像素）
+PROPOSAL_MIN_STD = 45          # 候选区域的最低局部灰度标准差，黑白方格边缘远高于草地、土路等背景
+PROPOSAL_MIN_AREA = 30         # 候选连通域的最小面积（缩小图像上的像素）
+PROPOSAL_MAX_ASPECT = 4.0      # 候选连通域外接矩形的最大长宽比
+PROPOSAL_PADDING = 0.3         # 候选区域外接矩形向外扩展的比例
+MAX_CANDIDATES = 40            # 最多验证的候选区域数，按对比度从高到低选取
+SCAN_WORKERS = 4               # 并行验证候选区域的线程数
+
+def _buffer(name, shape, dtype=np.uint8):
+    """
+    返回当前线程可复用的缓冲区：按名称保存只增不减的一维数组，取前缀重塑为所需形状，保证内存连续
+    :param name: 缓冲区名称
+    :param shape: 需要的形状
+    :return: 形状为 shape 的数组（内容未初始化）
+    """
+    pool = getattr(_buffers, 'pool', None)
+    if pool is None:
+        pool = _buffers.pool = {}
+    size = int(np.prod(shape))
+    flat = pool.get(name)
+    if flat is None or flat.size < size or flat.dtype != dtype:
+        flat = pool[name] = np.empty(size, dtype=dtype)
+    return flat[:size].reshape(shape)
+
+def replace_background_with_green(img, out=None):
+    """
+    把既不是白色也不是黑色的像素（草地等背景）替换为绿色，突出黑白棋盘格
+    作为角点检测的可选预处理只对ROI裁剪调用；HSV图像和掩码使用线程内复用的缓冲区，
+    最后用一次带掩码的复制代替多次整幅 bitwise 运算
+    :param img: BGR图像（通常为ROI裁剪）
+    :param out: 输出数组，None时新分配
+    :return: 替换背景后的BGR图像
+    """
+    height, width = img.shape[:2]
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=_buffer('hsv', (height, width, 3)))
+    mask_target = cv2.inRange(hsv, WHITE_LOWER, WHITE_UPPER, dst=_buffer('mask_target', (height, width)))
+    mask_black = cv2.inRange(hsv, BLACK_LOWER, BLACK_UPPER, dst=_buffer('mask_black', (height, width)))
+    cv2.bitwise_or(mask_target, mask_black, dst=mask_target)
+    cv2.morphologyEx(mask_target, cv2.MORPH_CLOSE, BACKGROUND_KERNEL, dst=mask_target)
+    cv2.morphologyEx(mask_target, cv2.MORPH_OPEN, BACKGROUND_KERNEL, dst=mask_target)
+
+    if out is None:
+        out = np.empty_like(img)
+    out[:] = BACKGROUND_COLOR
+    cv2.copyTo(img, mask_target, out)
+    return out
 
 def manual_region_selection(image):
     """手动选择棋盘格区域的四边形顶点"""
+    # matplotlib 只用于本地调试的手动选择和可视化，导入耗时较长，服务器不加载
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import PolygonSelector
     fig, ax = plt.subplots(figsize=(12, 8))
     ax.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
     plt.title("点击选择四边形顶点 (按顺序: 左上→右上→右下→左下)")
@@ -67,30 +111,140 @@ def manual_region_selection(image):
     plt.show()
     return polygon_coords
 
-def auto_detect_corners(image, region_vertices):
-    """自动检测棋盘格的25个关键点"""
-    # 1. 裁剪感兴趣区域(ROI)
-    mask = np.zeros(image.shape[:2], dtype=np.uint8)
-    cv2.fillPoly(mask, [np.array(region_vertices, dtype=np.int32)], 255)
-    roi = cv2.bitwise_and(image, image, mask=mask)
+def auto_detect_corners(image, region_vertices, multiscale=True, max_search_size=SEARCH_MAX_SIZE,
+                        suppress_background=False):
+    """
+    自动检测棋盘格的关键点
+    只处理区域外接矩形内的像素；multiscale 为True时先在缩小的图像上快速搜索，
+    找到后再在原分辨率上用 cornerSubPix 精确定位，搜索失败时退回原分辨率搜索
+    :param image: BGR图像
+    :param region_vertices: 区域顶点列表 [[x, y], ...]
+    :param multiscale: 是否先在缩小的图像上搜索
+    :param max_search_size: 缩小后搜索图像的最长边像素数
+    :param suppress_background: 是否先把区域内的草地等背景替换为绿色（replace_background_with_green）
+    :return: 角点坐标数组 (N, 2)，为 image 坐标系下的坐标
+    """
+    start_time = time.perf_counter()
+    # 1. 裁剪感兴趣区域(ROI)的外接矩形，并遮挡区域外的像素
+    polygon = np.array(region_vertices, dtype=np.int32)
+    x, y, w, h = cv2.boundingRect(polygon)
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(image.shape[1], x + w), min(image.shape[0], y + h)
+    if x1 <= x0 or y1 <= y0:
+        raise RuntimeError("选择的区域不在图像范围内")
+    crop = image[y0:y1, x0:x1]
+    if suppress_background:
+        with timed('detect.suppress_background'):
+            crop = replace_background_with_green(crop, out=_buffer('suppressed', crop.shape))
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    mask = np.zeros(gray.shape, dtype=np.uint8)
+    cv2.fillPoly(mask, [polygon - np.array([x0, y0], dtype=np.int32)], 255)
+    gray = cv2.bitwise_and(gray, gray, mask=mask)
 
-    # 2. 灰度化和自适应二值化
-    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    # 2. 检测棋盘格角点
+    pattern_size = (3, 3)  # 4x4棋盘格有3x3个内角点
+    corners = None
+    window = 5
+    scale = min(1.0, max_search_size / max(gray.shape)) if multiscale else 1.0
+    if scale < 1.0:
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        with timed('detect.find_corners_coarse'):
+            ret, small_corners = cv2.findChessboardCorners(small, pattern_size, flags=FAST_SEARCH_FLAGS)
+        if ret:
+            # 缩小图像上的坐标映射回原分辨率，亚像素窗口随缩放比例放大以覆盖映射误差
+            corners = ((small_corners + 0.5) / scale - 0.5).astype(np.float32)
+            window = min(MAX_SUBPIX_WINDOW, max(5, int(np.ceil(1.5 / scale))))
+    if corners is None:
+        with timed('detect.find_corners_full'):
+            ret, corners = cv2.findChessboardCorners(gray, pattern_size, None)
+        if not ret:
+            raise RuntimeError("无法自动检测棋盘格角点，请检查图像质量")
+    logger.debug("检测到的角点数量: %d", len(corners))
 
-    # 5. 在矫正后图像中检测棋盘格角点
-    pattern_size = (3, 3)  # 4x4棋盘格有5x5个交点
-    
-    ret, corners = cv2.findChessboardCorners(gray, pattern_size, None)
-    print(f"检测到的角点数量: {len(corners)}")
-    if not ret:
-        raise RuntimeError("无法自动检测棋盘格角点，请检查图像质量")
-    
-    # 精确定位角点
+    # 3. 在原分辨率上精确定位角点
     criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
-    refined_corners = cv2.cornerSubPix(gray, corners, (5, 5), (-1, -1), criteria)
-    flattened_points = refined_corners.reshape(-1, 2)
+    with timed('detect.corner_subpix'):
+        refined_corners = cv2.cornerSubPix(gray, corners, (window, window), (-1, -1), criteria)
+    flattened_points = refined_corners.reshape(-1, 2) + np.array([x0, y0], dtype=np.float32)
+
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    registry.observe('detect.total', elapsed_ms)
+    if elapsed_ms > DETECT_LATENCY_TARGET_MS:
+        logger.warning("角点检测用时 %.1f ms，超过目标 %d ms（区域 %dx%d）",
+                       elapsed_ms, DETECT_LATENCY_TARGET_MS, x1 - x0, y1 - y0)
     return flattened_points
 
+def propose_board_regions(image, max_size=PROPOSAL_MAX_SIZE):
+    """
+    在整幅图像中寻找可能是棋盘格靶标的区域：黑白方格交界处局部灰度标准差很高，
+    在缩小的图像上按局部标准差阈值分割后闭运算连成块，按面积、长宽比和是否同时含有黑白像素筛选
+    :param image: BGR图像（去畸变后）
+    :param max_size: 缩小后图像的最长边像素数
+    :return: 候选区域顶点列表 [[[x, y], ...4个顶点], ...]，按对比度从高到低排列，最多 MAX_CANDIDATES 个
+    """
+    start_time = time.perf_counter()
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = min(1.0, max_size / max(gray.shape))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    values = small.astype(np.float32)
+    window = (PROPOSAL_WINDOW, PROPOSAL_WINDOW)
+    mean = cv2.boxFilter(values, -1, window)
+    std = np.sqrt(np.maximum(cv2.boxFilter(values * values, -1, window) - mean * mean, 0))
+    mask = (std >= PROPOSAL_MIN_STD).astype(np.uint8) * 255
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (PROPOSAL_WINDOW * 2 + 1, PROPOSAL_WINDOW * 2 + 1))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+    candidates = []
+    for label in range(1, count):
+        x, y, w, h, area = stats[label]
+        if area < PROPOSAL_MIN_AREA or max(w, h) > PROPOSAL_MAX_ASPECT * min(w, h):
+            continue
+        patch = small[y:y + h, x:x + w]
+        if patch.min() > 80 or patch.max() < 170:
+            continue  # 棋盘格同时有黑色和白色方格
+        pad = PROPOSAL_PADDING * max(w, h)
+        x0, y0 = (x - pad) / scale, (y - pad) / scale
+        x1, y1 = (x + w + pad) / scale, (y + h + pad) / scale
+        score = float(std[y:y + h, x:x + w].mean())
+        candidates.append((score, [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]))
+    candidates.sort(key=lambda item: -item[0])
+    registry.observe('detect.propose', (time.perf_counter() - start_time) * 1000)
+    return [region for _, region in candidates[:MAX_CANDIDATES]]
+
+def detect_all_boards(image, regions=None, workers=SCAN_WORKERS):
+    """
+    一次扫描整幅图像，检测其中所有的棋盘格靶标
+    先用 propose_board_regions 找候选区域，再在线程池中并行对每个候选区域做棋盘格检测验证，
+    检测不到棋盘格的候选区域被丢弃，重叠区域检测到的同一个靶标只保留一次
+    :param image: BGR图像（去畸变后）
+    :param regions: 候选区域顶点列表，None时自动寻找
+    :param workers: 并行验证的线程数
+    :return: [{'points': 角点列表 [[x, y], ...], 'region': 候选区域顶点}, ...] 按从上到下、从左到右排列
+    """
+    regions = propose_board_regions(image) if regions is None else regions
+
+    def verify(region):
+        try:
+            return auto_detect_corners(image, region)
+        except RuntimeError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(regions) or 1))) as executor:
+        results = list(executor.map(verify, regions))
+
+    boards = []
+    for region, points in zip(regions, results):
+        if points is None:
+            continue
+        center = points.mean(axis=0)
+        span = float((points.max(axis=0) - points.min(axis=0)).max())
+        if any(np.linalg.norm(center - board['center']) < max(span, 1.0) for board in boards):
+            continue
+        boards.append({'points': points.tolist(), 'region': region, 'center': center})
+    boards.sort(key=lambda board: (float(board['center'][1]), float(board['center'][0])))
+    return [{'points': board['points'], 'region': board['region']} for board in boards]
+
 def order_points(pts):
     """对点进行排序：左上→右上→右下→左下"""
     s = pts.sum(axis=1)
@@ -109,6 +263,7 @@ def order_points(pts):
 
 def visualize_results(original_img, selected_region, detected_points):
     """可视化结果"""
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(1, 3, figsize=(18, 6))
     
     # 原始图像和选择的区域
@@ -0,0 +1,144 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import cv2
+
+
+class DecodedImageCache:
+    """
+    按字节预算淘汰的LRU缓存，保存解码后的图像（及其派生数据，如去畸变图像、预览图）
+    键为 (路径, 修改时间, 文件大小, 类型)，文件被修改后旧条目自然失效
+    同一个键同时未命中时只调用一次加载函数，其他请求等待并共享结果
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: 缓存占用的最大字节数
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._inflight = {}  # 正在加载的键 -> Future
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _sizeof(value):
+        if hasattr(value, 'nbytes'):
+            return value.nbytes
+        return len(value)
+
+    @staticmethod
+    def _make_key(path, variant):
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size, variant)
+
+    def peek(self, path, variant):
+        """
+        查询缓存但不调用加载函数
+        :return: 缓存的值，未命中时返回None
+        """
+        key = self._make_key(path, variant)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def get(self, path, variant, loader):
+        """
+        返回缓存的值，未命中时调用 loader(path) 加载并放入缓存
+        :param path: 图像文件路径
+        :param variant: 数据类型标识，如 'bgr'、'undistorted'
+        :param loader: 加载函数，返回numpy数组或bytes，返回None表示加载失败（不缓存）
+        :return: 缓存或新加载的值
+        """
+        key = self._make_key(path, variant)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            future = self._inflight.get(key)
+            if future is None:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+                loading = True
+            else:
+                self.hits += 1  # 另一个请求正在加载，等待后直接使用其结果
+                self.coalesced += 1
+                loading = False
+        if not loading:
+            return future.result()
+        try:
+            value = loader(path)
+            if value is not None:
+                self._put(key, value)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def _put(self, key, value):
+        if hasattr(value, 'flags'):
+            value.flags.writeable = False  # 缓存的数组被多个请求共享，禁止原地修改
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = value
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= self._sizeof(evicted)
+                self.evictions += 1
+
+    def get_bgr(self, path):
+        """返回 cv2.imread 解码的BGR图像，读取失败时返回None"""
+        return self.get(path, 'bgr', cv2.imread)
+
+    def get_undistorted(self, path, undistort):
+        """
+        返回整幅去畸变后的图像
+        :param undistort: 去畸变函数，参数为BGR图像
+        """
+        def load(p):
+            img = self.get_bgr(p)
+            return undistort(img) if img is not None else None
+        return self.get(path, 'undistorted', load)
+
+    def clear(self):
+        """清空缓存（统计计数保留）"""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'coalesced': self.coalesced,
+                'hit_rate': self.hits / total if total else 0.0
+            }
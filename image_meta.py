@@ -0,0 +1,255 @@
+import os
+import io
+import re
+import json
+import struct
+import logging
+import threading
+
+METADATA_CACHE_FILENAME = 'metadata.jsonl'
+MAX_HEADER_BYTES = 4 * 1024 * 1024   # 解析元数据时最多读取的文件头字节数
+EXIF_SIGNATURE = b'Exif\x00\x00'
+XMP_SIGNATURE = b'http://ns.adobe.com/xap/1.0/\x00'
+DJI_XMP_PATTERN = re.compile(rb'drone-dji:(\w+)\s*=\s*"([^"]*)"|<drone-dji:(\w+)>([^<]*)</drone-dji:')
+GEO_KEYS = ('Latitude', 'Longitude', 'Altitude', 'GimbalRoll', 'GimbalPitch', 'GimbalYaw')
+
+logger = logging.getLogger(__name__)
+
+
+def convert_gps(coordinate, ref):
+    """
+    将度、分、秒转换为十进制坐标
+    :param coordinate: GPS坐标值
+    :param ref: 方向参考 ('N', 'S', 'E', 'W')
+    :return: 十进制坐标
+    """
+    d = float(coordinate.values[0].num) / coordinate.values[0].den
+    m = float(coordinate.values[1].num) / coordinate.values[1].den
+    s = float(coordinate.values[2].num) / coordinate.values[2].den
+    decimal = d + m / 60 + s / 3600
+    return -decimal if ref in ['S', 'W'] else decimal
+
+
+def read_jpeg_app1_segments(f, max_bytes=MAX_HEADER_BYTES):
+    """
+    单次顺序读取JPEG文件头，只收集APP1段（EXIF和XMP），遇到图像数据(SOS)即停止
+    其他段通过 seek 跳过，不读取其内容
+    :param f: 以二进制模式打开的文件对象
+    :param max_bytes: 最多扫描的字节数
+    :return: APP1段内容列表；不是JPEG文件时返回None
+    """
+    if f.read(2) != b'\xff\xd8':
+        return None
+    segments = []
+    position = 2
+    while position < max_bytes:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            break
+        code = marker[1]
+        while code == 0xFF:
+            fill = f.read(1)
+            if not fill:
+                return segments
+            code = fill[0]
+            position += 1
+        if code in (0xD9, 0xDA):  # EOI / SOS：元数据段已结束
+            break
+        if 0xD0 <= code <= 0xD7 or code == 0x01:
+            position += 2
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            break
+        length = struct.unpack('>H', length_bytes)[0]
+        if code == 0xE1:
+            segments.append(f.read(length - 2))
+        else:
+            f.seek(length - 2, io.SEEK_CUR)
+        position += 2 + length
+    return segments
+
+
+def parse_dji_xmp(xmp_bytes):
+    """
+    从XMP数据中解析 drone-dji 命名空间的属性
+    :param xmp_bytes: XMP段原始字节
+    :return: {标签名: 字符串值} 字典
+    """
+    dj_data_dict = {}
+    for match in DJI_XMP_PATTERN.finditer(xmp_bytes):
+        key = match.group(1) or match.group(3)
+        value = match.group(2) if match.group(1) else match.group(4)
+        dj_data_dict[key.decode('ascii', errors='ignore')] = value.decode('ascii', errors='ignore').strip()
+    return dj_data_dict
+
+
+def read_image_tags(image_path):
+    """
+    一次打开文件读取EXIF标签和DJI XMP数据
+    :param image_path: 图像文件的完整路径
+    :return: (exifread标签字典, DJI XMP字典)
+    """
+    import exifread  # 元数据缓存命中时不需要加载
+    tags = {}
+    dj_data_dict = {}
+    with open(image_path, 'rb') as f:
+        segments = read_jpeg_app1_segments(f)
+        if segments is None:
+            # 非JPEG文件（如PNG）交给exifread自行解析
+            f.seek(0)
+            return exifread.process_file(f, details=False), dj_data_dict
+    for segment in segments:
+        if segment.startswith(EXIF_SIGNATURE) and not tags:
+            tags = exifread.process_file(io.BytesIO(segment[len(EXIF_SIGNATURE):]), details=False)
+        elif segment.startswith(XMP_SIGNATURE):
+            dj_data_dict.update(parse_dji_xmp(segment[len(XMP_SIGNATURE):]))
+    return tags, dj_data_dict
+
+
+def extract_geo_info(image_path):
+    """
+    从图像中提取GPS和云台姿态信息
+    :param image_path: 图像文件的完整路径
+    :return: 包含纬度、经度、高度和云台翻滚、俯仰、偏航角度的字典
+    """
+    geo_data = {key: None for key in GEO_KEYS}
+    tags = {}
+    dj_data_dict = {}
+    try:
+        tags, dj_data_dict = read_image_tags(image_path)
+    except Exception as e:
+        logger.warning("提取 %s 的DJI元数据块时出错: %s", image_path, e)
+
+    if 'GPS GPSLatitude' in tags and 'GPS GPSLatitudeRef' in tags:
+        try:
+            geo_data['Latitude'] = convert_gps(tags['GPS GPSLatitude'], tags['GPS GPSLatitudeRef'].values)
+        except Exception as e:
+            logger.warning("解析 %s 的纬度时出错: %s", image_path, e)
+    if 'GPS GPSLongitude' in tags and 'GPS GPSLongitudeRef' in tags:
+        try:
+            geo_data['Longitude'] = convert_gps(tags['GPS GPSLongitude'], tags['GPS GPSLongitudeRef'].values)
+        except Exception as e:
+            logger.warning("解析 %s 的经度时出错: %s", image_path, e)
+    if 'GPS GPSAltitude' in tags:
+        try:
+            alt = tags['GPS GPSAltitude'].values[0]
+            geo_data['Altitude'] = float(alt.num) / alt.den
+        except Exception as e:
+            logger.warning("解析 %s 的高度时出错: %s", image_path, e)
+
+    euler_angle_tags_map = {
+        'GimbalRoll': 'GimbalRollDegree',
+        'GimbalPitch': 'GimbalPitchDegree',
+        'GimbalYaw': 'GimbalYawDegree'
+    }
+    for key, tag_name in euler_angle_tags_map.items():
+        if tag_name in dj_data_dict:
+            value_str = dj_data_dict[tag_name]
+            try:
+                geo_data[key] = float(value_str)
+            except ValueError:
+                logger.warning("%s 中 '%s' 的云台值 ('%s') 不是简单的浮点数，存储为原始字符串",
+                               image_path, tag_name, value_str)
+                geo_data[key] = value_str
+    return geo_data
+
+
+class MetadataCache:
+    """
+    图像元数据缓存，以 文件名+修改时间+大小 为键
+    内存中保存全部条目，磁盘上以JSON Lines追加写入，重启服务器后无需重新解析
+    """
+
+    def __init__(self, folder_path, cache_dir=None):
+        """
+        :param folder_path: 图像文件夹路径
+        :param cache_dir: 缓存目录，提供时将元数据追加写入 metadata.jsonl
+        """
+        self.folder_path = folder_path
+        self.cache_path = os.path.join(cache_dir, METADATA_CACHE_FILENAME) if cache_dir else None
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._load()
+
+    def _load(self):
+        if not self.cache_path:
+            return
+        line_count = 0
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line_count += 1
+                    try:
+                        entry = json.loads(line)
+                        self._entries[entry['name']] = entry
+                    except (ValueError, KeyError):
+                        continue  # 忽略崩溃时写了一半的行
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning("无法读取元数据缓存 %s: %s", self.cache_path, e)
+            return
+        # 过期条目过多时压缩缓存文件，只保留每个文件的最新条目
+        if line_count > 2 * len(self._entries) + 100:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in self._entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning("无法压缩元数据缓存 %s: %s", self.cache_path, e)
+
+    def _append(self, entry):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.warning("无法写入元数据缓存 %s: %s", self.cache_path, e)
+
+    def lookup(self, image_filename):
+        """
+        仅查询缓存，不解析文件
+        :param image_filename: 图像文件名
+        :return: 缓存有效时返回地理信息字典，否则返回None
+        """
+        stat = os.stat(os.path.join(self.folder_path, image_filename))
+        entry = self._entries.get(image_filename)
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return dict(entry['geo_info'])
+        return None
+
+    def store(self, image_filename, geo_info):
+        """
+        写入一条元数据（内存和磁盘）
+        :param image_filename: 图像文件名
+        :param geo_info: extract_geo_info 返回的字典
+        """
+        stat = os.stat(os.path.join(self.folder_path, image_filename))
+        entry = {
+            'name': image_filename,
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'geo_info': geo_info
+        }
+        with self._lock:
+            self._entries[image_filename] = entry
+            if self.cache_path:
+                self._append(entry)
+
+    def get(self, image_filename):
+        """
+        返回图像的地理信息，缓存未命中或文件已变化时解析并写入缓存
+        :param image_filename: 图像文件名
+        :return: 地理信息字典
+        """
+        geo_info = self.lookup(image_filename)
+        if geo_info is None:
+            geo_info = extract_geo_info(os.path.join(self.folder_path, image_filename))
+            self.store(image_filename, geo_info)
+        return dict(geo_info)
@@ -0,0 +1,214 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = 2               # 执行任务的工作线程数
+JOB_TTL_SECONDS = 600         # 已结束的任务保留多久（秒）供查询
+EVENT_HEARTBEAT_SECONDS = 15  # SSE 连接没有进度更新时发送心跳的间隔（秒）
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """任务已被取消，由 Job.check 在任务函数的检查点抛出"""
+
+
+class Job:
+    """
+    一个后台任务的状态：queued → running → done / failed / cancelled
+    任务函数通过 report 更新进度，并在各阶段之间调用 check 响应取消
+    """
+
+    def __init__(self, kind, scope):
+        """
+        :param kind: 任务类型，如 'detect'
+        :param scope: 任务所属范围的字典（如 {'client', 'image', 'target'}），用于批量取消过期任务
+        """
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.scope = dict(scope or {})
+        self.status = 'queued'
+        self.progress = 0.0
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created = self.updated = time.time()
+        self.version = 0
+        self.future = None
+        self._cancel_event = threading.Event()
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def update(self, **fields):
+        """修改任务状态并唤醒等待进度的订阅者"""
+        with self._condition:
+            for key, value in fields.items():
+                setattr(self, key, value)
+            self.updated = time.time()
+            self.version += 1
+            self._condition.notify_all()
+
+    def check(self):
+        """任务已被取消时抛出 JobCancelled"""
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def report(self, progress, stage):
+        """
+        更新进度，同时作为取消检查点
+        :param progress: 0~1 的进度
+        :param stage: 当前阶段名称
+        """
+        self.check()
+        self.update(progress=progress, stage=stage)
+
+    def wait(self, version, timeout):
+        """
+        等待任务状态版本号变化
+        :return: 最新的版本号（超时时与传入的相同）
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                'job_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'progress': self.progress,
+                'stage': self.stage,
+                'result': self.result,
+                'error': self.error,
+                'created': self.created,
+                'updated': self.updated
+            }
+
+
+class JobQueue:
+    """
+    在线程池中执行耗时任务（如角点检测），请求只负责提交任务并立即返回任务ID，
+    客户端轮询或通过SSE订阅进度；同一范围的新任务提交时自动取消尚未完成的旧任务
+    任务状态只保存在本进程内存中，不共享也不持久化：查询必须发到提交任务的同一个进程，
+    因此使用它的服务器只能以单进程多线程方式部署，重启后所有任务ID失效
+    """
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL_SECONDS):
+        """
+        :param workers: 工作线程数
+        :param ttl: 已结束的任务保留多久（秒）
+        """
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, kind='job', scope=None, supersede=True):
+        """
+        提交任务
+        :param fn: 任务函数 fn(job)，返回值作为任务结果
+        :param kind: 任务类型
+        :param scope: 任务范围字典
+        :param supersede: 是否取消同类型、同范围中尚未完成的旧任务
+        :return: Job
+        """
+        self._purge()
+        if supersede and scope:
+            self.cancel_matching(kind, **scope)
+        job = Job(kind, scope)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        if job._cancel_event.is_set():
+            job.update(status='cancelled')
+            return
+        job.update(status='running')
+        try:
+            result = fn(job)
+        except JobCancelled:
+            job.update(status='cancelled')
+        except Exception as e:
+            logger.error("任务 %s (%s) 失败: %s", job.id, job.kind, e)
+            job.update(status='failed', error=str(e) or type(e).__name__)
+        else:
+            job.update(status='done', progress=1.0, result=result)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        取消任务：尚未开始的任务直接取消，正在执行的任务在下一个检查点停止
+        :return: 任务存在且尚未结束时返回True
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.update(status='cancelled')
+        return True
+
+    def cancel_matching(self, kind=None, **scope):
+        """
+        取消范围包含给定键值的所有未结束任务
+        :param kind: 只取消该类型的任务，None表示全部类型
+        :return: 取消的任务数
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs.values()
+                    if not job.finished and (kind is None or job.kind == kind)
+                    and all(job.scope.get(key) == value for key, value in scope.items())]
+        return sum(1 for job in jobs if self.cancel(job.id))
+
+    def events(self, job_id, heartbeat=EVENT_HEARTBEAT_SECONDS):
+        """
+        以 Server-Sent Events 格式逐条产生任务状态，任务结束后停止
+        :return: 生成器，产生SSE消息字符串
+        """
+        job = self.get(job_id)
+        if job is None:
+            return
+        version = -1
+        while True:
+            latest = job.wait(version, heartbeat)
+            if latest == version:
+                yield ': keepalive\n\n'
+                continue
+            version = latest
+            snapshot = job.snapshot()
+            yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            if snapshot['status'] in FINISHED_STATUSES:
+                return
+
+    def _purge(self):
+        """删除结束超过 ttl 的任务"""
+        expire_before = time.time() - self.ttl
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job.finished and job.updated < expire_before]:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def shutdown(self):
+        """取消所有未结束的任务并关闭线程池"""
+        self.cancel_matching()
+        self._executor.shutdown(wait=False)
@@ -1,23 +1,30 @@
 import os
-import base64
 import io
+import logging
 import webbrowser
-import re
 import time
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file, make_response, Response, g
 from PIL import Image
-import exifread
-import chardet
-from itertools import islice
-from path_select import select_directory
 import threading
 import sys
-import random
+import argparse
+import atexit
 import get_cheese_point as gp
+from folder_index import FolderIndex, IMAGE_EXTENSIONS, CACHE_DIRNAME
+from image_meta import MetadataCache
+from annotation_io import read_text_file, write_text_file, build_header, apply_coordinate_ops
+from undistort import undistort_image, undistort_roi
+from image_cache import DecodedImageCache
+from prefetch import Prefetcher
+from tile_cache import TileCache, tile_grid  # 只依赖已加载的 cv2/numpy/PIL，/api/image 每次都要用到
+from file_lock import locked_file, try_acquire_exclusive
+import rectangle_log
+from metrics import registry as metrics_registry, timed
+from write_behind import WriteBehindBuffer
+from job_queue import JobQueue
+import multiprocessing
 import cv2 
 import numpy as np
-import json
-img_path_global = ""
 
 # 从图片数据中提取参数（使用优化后的值）
 cam_matrix = np.array([
@@ -35,9 +42,38 @@ dist_coeffs = np.array([
 ])
 
 # 全局配置
-FOLDER_PATH = ""
-if not os.path.exists(FOLDER_PATH):
-    FOLDER_PATH = select_directory("请选择一个目录")
+FOLDER_PATH = os.environ.get("LABEL_FOLDER", "")  # 图像文件夹；为空或不存在时弹出目录选择对话框
+PREVIEW_MAX_SIZE = 2048      # 预览图最长边默认像素数
+PREVIEW_SIZE_RANGE = (128, 8192)  # 允许通过 ?size= 请求的预览尺寸范围
+PREVIEW_QUALITY = 85         # 预览图JPEG质量
+IMAGE_CACHE_MAX_AGE = 3600   # 图像响应的浏览器缓存时间（秒），配合ETag校验
+FOLDER_CHECK_INTERVAL = 2.0  # 文件夹索引检查目录变化的最小间隔（秒）
+INGEST_ON_STARTUP = False    # 启动时是否先用进程池批量预处理整个文件夹的元数据和TXT头部
+UNDISTORT_ROI_ONLY = True    # 处理矩形时只对选择区域（加边距）去畸变，而不是整幅图像
+ROI_MARGIN = 64              # 局部去畸变时选择区域外扩的像素数
+SUPPRESS_BACKGROUND = False  # 检测角点前是否把选择区域内的草地等背景替换为绿色；请求可通过 suppress_background 单独指定
+DECODED_CACHE_BYTES = 768 * 1024 * 1024  # 解码图像LRU缓存的字节预算
+PREFETCH_RADIUS = 2          # 访问某张图像时在后台预取前后各多少张图像
+PREFETCH_WORKERS = 2         # 后台预取线程数
+DETECT_WORKERS = 2           # 异步角点检测任务的工作线程数
+SERVER_HOST = 'localhost'
+SERVER_PORT = 5000
+SERVER_THREADS = 8           # 生产模式(waitress)下的工作线程数
+SHUTDOWN_ON_CLIENT_EXIT = True  # 浏览器页面关闭时是否关闭服务器；多人共用服务器时应设为False
+LOG_LEVEL = 'INFO'           # 日志级别；设为 'DEBUG' 时输出检测到的坐标等调试信息
+SLOW_REQUEST_MS = 1000       # 超过该耗时（毫秒）的请求记录各阶段耗时到慢请求日志，None表示关闭
+GROUND_ALTITUDE = None       # 地面海拔高度（米），用于估计图像的地面覆盖范围；None时按最低拍摄高度估计
+DEDUP_MAX_DISTANCE = 6       # 感知哈希汉明距离不超过该值的连续帧视为几乎相同（/api/images?dedup=1）
+_folder_index = None
+_metadata_cache = None
+_annotation_db = None
+_footprint_index = None
+_footprint_key = None
+_tile_cache = None
+_frame_clusters = None
+_frame_clusters_key = None
+_server_lock = None  # (图像文件夹, 锁文件对象)，保证一个文件夹只由一个服务进程使用
+image_cache = DecodedImageCache(DECODED_CACHE_BYTES)
 
 # Flask应用设置
 if getattr(sys, 'frozen', False):
@@ -50,272 +86,620 @@ else:
     app = Flask(__name__, static_folder=static_folder, static_url_path='/static')
 
 shutdown_event = threading.Event()
+logger = logging.getLogger('label_exe')
 
 # 辅助函数
 
-def convert_gps(coordinate, ref):
+def get_cache_dir():
+    """返回当前图像文件夹的缓存子目录路径"""
+    return os.path.join(FOLDER_PATH, CACHE_DIRNAME)
+
+def get_lock_dir():
+    """返回存放TXT/JSON写入锁文件的目录"""
+    return os.path.join(get_cache_dir(), 'locks')
+
+def claim_folder():
     """
-    将度、分、秒转换为十进制坐标
-    :param coordinate: GPS坐标值
-    :param ref: 方向参考 ('N', 'S', 'E', 'W')
-    :return: 十进制坐标
+    获取当前图像文件夹的服务进程锁（.label_cache/server.lock），进程退出时自动释放
+    尚未写入的坐标修改和后台任务只保存在本进程内存中，另一个进程同时提供服务会读到过期的TXT并覆盖这些修改
+    :return: 本进程持有该文件夹时返回True
     """
-    d = float(coordinate.values[0].num) / coordinate.values[0].den
-    m = float(coordinate.values[1].num) / coordinate.values[1].den
-    s = float(coordinate.values[2].num) / coordinate.values[2].den
-    decimal = d + m / 60 + s / 3600
-    return -decimal if ref in ['S', 'W'] else decimal
+    global _server_lock
+    if _server_lock is not None and _server_lock[0] == FOLDER_PATH:
+        return True
+    handle = try_acquire_exclusive(os.path.join(get_cache_dir(), 'server.lock'))
+    if handle is None:
+        return False
+    if _server_lock is not None:
+        _server_lock[1].close()
+    _server_lock = (FOLDER_PATH, handle)
+    return True
 
-def extract_geo_info(image_path):
+def get_folder_index():
     """
-    从图像中提取GPS和云台姿态信息
-    :param image_path: 图像文件的完整路径
-    :return: 包含纬度、经度、高度和云台翻滚、俯仰、偏航角度的字典
+    返回当前图像文件夹的索引，首次调用或文件夹改变时构建
+    :return: FolderIndex 实例
     """
-    geo_data = {
-        'Latitude': None, 'Longitude': None, 'Altitude': None,
-        'GimbalRoll': None, 'GimbalPitch': None, 'GimbalYaw': None
-    }
-    try:
-        with open(image_path, 'rb') as f:
-            tags = exifread.process_file(f)
-        data = bytearray()
-        with open(image_path, 'rb') as img:
-            flag = False
-            xmp_description_start = b"\x3c\x72\x64\x66\x3a\x44\x65\x73\x63\x72\x69\x70\x74\x69\x6f\x6e\x20"
-            xmp_description_end = b"\x3c\x2f\x72\x64\x66\x3a\x44\x65\x73\x63\x72\x69\x70\x74\x69\x6f\x6e\x3e"
-            for line in img.readlines():
-                if xmp_description_start in line:
-                    flag = True
-                if flag:
-                    data += line
-                if xmp_description_end in line:
-                    break
-            dj_data_dict = {}
-            if data:
-                try:
-                    data_str = data.decode('ascii', errors='ignore')
-                    lines = [d.strip()[10:] for d in data_str.split("\n") if 'drone-dji:' in d]
-                    for d in lines:
-                        if '=' in d:
-                            k, v = d.split("=", 1)
-                            dj_data_dict[k.strip()] = v.strip()
-                except Exception:
-                    print(f"Warning: 无法用ASCII解码 {image_path} 的DJI数据，跳过解析")
-    except Exception as e:
-        print(f"提取DJI元数据块时出错: {e}")
+    global _folder_index
+    if _folder_index is None or _folder_index.folder_path != FOLDER_PATH:
+        _folder_index = FolderIndex(FOLDER_PATH, IMAGE_EXTENSIONS, check_interval=FOLDER_CHECK_INTERVAL,
+                                    cache_dir=get_cache_dir())
+    return _folder_index
 
-    if 'GPS GPSLatitude' in tags and 'GPS GPSLatitudeRef' in tags:
-        try:
-            geo_data['Latitude'] = convert_gps(tags['GPS GPSLatitude'], tags['GPS GPSLatitudeRef'].values)
-        except Exception as e:
-            print(f"解析 {image_path} 的纬度时出错: {e}")
-    if 'GPS GPSLongitude' in tags and 'GPS GPSLongitudeRef' in tags:
-        try:
-            geo_data['Longitude'] = convert_gps(tags['GPS GPSLongitude'], tags['GPS GPSLongitudeRef'].values)
-        except Exception as e:
-            print(f"解析 {image_path} 的经度时出错: {e}")
-    if 'GPS GPSAltitude' in tags:
-        try:
-            alt = tags['GPS GPSAltitude'].values[0]
-            geo_data['Altitude'] = float(alt.num) / alt.den
-        except Exception as e:
-            print(f"解析 {image_path} 的高度时出错: {e}")
+def get_metadata_cache():
+    """
+    返回当前图像文件夹的元数据缓存，首次调用或文件夹改变时加载
+    :return: MetadataCache 实例
+    """
+    global _metadata_cache
+    if _metadata_cache is None or _metadata_cache.folder_path != FOLDER_PATH:
+        _metadata_cache = MetadataCache(FOLDER_PATH, cache_dir=get_cache_dir())
+    return _metadata_cache
 
-    euler_angle_tags_map = {
-        'GimbalRoll': 'GimbalRollDegree',
-        'GimbalPitch': 'GimbalPitchDegree',
-        'GimbalYaw': 'GimbalYawDegree'
-    }
-    for key, tag_name in euler_angle_tags_map.items():
-        if tag_name in dj_data_dict:
-            value_str = dj_data_dict[tag_name]
-            try:
-                geo_data[key] = float(value_str)
-            except ValueError:
-                print(f"Warning: {image_path} 中 '{tag_name}' 的云台值 ('{value_str}') 不是简单的浮点数，存储为原始字符串")
-                geo_data[key] = value_str
-            except Exception as e:
-                print(f"处理 {image_path} 的云台标签 {tag_name} 时出错: {e}")
-    return geo_data
-
-def read_text_file(txt_file_path):
-    """
-    读取文本文件，返回前8行和坐标列表
-    :param txt_file_path: 文本文件的完整路径
-    :return: (header_lines, coordinates_list)
-    """
-    header = []
-    raw_coordinates = []
-    try:
-        with open(txt_file_path, 'rb') as raw_file:
-            detector = chardet.detect(raw_file.read())
-            encoding = detector['encoding'] if detector['encoding'] else 'utf-8'
-        with open(txt_file_path, 'r', encoding=encoding, errors='replace') as f:
-            lines = f.readlines()
-            header = lines[:8]
-            for line in islice(lines, 8, None):
-                coord = parse_coordinate_line(line.strip())
-                raw_coordinates.append(coord)
-    except FileNotFoundError:
-        print(f"Warning: 未找到文本文件: {txt_file_path}，返回空数据")
-        return [], [None]
-    except Exception as e:
-        print(f"读取文本文件 {txt_file_path} 时出错: {e}")
-        return [], [None]
+def get_annotation_db():
+    """
+    返回当前图像文件夹的标注数据库，首次调用或文件夹改变时打开
+    :return: AnnotationDB 实例
+    """
+    global _annotation_db
+    if _annotation_db is None or _annotation_db.folder_path != FOLDER_PATH:
+        from annotation_db import open_folder_db  # 第一次保存或导出时才加载
+        _annotation_db = open_folder_db(FOLDER_PATH, get_cache_dir())
+    return _annotation_db
 
-    valid_coordinates = [coord for coord in raw_coordinates if coord is not None]
-    coordinates = valid_coordinates if valid_coordinates else [None]
-    print(f"Debug: 从 {txt_file_path} 读取。原始: {raw_coordinates}。处理后: {coordinates}")
-    return header, coordinates
+def sync_annotation_db(image_files=None):
+    """
+    将TXT/JSON标注同步到标注数据库
+    :param image_files: 只同步这些图像（批量写入TXT之后），None表示同步整个文件夹（逐个检查文件修改时间，较慢）
+    :return: 实际更新的图像数量
+    """
+    coordinate_buffer.flush()
+    if image_files is None:
+        return get_annotation_db().sync_folder(FOLDER_PATH, list_image_files(), get_metadata_cache())
+    return get_annotation_db().sync_files(FOLDER_PATH, image_files, get_metadata_cache())
 
-def write_text_file(txt_file_path, header, coordinates):
+def get_export_db():
     """
-    将头部信息和坐标列表写入文本文件
-    :param txt_file_path: 文本文件的完整路径
-    :param header: 包含前8行的字符串列表
-    :param coordinates: (x, y) 或 (x, y, target_number) 元组或 None 的列表
+    返回用于导出的标注数据库：保存坐标和矩形时已增量更新数据库，只写入尚未写入的坐标修改，
+    还没有从文件夹全量同步过时先同步一次；之后批处理脚本直接修改的TXT需要先调用 /api/export/sync
+    :return: AnnotationDB 实例
     """
-    try:
-        with open(txt_file_path, 'w', encoding='utf-8') as f:
-            for line in header:
-                f.write(line)
-            valid_coords_to_write = [coord for coord in coordinates if coord is not None]
-            if not valid_coords_to_write:
-                f.write("x none y none\n")
-            else:
-                for coord in valid_coords_to_write:
-                    if len(coord) >= 3:
-                        f.write(f"靶标 {coord[2]}: x {coord[0]} y {coord[1]}\n")
-                    else:
-                        f.write(f"x {coord[0]} y {coord[1]}\n")
-        # print(f"Debug: 已将坐标保存到 {txt_file_path}。写入的数据: {valid_coords_to_write if valid_coords_to_write else '[None]'}")
-    except Exception as e:
-        print(f"写入文本文件 {txt_file_path} 时出错: {e}")
+    coordinate_buffer.flush()
+    db = get_annotation_db()
+    if not db.folder_synced():
+        db.sync_folder(FOLDER_PATH, list_image_files(), get_metadata_cache())
+    return db
 
-def parse_coordinate_line(line):
+def get_tile_cache():
     """
-    解析坐标字符串行，如 "x 123 y 456 target 1" 或 "x none y none"
-    :return: (x, y, target_number) 元组，或如果行表示 '无注释' 或解析失败则返回 None
+    返回当前图像文件夹的瓦片缓存，首次调用或文件夹改变时创建
+    :return: TileCache 实例
     """
-    parts = line.strip().split()
-    if len(parts) >= 4 and parts[2] == "x" and parts[4] == "y":
-        x_val = parts[3].lower()
-        y_val = parts[5].lower()
-        if x_val == "none" and y_val == "none":
-            return None
+    global _tile_cache
+    if _tile_cache is None or _tile_cache.tiles_dir != os.path.join(get_cache_dir(), 'tiles'):
+        _tile_cache = TileCache(get_cache_dir(), image_cache)
+    return _tile_cache
+
+def get_footprint_index(ground_altitude=None):
+    """
+    返回当前文件夹所有图像地面覆盖范围的空间索引，文件列表或地面高度改变时重建
+    :param ground_altitude: 地面海拔高度（米），默认使用 GROUND_ALTITUDE
+    :return: FootprintIndex 实例
+    """
+    global _footprint_index, _footprint_key
+    if ground_altitude is None:
+        ground_altitude = GROUND_ALTITUDE
+    image_files = list_image_files()
+    key = (FOLDER_PATH, tuple(image_files), ground_altitude)
+    if _footprint_index is None or _footprint_key != key:
+        from batch_ingest import build_flight_table  # 空间查询功能按需加载
+        from spatial_index import FootprintIndex
+        metadata_cache = get_metadata_cache()
+        flight = build_flight_table(image_files, [metadata_cache.get(name) for name in image_files])
+        image_size = (0, 0)
+        if image_files:
+            with Image.open(os.path.join(FOLDER_PATH, image_files[0])) as img:
+                image_size = img.size
+        _footprint_index = FootprintIndex(flight, cam_matrix, image_size, ground_altitude)
+        _footprint_key = key
+    return _footprint_index
+
+def get_frame_clusters(max_distance=None):
+    """
+    返回按感知哈希分组的几乎相同的连续帧，文件列表或距离阈值改变时重新分组（未变化的图像使用缓存的哈希）
+    :param max_distance: 视为几乎相同的最大汉明距离，默认使用 DEDUP_MAX_DISTANCE
+    :return: [[代表帧文件名, 其余文件名...], ...]
+    """
+    global _frame_clusters, _frame_clusters_key
+    if max_distance is None:
+        max_distance = DEDUP_MAX_DISTANCE
+    image_files = list_image_files()
+    key = (FOLDER_PATH, tuple(image_files), max_distance)
+    if _frame_clusters is None or _frame_clusters_key != key:
+        from frame_dedup import compute_hashes, cluster_frames  # 跳过近重复帧功能按需加载
+        with timed('dedup.cluster'):
+            hashes = compute_hashes(FOLDER_PATH, image_files, get_cache_dir())
+            _frame_clusters = cluster_frames(image_files, hashes, max_distance)
+        _frame_clusters_key = key
+        logger.info("%s 张图像分为 %s 组几乎相同的连续帧", len(image_files), len(_frame_clusters))
+    return _frame_clusters
+
+def list_image_files():
+    """
+    返回图像文件夹中按文件名排序的图像文件列表
+    :return: 图像文件名列表
+    """
+    return get_folder_index().files()
+
+def resolve_image_filename(index=None, filename=None):
+    """
+    根据请求中的文件名或索引确定图像文件名
+    文件名优先，不受其他用户在文件夹中增删图像导致的索引变化影响
+    :param index: 图像列表中的索引
+    :param filename: 图像文件名
+    :return: 图像文件名，无效时返回None
+    """
+    folder_index = get_folder_index()
+    if filename:
+        return filename if folder_index.index_of(filename) is not None else None
+    if index is not None:
         try:
-            x = int(x_val)
-            y = int(y_val)
-            target_number = None
-            if len(parts) >= 6:
-                try:
-                    target_number = int(re.findall(r'\d+', parts[1])[0])
-                except ValueError:
-                    print(f"Warning: 坐标行中靶标号码格式无效: {line.strip()}")
-            if target_number is not None:
-                return (x, y, target_number)
-            else:
-                return (x, y)
-        except ValueError:
-            print(f"Warning: 坐标行中数字格式无效: {line.strip()}")
+            return folder_index.filename(int(index))
+        except (TypeError, ValueError):
             return None
     return None
 
+def render_preview(image_path, max_size):
+    """
+    生成最长边不超过 max_size 的JPEG预览图
+    已解码的图像在缓存中时直接缩放；否则对JPEG使用 draft 模式在解码阶段按DCT缩放，避免完整解码全分辨率图像
+    :param image_path: 图像文件的完整路径
+    :param max_size: 预览图最长边像素数
+    :return: JPEG字节数据
+    """
+    with timed('preview.render'):
+        decoded = image_cache.peek(image_path, 'bgr')
+        if decoded is not None:
+            height, width = decoded.shape[:2]
+            scale = min(1.0, max_size / max(width, height))
+            resized = cv2.resize(decoded, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                 interpolation=cv2.INTER_AREA)
+            ok, encoded = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_QUALITY])
+            if ok:
+                return encoded.tobytes()
+        with Image.open(image_path) as img:
+            img.draft('RGB', (max_size, max_size))
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.thumbnail((max_size, max_size), Image.BILINEAR)
+            img_byte_arr = io.BytesIO()
+            img.save(img_byte_arr, format='JPEG', quality=PREVIEW_QUALITY)
+        return img_byte_arr.getvalue()
+
+def get_preview_bytes(image_path, max_size):
+    """
+    返回缓存的预览图，未命中时生成并放入缓存
+    :param image_path: 图像文件的完整路径
+    :param max_size: 预览图最长边像素数
+    :return: JPEG字节数据
+    """
+    return image_cache.get(image_path, f'preview-{max_size}', lambda path: render_preview(path, max_size))
+
+def warm_image(index):
+    """
+    预热指定索引图像的元数据、坐标和默认尺寸预览图，供后台预取使用
+    :param index: 图像列表中的索引
+    """
+    image_filename = get_folder_index().filename(index)
+    if image_filename is None:
+        return
+    get_metadata_cache().get(image_filename)
+    base_name = os.path.splitext(image_filename)[0]
+    txt_path = os.path.join(FOLDER_PATH, f"{base_name}.txt")
+    if os.path.exists(txt_path):
+        read_text_file(txt_path)
+    get_preview_bytes(os.path.join(FOLDER_PATH, image_filename), PREVIEW_MAX_SIZE)
+
+prefetcher = Prefetcher(warm_image, radius=PREFETCH_RADIUS, workers=PREFETCH_WORKERS)
+job_queue = JobQueue(workers=DETECT_WORKERS)
+
+def flush_coordinates(image_filename, state):
+    """
+    将合并后的坐标修改写入TXT并更新标注数据库，由 coordinate_buffer 在后台调用
+    只有TXT写入失败才抛出异常让 coordinate_buffer 重试；数据库只是TXT的索引，更新失败时与 save_coordinates_data 一样只记录日志
+    :param image_filename: 图像文件名
+    :param state: (header_lines, coordinates)
+    """
+    header, coordinates = state
+    base_name = os.path.splitext(image_filename)[0]
+    txt_path = os.path.join(FOLDER_PATH, f"{base_name}.txt")
+    with timed('txt.write'), locked_file(txt_path, get_lock_dir()):
+        if not write_text_file(txt_path, header, coordinates):
+            raise OSError(f"写入 {txt_path} 失败")
+    try:
+        with timed('db.save_points'):
+            get_annotation_db().save_points(image_filename, get_metadata_cache().get(image_filename), coordinates)
+    except Exception as e:
+        logger.exception("更新标注数据库时出错: %s", e)
+
+def load_text_state(image_filename, geo_info):
+    """
+    读取图像对应TXT的头部和坐标；文件不存在、为空或头部不完整时重新初始化，直接使用写入的内容而不再读取一次
+    :param image_filename: 图像文件名
+    :param geo_info: 地理信息字典
+    :return: (header_lines, coordinates)
+    """
+    base_name = os.path.splitext(image_filename)[0]
+    txt_path = os.path.join(FOLDER_PATH, f"{base_name}.txt")
+    with timed('txt.read'), locked_file(txt_path, get_lock_dir()):
+        header, coordinates = read_text_file(txt_path)
+        if len(header) < 8:
+            header = build_header(image_filename, geo_info)
+            write_text_file(txt_path, header, coordinates)
+            logger.debug("为 %s 重新初始化TXT文件", image_filename)
+    return header, coordinates
+
+# 未写入的修改只保存在本进程内存中，claim_folder 保证同一个文件夹只有一个服务进程
+coordinate_buffer = WriteBehindBuffer(flush_coordinates)
+atexit.register(coordinate_buffer.flush)
+
 # Flask路由
 
+@app.before_request
+def start_request_timer():
+    """记录请求开始时间，并开始收集本请求内各阶段的耗时"""
+    g.start_time = time.perf_counter()
+    metrics_registry.begin_request()
+
+@app.before_request
+def require_single_process():
+    """另一个进程已在为该文件夹提供服务时拒绝API请求，避免多进程部署时覆盖对方尚未写入的修改"""
+    if request.path.startswith('/api/') and not claim_folder():
+        return jsonify({'error': '该图像文件夹已由另一个服务进程提供服务，本服务器只能以单进程多线程方式部署'}), 503
+
+@app.after_request
+def record_request_time(response):
+    """按路由汇总请求耗时，超过 SLOW_REQUEST_MS 时记录各阶段耗时"""
+    start_time = g.get('start_time')
+    stages = metrics_registry.end_request()
+    if start_time is None:
+        return response
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    metrics_registry.observe(f'request.{request.endpoint or "unknown"}', elapsed_ms)
+    if SLOW_REQUEST_MS is not None and elapsed_ms > SLOW_REQUEST_MS:
+        logger.warning("慢请求 method=%s path=%s status=%s total_ms=%.1f stages=%s",
+                       request.method, request.path, response.status_code, elapsed_ms,
+                       ' '.join(f'{name}:{value:.1f}' for name, value in stages))
+    return response
+
 @app.route('/')
 def index():
     """根路由，提供HTML页面"""
     return send_from_directory('static', 'index.html')
 
 
+def rectangle_corners(rectangle):
+    """
+    由前端发送的矩形（两个对角点）得到四个角点
+    :param rectangle: [[x0, y0], [x1, y1]]
+    :return: [[x, y], ...] 左上→右上→右下→左下
+    """
+    return [
+        [rectangle[0][0], rectangle[0][1]],
+        [rectangle[1][0], rectangle[0][1]],
+        [rectangle[1][0], rectangle[1][1]],
+        [rectangle[0][0], rectangle[1][1]]
+    ]
+
+def detect_rectangle(image_filename, corners, target=None, roi_only=UNDISTORT_ROI_ONLY,
+                     suppress_background=SUPPRESS_BACKGROUND, job=None):
+    """
+    在矩形区域内检测棋盘格角点，并把矩形追加到该图像的矩形记录
+    :param image_filename: 图像文件名
+    :param corners: 矩形四个角点
+    :param target: 靶标编号（记录下来供批量检测时回写TXT）
+    :param roi_only: 是否只对选择区域去畸变
+    :param suppress_background: 检测前是否把选择区域内的背景替换为绿色
+    :param job: 作为异步任务执行时的 Job，用于报告进度和响应取消；任务被取消时不保存矩形
+    :return: 检测到的点列表 [[x, y], ...]
+    """
+    def report(progress, stage):
+        if job is not None:
+            job.report(progress, stage)
+
+    image_path = os.path.join(FOLDER_PATH, image_filename)
+    # 矩形记录追加写入 <图像名>.rectangles.jsonl，定期合并到 <图像名>.json
+    json_path = rectangle_log.snapshot_path(image_path)
+
+    # 创建新的矩形数据（记录靶标编号，供批量检测时回写TXT）
+    new_rectangle = {
+        "corners": corners,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    if target is not None:
+        new_rectangle["target"] = target
+
+    # 处理图像并检测点
+    report(0.1, 'decode')
+    with timed('image.decode'):
+        img = image_cache.get_bgr(image_path)
+    if img is None:
+        raise ValueError('无法读取图像，请检查路径')
+
+    report(0.3, 'undistort')
+    if roi_only:
+        # 只对选择区域去畸变，检测结果再平移回整幅图像坐标
+        with timed('undistort.roi'):
+            roi_img, (x0, y0) = undistort_roi(img, cam_matrix, dist_coeffs, corners, ROI_MARGIN)
+        local_corners = [[x - x0, y - y0] for x, y in corners]
+        report(0.5, 'detect')
+        detected_points = gp.auto_detect_corners(roi_img, local_corners, suppress_background=suppress_background) \
+            + np.array([x0, y0], dtype=np.float32)
+    else:
+        with timed('undistort.full'):
+            undistorted = image_cache.get_undistorted(
+                image_path, lambda frame: undistort_image(frame, cam_matrix, dist_coeffs))
+        report(0.5, 'detect')
+        detected_points = gp.auto_detect_corners(undistorted, corners, suppress_background=suppress_background)
+    ans_point = detected_points.tolist()
+    logger.debug("检测到的点: %s", ans_point)
+
+    report(0.9, 'save')
+    # 追加一行记录即可保存，不再读取并重写整个JSON文件
+    with timed('rectangle.append'), locked_file(json_path, get_lock_dir()):
+        saved_rectangle = rectangle_log.append_rectangle(image_path, new_rectangle)
+    try:
+        with timed('db.add_rectangle'):
+            get_annotation_db().add_rectangle(image_filename, saved_rectangle)
+    except Exception as e:
+        logger.exception("更新标注数据库时出错: %s", e)
+
+    logger.debug("已将矩形数据追加到: %s", rectangle_log.log_path(image_path))
+    return ans_point
+
+def detect_all_targets(image_filename, job=None):
+    """
+    扫描整幅去畸变图像检测所有靶标，并按TXT中已有的标注自动分配靶标编号
+    整幅去畸变图像放入解码图像缓存，多次检测或之后的全图去畸变请求可以复用
+    :param image_filename: 图像文件名
+    :param job: 作为异步任务执行时的 Job
+    :return: [{'target': 靶标编号或None, 'points': [[x, y], ...]}, ...]
+    """
+    def report(progress, stage):
+        if job is not None:
+            job.report(progress, stage)
+
+    image_path = os.path.join(FOLDER_PATH, image_filename)
+    report(0.1, 'undistort')
+    with timed('undistort.full'):
+        undistorted = image_cache.get_undistorted(
+            image_path, lambda frame: undistort_image(frame, cam_matrix, dist_coeffs))
+    if undistorted is None:
+        raise ValueError('无法读取图像，请检查路径')
+    report(0.4, 'propose')
+    regions = gp.propose_board_regions(undistorted)
+    report(0.5, 'detect')
+    boards = gp.detect_all_boards(undistorted, regions)
+    report(0.9, 'assign')
+    from batch_detect import assign_targets  # 批处理模块按需加载
+    pending = coordinate_buffer.get(image_filename)
+    coordinates = pending[1] if pending is not None else \
+        load_text_state(image_filename, get_metadata_cache().get(image_filename))[1]
+    return [{'target': target, 'points': points} for target, points in assign_targets(boards, coordinates)]
+
 @app.route('/api/process_rectangle', methods=['POST'])
 def process_rectangle():
+    """API路由，同步检测矩形内的棋盘格角点；界面使用异步的 /api/jobs/detect，该路由保留给脚本调用"""
     data = request.get_json()
     rectangle = data.get('rectangle')
     if not rectangle:
         return jsonify({'error': 'Invalid rectangle data'}), 400
 
-    # 提取矩形的角点
-    corners = [
-        [rectangle[0][0], rectangle[0][1]],
-        [rectangle[1][0], rectangle[0][1]],
-        [rectangle[1][0], rectangle[1][1]],
-        [rectangle[0][0], rectangle[1][1]]
-    ]
-    global img_path_global  # 使用全局变量
-    image_path = img_path_global  # 当前处理的图像路径
-    
-    # 检查图像路径是否有效
-    if not image_path or not os.path.exists(image_path):
+    # 图像由请求显式指定，多个标注员/标签页同时工作时互不影响
+    image_filename = resolve_image_filename(data.get('index'), data.get('filename'))
+    if image_filename is None:
         return jsonify({'error': '无效的图像路径'}), 400
-    
-    # 创建JSON文件路径（与图像同名但扩展名为.json）
-    json_path = os.path.splitext(image_path)[0] + '.json'
-    
-    # 保存矩形数据到JSON文件（追加而不是覆盖）
     try:
-        # 如果文件已存在，读取现有数据
-        existing_data = []
-        if os.path.exists(json_path):
-            try:
-                with open(json_path, 'r') as f:
-                    existing_data = json.load(f)
-                    if not isinstance(existing_data, list):
-                        existing_data = [existing_data]  # 如果数据不是列表，转换为列表
-            except json.JSONDecodeError:
-                print(f"警告: JSON文件 {json_path} 格式无效，将创建新文件")
-                existing_data = []
-        
-        # 创建新的矩形数据
-        new_rectangle = {
-            "corners": corners,
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        
+        return jsonify(detect_rectangle(image_filename, rectangle_corners(rectangle), data.get('target'),
+                                        data.get('roi_only', UNDISTORT_ROI_ONLY),
+                                        data.get('suppress_background', SUPPRESS_BACKGROUND)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"保存矩形数据到JSON文件时出错: {e}")
-        return jsonify({'error': f'保存矩形数据失败: {str(e)}'}), 500
+        logger.error("处理矩形时出错: %s", e)
+        return jsonify({'error': f'处理矩形时出错: {str(e)}'}), 500
 
-    # 处理图像并检测点
-    img = cv2.imread(image_path)
-    if img is None:
-        return jsonify({'error': '无法读取图像，请检查路径'}), 400
-    
+@app.route('/api/jobs/detect', methods=['POST'])
+def submit_detect_job():
+    """
+    API路由，提交异步角点检测任务后立即返回，检测在后台线程池中执行
+    请求JSON与 /api/process_rectangle 相同（'rectangle', 'index'/'filename', 'target', 'roi_only', 'suppress_background'），
+    另有 'client': 客户端（标签页）标识；
+    同一客户端对同一图像、同一靶标提交新矩形时，尚未完成的旧任务会被取消
+    :return: 202 {'job_id', 'status', 'url', 'events_url'}
+    """
+    data = request.get_json() or {}
+    rectangle = data.get('rectangle')
+    if not rectangle:
+        return jsonify({'error': 'Invalid rectangle data'}), 400
+    image_filename = resolve_image_filename(data.get('index'), data.get('filename'))
+    if image_filename is None:
+        return jsonify({'error': '无效的图像路径'}), 400
+    corners = rectangle_corners(rectangle)
+    target = data.get('target')
+    roi_only = data.get('roi_only', UNDISTORT_ROI_ONLY)
+    suppress_background = data.get('suppress_background', SUPPRESS_BACKGROUND)
+    job = job_queue.submit(lambda job: detect_rectangle(image_filename, corners, target, roi_only,
+                                                        suppress_background, job),
+                           kind='detect',
+                           scope={'client': data.get('client'), 'image': image_filename, 'target': target})
+    return jsonify({'job_id': job.id, 'status': job.status, 'url': f'/api/jobs/{job.id}',
+                    'events_url': f'/api/jobs/{job.id}/events'}), 202
+
+@app.route('/api/jobs/detect_all', methods=['POST'])
+def submit_detect_all_job():
+    """
+    API路由，提交整幅图像多靶标检测任务，不需要画矩形
+    请求JSON: {'index' 或 'filename': 图像, 'client': 客户端标识}
+    任务结果: [{'target': 自动分配的靶标编号, 'points': 角点列表}, ...]
+    :return: 202 {'job_id', 'status', 'url', 'events_url'}
+    """
+    data = request.get_json() or {}
+    image_filename = resolve_image_filename(data.get('index'), data.get('filename'))
+    if image_filename is None:
+        return jsonify({'error': '无效的图像路径'}), 400
+    job = job_queue.submit(lambda job: detect_all_targets(image_filename, job), kind='detect_all',
+                           scope={'client': data.get('client'), 'image': image_filename})
+    return jsonify({'job_id': job.id, 'status': job.status, 'url': f'/api/jobs/{job.id}',
+                    'events_url': f'/api/jobs/{job.id}/events'}), 202
+
+def unknown_job_response(job_id):
+    """任务ID不存在时的响应：任务只保存在提交它的服务进程内存中，结束 job_queue.ttl 秒后删除"""
+    return jsonify({
+        'job_id': job_id,
+        'status': 'unknown',
+        'error': f'任务 {job_id} 不存在：可能已结束超过 {job_queue.ttl} 秒被删除，或服务器已重启；'
+                 f'任务只保存在提交它的服务进程中，服务器必须以单进程方式部署'
+    }), 404
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """API路由，GET 查询任务状态和结果，DELETE 取消任务"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return unknown_job_response(job_id)
+    if request.method == 'DELETE':
+        return jsonify({'cancelled': job_queue.cancel(job_id)})
+    return jsonify(job.snapshot())
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """API路由，以 Server-Sent Events 推送任务进度，任务结束后关闭连接"""
+    if job_queue.get(job_id) is None:
+        return unknown_job_response(job_id)
+    return Response(job_queue.events(job_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs/cancel', methods=['POST'])
+def cancel_jobs():
+    """
+    API路由，取消一个客户端尚未完成的任务（例如切换图像时）
+    请求JSON: {'client': 客户端标识, 'index' 或 'filename': 只取消该图像的任务（可选）}
+    """
+    data = request.get_json() or {}
+    if not data.get('client'):
+        return jsonify({'error': '缺少客户端标识'}), 400
+    scope = {'client': data['client']}
+    if data.get('index') is not None or data.get('filename'):
+        image_filename = resolve_image_filename(data.get('index'), data.get('filename'))
+        if image_filename is None:
+            return jsonify({'error': '无效的图像路径'}), 400
+        scope['image'] = image_filename
+    return jsonify({'cancelled': job_queue.cancel_matching(**scope)})
+
+
+@app.route('/api/rectangles/<int:index>')
+def get_rectangles(index):
+    """
+    API路由，返回指定图像保存过的全部矩形记录
+    :param index: 图像列表中的索引
+    """
     try:
-        undistorted = cv2.undistort(img, cam_matrix, dist_coeffs)
-        detected_points = gp.auto_detect_corners(undistorted, corners)
-        ans_point = detected_points.tolist()
-        print(ans_point)
-        # 将新数据添加到现有数据中
-        existing_data.append(new_rectangle)
-        
-        # 保存更新后的数据
-        with open(json_path, 'w') as f:
-            json.dump(existing_data, f, indent=4)
-        
-        print(f"已将矩形数据追加到: {json_path} (当前矩形数: {len(existing_data)})")
-        return jsonify(ans_point)
+        image_filename = get_folder_index().filename(index)
+        if image_filename is None:
+            return jsonify({'error': '图像索引超出范围'}), 404
+        image_path = os.path.join(FOLDER_PATH, image_filename)
+        return jsonify({'filename': image_filename, 'rectangles': rectangle_log.read_rectangles(image_path)})
     except Exception as e:
-        print(f"处理矩形时出错: {e}")
-        return jsonify({'error': f'处理矩形时出错: {str(e)}'}), 500
-
+        logger.exception("/api/rectangles/%s 出错: %s", index, e)
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/images')
 def get_image_list():
-    """API路由，返回图像文件列表"""
+    """
+    API路由，返回图像文件列表
+    提供查询参数 offset/limit 时分页返回 {'total', 'offset', 'files'}，否则返回完整列表；
+    dedup=1 时每组几乎相同的连续帧只返回代表帧 {'total', 'files', 'indices': 代表帧在完整列表中的索引,
+    'cluster_sizes': 各组帧数}，可用 max_distance 指定汉明距离阈值
+    """
     try:
-        image_files = [f for f in os.listdir(FOLDER_PATH) if f.lower().endswith(('.jpeg', '.jpg', '.png'))]
-        image_files.sort()
+        image_files = list_image_files()
         if not image_files:
-            print(f"Warning: 在 '{FOLDER_PATH}' 中未找到图像文件，请确保已放置图像")
+            logger.warning("在 '%s' 中未找到图像文件，请确保已放置图像", FOLDER_PATH)
+        if request.args.get('dedup') == '1':
+            clusters = get_frame_clusters(request.args.get('max_distance', type=int))
+            folder_index = get_folder_index()
+            return jsonify({'total': len(image_files),
+                            'files': [cluster[0] for cluster in clusters],
+                            'indices': [folder_index.index_of(cluster[0]) for cluster in clusters],
+                            'cluster_sizes': [len(cluster) for cluster in clusters]})
+        if 'offset' in request.args or 'limit' in request.args:
+            offset = request.args.get('offset', 0, type=int)
+            limit = request.args.get('limit', len(image_files), type=int)
+            total, page_files = get_folder_index().page(offset, limit)
+            return jsonify({'total': total, 'offset': offset, 'files': page_files})
         return jsonify(image_files)
     except FileNotFoundError:
-        print(f"Error: 未找到图像文件夹 '{FOLDER_PATH}'，请创建并放置图像")
+        logger.error("未找到图像文件夹 '%s'，请创建并放置图像", FOLDER_PATH)
         return jsonify({'error': f"图像文件夹 '{FOLDER_PATH}' 未找到"}), 500
     except Exception as e:
-        print(f"列出图像时出错: {e}")
+        logger.exception("列出图像时出错: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/dedup/copy_annotations', methods=['POST'])
+def copy_dedup_annotations():
+    """
+    API路由，把指定帧的靶标点复制到同组几乎相同的其余帧
+    请求JSON: {'index' 或 'filename': 作为复制来源的帧, 或 'all': True 把每组代表帧的标注复制到该组其余帧,
+              'overwrite': 是否覆盖已有标注的帧, 'max_distance': 汉明距离阈值}
+    :return: {'copied': 写入的文件名列表, 'clusters': 处理的组数}
+    """
+    data = request.get_json() or {}
+    try:
+        coordinate_buffer.flush()
+        clusters = get_frame_clusters(data.get('max_distance'))
+        if data.get('all'):
+            selected = [cluster for cluster in clusters if len(cluster) > 1]
+            image_filename = None
+        else:
+            image_filename = resolve_image_filename(data.get('index'), data.get('filename'))
+            if image_filename is None:
+                return jsonify({'error': '无效的图像路径'}), 400
+            selected = [cluster for cluster in clusters if image_filename in cluster]
+        from frame_dedup import copy_cluster_annotations
+        copied = []
+        for cluster in selected:
+            copied.extend(copy_cluster_annotations(FOLDER_PATH, cluster, get_metadata_cache(), get_lock_dir(),
+                                                   data.get('overwrite', False), source=image_filename))
+        if copied:
+            sync_annotation_db(copied)
+        return jsonify({'copied': copied, 'clusters': len(selected)})
+    except Exception as e:
+        logger.exception("复制近重复帧的标注时出错: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/frames_at')
+def get_frames_at():
+    """
+    API路由，返回地面覆盖范围包含给定经纬度的所有图像
+    查询参数: lat, lon, 可选 ground_altitude
+    """
+    try:
+        latitude = float(request.args['lat'])
+        longitude = float(request.args['lon'])
+        ground_altitude = request.args.get('ground_altitude', type=float)
+    except (KeyError, ValueError):
+        return jsonify({'error': '需要数字参数 lat 和 lon'}), 400
+    try:
+        footprint_index = get_footprint_index(ground_altitude)
+        index = get_folder_index()
+        frames = footprint_index.query(latitude, longitude)
+        for frame in frames:
+            frame['index'] = index.index_of(frame['filename'])
+        return jsonify({'frames': frames, 'count': len(frames),
+                        'ground_altitude': footprint_index.ground_altitude})
+    except Exception as e:
+        logger.exception("查询图像覆盖范围时出错: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/image/<int:index>')
@@ -325,53 +709,103 @@ def get_image_data(index):
     :param index: 图像列表中的索引
     """
     try:
-        image_files = [f for f in os.listdir(FOLDER_PATH) if f.lower().endswith(('.jpeg', '.jpg', '.png'))]
-        image_files.sort()
-        if not (0 <= index < len(image_files)):
+        image_filename = get_folder_index().filename(index)
+        if image_filename is None:
             return jsonify({'error': '图像索引超出范围'}), 404
-        image_filename = image_files[index]
         image_path = os.path.join(FOLDER_PATH, image_filename)
-        base_name = os.path.splitext(image_filename)[0]
-        txt_path = os.path.join(FOLDER_PATH, f"{base_name}.txt")
-        global img_path_global  # 使用全局变量
-        img_path_global = image_path  # 更新全局变量
+        prefetcher.schedule(index, len(get_folder_index()))
+        # 仅读取文件头获取尺寸，像素数据由浏览器通过二进制路由单独获取
         with Image.open(image_path) as img:
             original_width, original_height = img.size
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='JPEG')
-            encoded_img = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
-
-        current_geo_info = extract_geo_info(image_path)
-        header, coordinates = read_text_file(txt_path)
 
-        if not os.path.exists(txt_path) or os.path.getsize(txt_path) == 0 or len(header) < 8:
-            initial_header = [
-                f"Filename: {image_filename}\n",
-                f"Latitude: {current_geo_info['Latitude'] if current_geo_info['Latitude'] is not None else 'N/A'}\n",
-                f"Longitude: {current_geo_info['Longitude'] if current_geo_info['Longitude'] is not None else 'N/A'}\n",
-                f"Altitude: {current_geo_info['Altitude'] if current_geo_info['Altitude'] is not None else 'N/A'} meters\n",
-                "Gimbal Orientation:\n",
-                f"  Roll:  {current_geo_info['GimbalRoll'] if current_geo_info['GimbalRoll'] is not None else 'N/A'}°\n",
-                f"  Pitch: {current_geo_info['GimbalPitch'] if current_geo_info['GimbalPitch'] is not None else 'N/A'}°\n",
-                f"  Yaw:   {current_geo_info['GimbalYaw'] if current_geo_info['GimbalYaw'] is not None else 'N/A'}°\n",
-                "\n"
-            ]
-            write_text_file(txt_path, initial_header, coordinates)
-            print(f"Debug: 为 {image_filename} 重新初始化TXT文件")
-
-        header, coordinates = read_text_file(txt_path)
+        with timed('metadata.get'):
+            current_geo_info = get_metadata_cache().get(image_filename)
+        # 增量修改尚未写入磁盘时直接返回内存中的最新坐标
+        pending = coordinate_buffer.get(image_filename)
+        header, coordinates = pending if pending is not None else load_text_state(image_filename, current_geo_info)
+        header = header[:8]
         return jsonify({
             'filename': image_filename,
-            'image_data': encoded_img,
+            'image_url': f'/api/image_file/{index}',
+            'preview_url': f'/api/image_preview/{index}',
+            'tile_url': f'/api/tiles/{index}',
+            'tiles': tile_grid(original_width, original_height),
             'geo_info': current_geo_info,
             'header_lines': header,
             'coordinates': coordinates,
             'original_dimensions': {'width': original_width, 'height': original_height}
         })
     except Exception as e:
-        print(f"/api/image/{index} 出错: {e}")
+        logger.exception("/api/image/%s 出错: %s", index, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/image_file/<int:index>')
+def get_image_file(index):
+    """
+    API路由，按索引直接返回原始图像文件（支持ETag、If-None-Match和Range请求）
+    :param index: 图像列表中的索引
+    """
+    try:
+        image_filename = get_folder_index().filename(index)
+        if image_filename is None:
+            return jsonify({'error': '图像索引超出范围'}), 404
+        image_path = os.path.join(FOLDER_PATH, image_filename)
+        return send_file(image_path, conditional=True, etag=True, max_age=IMAGE_CACHE_MAX_AGE)
+    except Exception as e:
+        logger.exception("/api/image_file/%s 出错: %s", index, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/image_preview/<int:index>')
+def get_image_preview(index):
+    """
+    API路由，按索引返回服务端缩放后的JPEG预览图
+    可通过查询参数 size 指定预览图最长边像素数，默认 PREVIEW_MAX_SIZE
+    :param index: 图像列表中的索引
+    """
+    try:
+        image_filename = get_folder_index().filename(index)
+        if image_filename is None:
+            return jsonify({'error': '图像索引超出范围'}), 404
+        image_path = os.path.join(FOLDER_PATH, image_filename)
+        max_size = request.args.get('size', PREVIEW_MAX_SIZE, type=int)
+        max_size = max(PREVIEW_SIZE_RANGE[0], min(max_size, PREVIEW_SIZE_RANGE[1]))
+
+        # ETag由文件修改时间、大小和预览尺寸决定，命中时无需重新解码
+        stat = os.stat(image_path)
+        etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}-{max_size}"
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+        preview_bytes = get_preview_bytes(image_path, max_size)
+        response = make_response(preview_bytes)
+        response.mimetype = 'image/jpeg'
+        response.set_etag(etag)
+        response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+        return response
+    except Exception as e:
+        logger.exception("/api/image_preview/%s 出错: %s", index, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/tiles/<int:index>/<int:z>/<int:x>/<int:y>.jpg')
+def get_image_tile(index, z, x, y):
+    """
+    API路由，返回图像金字塔中的一个瓦片，首次请求时生成并缓存到磁盘
+    第0层为整幅缩略图，tile_grid 给出的 max_level 层为原始分辨率
+    :param index: 图像列表中的索引
+    """
+    try:
+        image_filename = get_folder_index().filename(index)
+        if image_filename is None:
+            return jsonify({'error': '图像索引超出范围'}), 404
+        image_path = os.path.join(FOLDER_PATH, image_filename)
+        tile_path = get_tile_cache().tile_path(image_path, z, x, y)
+        return send_file(tile_path, mimetype='image/jpeg', conditional=True, etag=True, max_age=IMAGE_CACHE_MAX_AGE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        logger.exception("/api/tiles/%s/%s/%s/%s 出错: %s", index, z, x, y, e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/save_coordinates/<int:index>', methods=['POST'])
@@ -381,11 +815,9 @@ def save_coordinates_data(index):
     :param index: 图像列表中的索引
     """
     try:
-        image_files = [f for f in os.listdir(FOLDER_PATH) if f.lower().endswith(('.jpeg', '.jpg', '.png'))]
-        image_files.sort()
-        if not (0 <= index < len(image_files)):
+        image_filename = get_folder_index().filename(index)
+        if image_filename is None:
             return jsonify({'error': '图像索引超出范围'}), 404
-        image_filename = image_files[index]
         base_name = os.path.splitext(image_filename)[0]
         txt_path = os.path.join(FOLDER_PATH, f"{base_name}.txt")
         data = request.json
@@ -394,34 +826,286 @@ def save_coordinates_data(index):
         if len(header) < 8:
             header.extend(['\n'] * (8 - len(header)))
         header = header[:8]
-        write_text_file(txt_path, header, coordinates)
+        coordinate_buffer.discard(image_filename)  # 整体保存覆盖尚未写入的增量修改
+        with timed('txt.write'), locked_file(txt_path, get_lock_dir()):
+            write_text_file(txt_path, header, coordinates)
+        try:
+            with timed('db.save_points'):
+                get_annotation_db().save_points(image_filename, get_metadata_cache().get(image_filename), coordinates)
+        except Exception as e:
+            logger.exception("更新标注数据库时出错: %s", e)
         return jsonify({'message': '坐标保存成功!'})
     except Exception as e:
-        print(f"保存索引 {index} 的坐标时出错: {e}")
+        logger.exception("保存索引 %s 的坐标时出错: %s", index, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/coordinates/<int:index>', methods=['PATCH'])
+def patch_coordinates(index):
+    """
+    API路由，增量修改指定图像的坐标，短时间内的多次修改合并为一次TXT写入
+    请求JSON: {'ops': [操作, ...], 'flush': 是否立即写入}，操作格式见 annotation_io.apply_coordinate_ops
+    :param index: 图像列表中的索引
+    :return: {'coordinates': 修改后的完整坐标列表, 'pending': 是否还有未写入磁盘的修改,
+              'write_error': 未写入的修改最近一次写入失败的原因，没有失败时为None}
+    """
+    try:
+        image_filename = get_folder_index().filename(index)
+        if image_filename is None:
+            return jsonify({'error': '图像索引超出范围'}), 404
+        data = request.json or {}
+        ops = data.get('ops', [])
+        if ops:
+            def load():
+                return load_text_state(image_filename, get_metadata_cache().get(image_filename))
+
+            def apply(state):
+                return state[0], apply_coordinate_ops(state[1], ops)
+
+            try:
+                header, coordinates = coordinate_buffer.update(image_filename, load, apply)
+            except (KeyError, TypeError, ValueError) as e:
+                return jsonify({'error': f'无效的坐标操作: {e}'}), 400
+        if data.get('flush'):
+            coordinate_buffer.flush(image_filename)
+        pending = coordinate_buffer.get(image_filename)
+        if pending is not None:
+            coordinates = pending[1]
+        elif not ops:
+            coordinates = load_text_state(image_filename, get_metadata_cache().get(image_filename))[1]
+        return jsonify({'coordinates': coordinates, 'pending': pending is not None,
+                        'write_error': coordinate_buffer.error(image_filename)})
+    except Exception as e:
+        logger.exception("修改索引 %s 的坐标时出错: %s", index, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export/sync', methods=['POST'])
+def sync_export_db():
+    """API路由，将整个文件夹的标注同步到SQLite标注数据库"""
+    try:
+        updated = sync_annotation_db()
+        return jsonify({'message': f'已同步 {updated} 张图像', 'updated': updated,
+                        'db_path': get_annotation_db().db_path})
+    except Exception as e:
+        logger.exception("同步标注数据库时出错: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/localize_target', methods=['POST'])
+def localize_target_route():
+    """
+    API路由，根据已标注帧和GPS/云台姿态把靶标投影到整次飞行的所有帧
+    请求JSON: {'target': 靶标编号, 'detect': 是否检测角点, 'write': 是否写回TXT, 'ground_altitude': 地面海拔}
+    """
+    data = request.json or {}
+    if data.get('target') is None:
+        return jsonify({'error': '缺少靶标编号'}), 400
+    try:
+        from batch_detect import run_localized_detection  # 批处理模块按需加载
+        coordinate_buffer.flush()
+        result = run_localized_detection(
+            FOLDER_PATH, int(data['target']),
+            dry_run=not data.get('write', False),
+            ground_altitude=data.get('ground_altitude'),
+            detect=data.get('detect', False),
+            cache_dir=get_cache_dir(),
+            metadata_cache=get_metadata_cache())
+        if result['detected'] and data.get('write', False):
+            sync_annotation_db(list(result['detected']))
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("靶标自动定位时出错: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/propagate', methods=['POST'])
+def propagate_route():
+    """
+    API路由，把指定图像中已标注的靶标逐帧跟踪到后续图像（模板匹配+光流），并用棋盘格检测验证
+    请求JSON: {'index': 起始图像索引, 'targets': 靶标编号列表（默认全部）, 'count': 向后传播多少张（默认1）,
+              'overwrite': 是否覆盖已标注的同编号靶标, 'write': 是否写入TXT（默认True）}
+    :return: {'frames': [{'index', 'filename', 'detected': {靶标编号: 点列表}}], 'report': 报告行}
+    """
+    data = request.json or {}
+    try:
+        start = int(data.get('index', 0))
+        count = max(1, int(data.get('count', 1)))
+        targets = data.get('targets')
+        targets = None if targets is None else [int(target) for target in targets]
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'无效的参数: {e}'}), 400
+    image_files = list_image_files()
+    if not 0 <= start < len(image_files):
+        return jsonify({'error': '图像索引超出范围'}), 404
+    from propagate import propagate_sequence  # 逐帧传播功能按需加载
+
+    def load_points(image_filename):
+        pending = coordinate_buffer.get(image_filename)
+        if pending is not None:
+            return pending[1]
+        return load_text_state(image_filename, get_metadata_cache().get(image_filename))[1]
+
+    def load_image(image_filename):
+        with timed('image.decode'):
+            return image_cache.get_bgr(os.path.join(FOLDER_PATH, image_filename))
+
+    try:
+        frames = []
+        report = []
+        filenames = image_files[start:start + count + 1]
+        for offset, (image_filename, detected, rows) in enumerate(
+                propagate_sequence(filenames, load_image, load_points, targets, data.get('overwrite', False))):
+            report.extend(rows)
+            if not detected:
+                continue
+            frames.append({'index': start + offset, 'filename': image_filename, 'detected': detected})
+            if data.get('write', True):
+                ops = []
+                for target, points in sorted(detected.items()):
+                    ops.append({'op': 'delete', 'target': target})
+                    ops.extend({'op': 'add', 'x': x, 'y': y, 'target': target} for x, y in points)
+
+                def load(image_filename=image_filename):
+                    return load_text_state(image_filename, get_metadata_cache().get(image_filename))
+
+                def apply(state, ops=ops):
+                    return state[0], apply_coordinate_ops(state[1], ops)
+
+                coordinate_buffer.update(image_filename, load, apply)
+        return jsonify({'frames': frames, 'report': report})
+    except Exception as e:
+        logger.exception("传播索引 %s 的靶标时出错: %s", start, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export/csv')
+def export_csv():
+    """API路由，以CSV下载全部靶标点"""
+    try:
+        output = io.StringIO()
+        get_export_db().export_csv(output)
+        return Response('\ufeff' + output.getvalue(), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=annotations.csv'})
+    except Exception as e:
+        logger.exception("导出CSV时出错: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export/coco')
+def export_coco():
+    """API路由，以COCO风格JSON下载全部标注"""
+    try:
+        response = jsonify(get_export_db().export_coco())
+        response.headers['Content-Disposition'] = 'attachment; filename=annotations_coco.json'
+        return response
+    except Exception as e:
+        logger.exception("导出COCO JSON时出错: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache_stats')
+def get_cache_stats():
+    """API路由，返回解码图像缓存的命中/未命中统计"""
+    return jsonify(image_cache.stats())
+
+@app.route('/api/metrics')
+def get_metrics():
+    """
+    API路由，返回各请求和处理阶段（预览图编码、EXIF解析、TXT读写、去畸变、角点检测等）的耗时直方图
+    查询参数 reset=1 时返回后清空统计
+    """
+    snapshot = metrics_registry.snapshot()
+    if request.args.get('reset') == '1':
+        metrics_registry.reset()
+    return jsonify({'stages': snapshot, 'image_cache': image_cache.stats(),
+                    'coordinate_writes': coordinate_buffer.stats(), 'jobs': job_queue.stats()})
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     """关闭服务器的路由"""
+    if not SHUTDOWN_ON_CLIENT_EXIT:
+        return jsonify({"status": "ignored", "message": "多人标注模式下不响应客户端关闭请求"}), 403
     shutdown_event.set()
     return jsonify({"status": "success", "message": "服务器正在关闭"})
 
-if __name__ == '__main__':
+def run_server():
+    """
+    启动HTTP服务器：安装了 waitress 时使用多线程生产级WSGI服务器，否则退回Flask开发服务器（多线程模式）
+    只能以单进程多线程方式部署：尚未写入的坐标修改和后台检测任务只保存在本进程内存中，
+    多进程WSGI服务器的其他工作进程看不到它们（claim_folder 会拒绝为同一个文件夹提供服务的第二个进程）；
+    锁文件只保证TXT/JSON的每次读-改-写不与批处理脚本冲突
+    """
+    try:
+        from waitress import serve
+    except ImportError:
+        logger.info("未安装 waitress，使用Flask开发服务器")
+        app.run(host=SERVER_HOST, port=SERVER_PORT, threaded=True)
+        return
+    logger.info("使用 waitress 提供服务（%s 个工作线程）", SERVER_THREADS)
+    serve(app, host=SERVER_HOST, port=SERVER_PORT, threads=SERVER_THREADS)
+
+def has_display():
+    """判断当前环境能否弹出图形界面（Linux下没有 DISPLAY/WAYLAND_DISPLAY 时视为无图形界面）"""
+    if sys.platform.startswith('linux'):
+        return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    return True
+
+def parse_args(argv=None):
+    """解析命令行参数，默认值取自模块的全局配置"""
+    parser = argparse.ArgumentParser(description="无人机图像棋盘格靶标标注服务器")
+    parser.add_argument('folder', nargs='?', default=FOLDER_PATH or None,
+                        help="图像文件夹路径，默认读取环境变量 LABEL_FOLDER；都未提供且有图形界面时弹出目录选择对话框")
+    parser.add_argument('--host', default=SERVER_HOST, help="监听地址，多人共用时设为 0.0.0.0")
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help="监听端口")
+    parser.add_argument('--headless', action='store_true',
+                        help="服务器模式：不弹出对话框、不打开浏览器，浏览器页面关闭时不关闭服务器")
+    parser.add_argument('--no-browser', action='store_true', help="启动后不自动打开浏览器")
+    parser.add_argument('--log-level', default=LOG_LEVEL, help="日志级别，如 DEBUG、INFO、WARNING")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """命令行入口：确定图像文件夹后启动服务器"""
+    global FOLDER_PATH, SERVER_HOST, SERVER_PORT, SHUTDOWN_ON_CLIENT_EXIT
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    headless = args.headless or not has_display()
+    folder = args.folder
+    if not folder and not headless:
+        from path_select import select_directory  # 只有需要对话框时才加载 tkinter
+        folder = select_directory("请选择一个目录")
+    if not folder or not os.path.isdir(folder):
+        logger.error("未指定有效的图像文件夹: %r（通过命令行参数或环境变量 LABEL_FOLDER 指定）", folder)
+        sys.exit(1)
+    FOLDER_PATH = folder
+    SERVER_HOST, SERVER_PORT = args.host, args.port
+    if headless:
+        SHUTDOWN_ON_CLIENT_EXIT = False
+
+    if not claim_folder():
+        logger.error("图像文件夹 %s 已由另一个服务进程提供服务", FOLDER_PATH)
+        sys.exit(1)
+    get_folder_index()
+    if INGEST_ON_STARTUP:
+        from batch_ingest import ingest_folder
+        ingest_folder(FOLDER_PATH, cache_dir=get_cache_dir(), metadata_cache=get_metadata_cache())
+    logger.info("服务器将在 http://%s:%s 运行，图像文件夹: %s", SERVER_HOST, SERVER_PORT, FOLDER_PATH)
+
+    if headless:
+        run_server()
+        return
+
     def open_browser():
         """延迟打开浏览器的函数"""
         time.sleep(1.5)
-        webbrowser.open('http://localhost:5000')
-        print("已自动打开浏览器访问: http://localhost:5000")
+        webbrowser.open(f'http://{SERVER_HOST}:{SERVER_PORT}')
+        logger.info("已自动打开浏览器访问: http://%s:%s", SERVER_HOST, SERVER_PORT)
 
-    if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+    if not args.no_browser and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
         threading.Thread(target=open_browser, daemon=True).start()
 
-    print("正在启动Flask服务器...")
-    print("服务器将在 http://localhost:5000 运行")
-
-    server_thread = threading.Thread(target=app.run, kwargs={'host': 'localhost', 'port': 5000})
+    server_thread = threading.Thread(target=run_server)
     server_thread.daemon = True
     server_thread.start()
     shutdown_event.wait()
-    print("收到退出信号，服务器正在关闭...")
-    sys.exit(0)
\ No newline at end of file
+    logger.info("收到退出信号，服务器正在关闭...")
+    sys.exit(0)
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
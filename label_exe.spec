@@ -13,7 +13,8 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # matplotlib 只被 get_cheese_point 中本地调试用的函数延迟导入，打包时排除以减小体积和启动时间
+    excludes=['matplotlib', 'IPython', 'PyQt5', 'PySide2', 'PySide6'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
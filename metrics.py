@@ -0,0 +1,114 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# 直方图桶的上界（毫秒），最后一个桶收集所有更慢的样本
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    """固定分桶的耗时直方图（毫秒），只保存计数，内存占用与样本数无关"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        self.min = value_ms if self.min is None else min(self.min, value_ms)
+        self.max = value_ms if self.max is None else max(self.max, value_ms)
+
+    def quantile(self, q):
+        """按桶估计分位数，返回样本所在桶的上界（最后一个桶返回最大值）"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else None,
+            'min_ms': self.min,
+            'max_ms': self.max,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'buckets': {('+Inf' if i == len(self.buckets) else f'le_{self.buckets[i]}'): count
+                        for i, count in enumerate(self.counts)}
+        }
+
+
+class MetricsRegistry:
+    """
+    按阶段名称汇总耗时直方图（线程安全）
+    在 begin_request/end_request 之间，同一线程内计时的各阶段也会记录到当前请求，用于慢请求日志
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, name, value_ms):
+        """
+        记录一个阶段的耗时
+        :param name: 阶段名称，如 'txt.read'
+        :param value_ms: 耗时（毫秒）
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.buckets)
+            histogram.observe(value_ms)
+        stages = getattr(self._local, 'stages', None)
+        if stages is not None:
+            stages.append((name, value_ms))
+
+    @contextmanager
+    def timer(self, name):
+        """对 with 块计时并记录到名为 name 的直方图"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def begin_request(self):
+        """开始记录当前线程的请求内各阶段耗时"""
+        self._local.stages = []
+
+    def end_request(self):
+        """
+        结束当前线程的请求
+        :return: [(阶段名称, 耗时毫秒), ...]
+        """
+        stages = getattr(self._local, 'stages', None) or []
+        self._local.stages = None
+        return stages
+
+    def snapshot(self):
+        """返回所有阶段的直方图统计"""
+        with self._lock:
+            return {name: histogram.snapshot() for name, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+registry = MetricsRegistry()
+timed = registry.timer
@@ -1,5 +1,4 @@
-import tkinter as tk
-from tkinter import filedialog
+# tkinter 在打开对话框时才导入：服务器模式和无图形界面的Linux主机上不需要它
 
 
 def select_file(title="选择文件", initial_dir=None, file_types=None):
@@ -14,6 +13,9 @@ def select_file(title="选择文件", initial_dir=None, file_types=None):
     返回:
         str: 用户选择的文件路径，如果取消选择则返回空字符串
     """
+    import tkinter as tk
+    from tkinter import filedialog
+
     # 创建一个隐藏的主窗口
     root = tk.Tk()
     root.withdraw()  # 隐藏窗口
@@ -43,6 +45,9 @@ def select_directory(title="选择目录", initial_dir=None):
     返回:
         str: 用户选择的目录路径，如果取消选择则返回空字符串
     """
+    import tkinter as tk
+    from tkinter import filedialog
+
     # 创建一个隐藏的主窗口
     root = tk.Tk()
     root.withdraw()  # 隐藏窗口
@@ -0,0 +1,63 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    后台预取相邻图像：每次访问索引 i 时，在线程池中预热 i±radius 范围内的图像
+    用户跳转到别处时，上一轮尚未开始的预取任务会被取消
+    """
+
+    def __init__(self, warm_fn, radius=2, workers=2):
+        """
+        :param warm_fn: 预热函数，参数为图像索引
+        :param radius: 预取当前索引前后各多少张图像
+        :param workers: 预取线程数
+        """
+        self.warm_fn = warm_fn
+        self.radius = radius
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending = []
+        self._center = None
+
+    def schedule(self, center_index, total):
+        """
+        以 center_index 为中心安排预取，越近的图像越先预取（先后一张，再前一张，依次外扩）
+        :param center_index: 当前访问的图像索引
+        :param total: 图像总数
+        """
+        with self._lock:
+            if center_index == self._center:
+                return
+            self._center = center_index
+            self._generation += 1
+            generation = self._generation
+            for future in self._pending:
+                future.cancel()
+            self._pending = []
+            for distance in range(1, self.radius + 1):
+                for index in (center_index + distance, center_index - distance):
+                    if 0 <= index < total:
+                        self._pending.append(self._executor.submit(self._run, generation, index))
+
+    def _run(self, generation, index):
+        if generation != self._generation:
+            return  # 用户已跳转，放弃过期的预取
+        try:
+            self.warm_fn(index)
+        except Exception as e:
+            logger.warning("预取索引 %s 时出错: %s", index, e)
+
+    def shutdown(self):
+        """取消所有未开始的任务并关闭线程池"""
+        with self._lock:
+            self._generation += 1
+            for future in self._pending:
+                future.cancel()
+            self._pending = []
+        self._executor.shutdown(wait=False)
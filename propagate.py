@@ -0,0 +1,171 @@
+import cv2
+import numpy as np
+import get_cheese_point as gp
+from undistort import undistort_roi
+from metrics import timed
+
+TRACK_SCALE = 0.25       # 模板匹配和光流在缩小到该比例的图像上进行
+SEARCH_RADIUS = 600      # 相邻两帧之间靶标的最大位移（原分辨率像素）
+MIN_MATCH_SCORE = 0.5    # 模板匹配的最低归一化相关系数，低于该值认为靶标已离开画面或被遮挡
+BOARD_PADDING = 0.75     # 由内角点估计整个棋盘格区域时，向外扩展的比例（相对内角点跨度）
+MIN_BOARD_PADDING = 32   # 向外扩展的最少像素数
+TEMPLATE_PADDING = 2.0   # 模板匹配的模板包含棋盘格周围多大范围的地面（相对内角点跨度），用于区分外观相同的多个靶标
+MAX_MISSES = 2           # 靶标连续失败超过多少帧后停止跟踪
+
+
+def group_targets(coordinates):
+    """
+    按靶标编号整理坐标列表
+    :param coordinates: read_text_file 返回的坐标列表
+    :return: {靶标编号: [[x, y], ...]}
+    """
+    targets = {}
+    for coord in coordinates:
+        if coord is not None and len(coord) >= 3 and coord[2] is not None:
+            targets.setdefault(int(coord[2]), []).append([float(coord[0]), float(coord[1])])
+    return targets
+
+
+def board_region(points, padding=BOARD_PADDING):
+    """
+    由棋盘格内角点估计整个棋盘格（含最外一圈方格）的外接矩形
+    :param points: 内角点 [[x, y], ...]
+    :return: 区域四个顶点 [[x, y], ...]
+    """
+    points = np.asarray(points, dtype=np.float64)
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    pad = max(MIN_BOARD_PADDING, padding * float((upper - lower).max()))
+    x0, y0 = lower - pad
+    x1, y1 = upper + pad
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+
+def _to_gray_small(img, scale):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def track_target(prev_img, next_img, points, cam_matrix=gp.cam_matrix, dist_coeffs=gp.dist_coeffs,
+                 search_radius=SEARCH_RADIUS, scale=TRACK_SCALE):
+    """
+    把前一帧中已精确定位的棋盘格角点跟踪到下一帧，并用棋盘格检测器验证和精确定位
+    两帧只对靶标周围 search_radius 范围内的区域去畸变，在缩小的图像上先用模板匹配估计整体位移，
+    再以该位移为初值用金字塔光流跟踪各角点（可以适应小幅旋转和缩放），最后在跟踪位置附近检测角点
+    :param prev_img: 前一帧BGR图像（原始畸变图像）
+    :param next_img: 下一帧BGR图像
+    :param points: 前一帧中该靶标的角点（去畸变坐标） [[x, y], ...]
+    :param search_radius: 搜索半径（原分辨率像素）
+    :param scale: 跟踪时图像的缩小比例
+    :return: {'points': 下一帧中检测到的角点, 'shift': [dx, dy] 整体位移, 'score': 模板匹配相关系数}
+    """
+    points = np.asarray(points, dtype=np.float64)
+    region = board_region(points, TEMPLATE_PADDING)
+    # 两帧使用相同的区域，得到的局部图像尺寸和偏移一致
+    with timed('propagate.undistort'):
+        prev_crop, (x0, y0) = undistort_roi(prev_img, cam_matrix, dist_coeffs, region, search_radius)
+        next_crop, offset = undistort_roi(next_img, cam_matrix, dist_coeffs, region, search_radius)
+    if prev_crop.shape != next_crop.shape or offset != (x0, y0):
+        raise RuntimeError("两帧图像尺寸不一致，无法跟踪")
+
+    with timed('propagate.track'):
+        prev_small = _to_gray_small(prev_crop, scale)
+        next_small = _to_gray_small(next_crop, scale)
+        # 1. 模板匹配估计整体位移，模板包含靶标周围的地面纹理
+        bx0, by0 = np.floor((np.asarray(region[0]) - (x0, y0)) * scale).astype(int)
+        bx1, by1 = np.ceil((np.asarray(region[2]) - (x0, y0)) * scale).astype(int)
+        bx0, by0 = max(bx0, 0), max(by0, 0)
+        template = prev_small[by0:by1, bx0:bx1]
+        if template.size == 0 or min(template.shape) < 8:
+            raise RuntimeError("靶标区域过小或不在图像范围内")
+        if template.shape[0] >= next_small.shape[0] or template.shape[1] >= next_small.shape[1]:
+            raise RuntimeError("靶标靠近图像边缘，搜索区域不足")
+        # 多个靶标外观相同，遮住棋盘格本身，只用周围的地面纹理匹配，避免跳到相邻的靶标上
+        mask = np.full(template.shape, 255, dtype=np.uint8)
+        inner = (np.asarray(board_region(points)) - (x0, y0)) * scale - (bx0, by0)
+        ix0, iy0 = np.floor(inner.min(axis=0)).astype(int)
+        ix1, iy1 = np.ceil(inner.max(axis=0)).astype(int)
+        mask[max(iy0, 0):iy1, max(ix0, 0):ix1] = 0
+        result = cv2.matchTemplate(next_small, template, cv2.TM_CCOEFF_NORMED, mask=mask)
+        result[~np.isfinite(result)] = -1
+        _, score, _, (mx, my) = cv2.minMaxLoc(result)
+        if score < MIN_MATCH_SCORE:
+            raise RuntimeError(f"模板匹配相关系数 {score:.2f} 过低，靶标可能已离开画面或被遮挡")
+        shift = np.array([mx - bx0, my - by0], dtype=np.float64) / scale
+
+        # 2. 以整体位移为初值用金字塔光流跟踪各角点，跟踪失败时只使用整体位移
+        local = points - (x0, y0)
+        prev_pts = ((local + 0.5) * scale - 0.5).astype(np.float32).reshape(-1, 1, 2)
+        next_pts = ((local + shift + 0.5) * scale - 0.5).astype(np.float32).reshape(-1, 1, 2)
+        tracked, status, _ = cv2.calcOpticalFlowPyrLK(
+            prev_small, next_small, prev_pts, next_pts.copy(), winSize=(21, 21), maxLevel=3,
+            flags=cv2.OPTFLOW_USE_INITIAL_FLOW)
+        if tracked is not None and status is not None and status.all():
+            predicted = (tracked.reshape(-1, 2).astype(np.float64) + 0.5) / scale - 0.5
+        else:
+            predicted = local + shift
+
+    # 3. 在跟踪位置附近检测棋盘格角点，检测不到或位置不一致时视为跟踪失败
+    detected = gp.auto_detect_corners(next_crop, board_region(predicted))
+    span = float((predicted.max(axis=0) - predicted.min(axis=0)).max())
+    if np.linalg.norm(detected.mean(axis=0) - predicted.mean(axis=0)) > max(MIN_BOARD_PADDING, 0.5 * span):
+        raise RuntimeError("检测到的棋盘格与跟踪位置不一致")
+    detected = detected + np.array([x0, y0], dtype=np.float32)
+    return {'points': detected.tolist(), 'shift': shift.tolist(), 'score': float(score)}
+
+
+def propagate_sequence(filenames, load_image, load_points, targets=None, overwrite=False,
+                       search_radius=SEARCH_RADIUS, max_misses=MAX_MISSES):
+    """
+    沿拍摄顺序逐帧传播靶标角点：每个靶标以最近一次已标注或传播成功的帧为起点，跟踪到下一帧
+    已标注的靶标（overwrite 为False时）不会被覆盖，而是作为之后各帧的新起点
+    :param filenames: 按拍摄顺序排列的图像文件名，第一帧为起始帧
+    :param load_image: load_image(文件名) -> BGR图像或None
+    :param load_points: load_points(文件名) -> 坐标列表（read_text_file 格式）
+    :param targets: 只传播这些编号的靶标，None表示所有已标注的靶标
+    :param overwrite: 是否覆盖下一帧中已有的同编号靶标
+    :param search_radius: 相邻帧之间的搜索半径（像素）
+    :param max_misses: 靶标连续失败超过多少帧后停止跟踪
+    :return: 生成器，每帧产生 (文件名, {靶标编号: 点列表}, 报告行 [(文件名, 靶标编号, 状态, 说明)])
+    """
+    targets = None if targets is None else {int(target) for target in targets}
+    seeds = {}  # 靶标编号 -> [角点, 来源文件名, 连续失败次数]
+    images = {}
+    for position, filename in enumerate(filenames):
+        labeled = group_targets(load_points(filename))
+        if targets is not None:
+            labeled = {target: points for target, points in labeled.items() if target in targets}
+        detected = {}
+        report = []
+        todo = [target for target in sorted(seeds) if overwrite or target not in labeled]
+        if position > 0 and todo:
+            img = images.get(filename)
+            if img is None:
+                img = images[filename] = load_image(filename)
+            for target in todo:
+                points, source, misses = seeds[target]
+                try:
+                    if img is None:
+                        raise RuntimeError('无法读取图像')
+                    source_img = images.get(source)
+                    if source_img is None:
+                        raise RuntimeError(f'无法读取起始帧 {source}')
+                    result = track_target(source_img, img, points, search_radius=search_radius)
+                except Exception as e:
+                    seeds[target][2] = misses + 1
+                    report.append((filename, target, 'failed', f'由 {source} 传播失败: {str(e) or type(e).__name__}'))
+                    continue
+                detected[target] = result['points']
+                seeds[target] = [result['points'], filename, 0]
+                report.append((filename, target, 'ok', f"由 {source} 传播，位移 ({result['shift'][0]:.1f}, "
+                                                       f"{result['shift'][1]:.1f})，相关系数 {result['score']:.2f}"))
+        for target, points in labeled.items():
+            if target not in detected:
+                seeds[target] = [points, filename, 0]
+        seeds = {target: seed for target, seed in seeds.items() if seed[2] <= max_misses}
+        # 只保留仍作为起点的帧，起始帧按需加载
+        for source in {seed[1] for seed in seeds.values()}:
+            if source not in images:
+                images[source] = load_image(source)
+        sources = {seed[1] for seed in seeds.values()}
+        images = {name: img for name, img in images.items() if name in sources}
+        yield filename, detected, report
@@ -0,0 +1,114 @@
+import os
+import json
+import logging
+import uuid
+
+LOG_SUFFIX = '.rectangles.jsonl'
+COMPACT_THRESHOLD_BYTES = 64 * 1024  # 追加日志超过该大小时合并到 .json 快照
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_path(image_path):
+    """返回矩形快照文件路径（与图像同名但扩展名为.json，兼容旧格式）"""
+    return os.path.splitext(image_path)[0] + '.json'
+
+
+def log_path(image_path):
+    """返回矩形追加日志文件路径"""
+    return os.path.splitext(image_path)[0] + LOG_SUFFIX
+
+
+def _read_snapshot(path):
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except json.JSONDecodeError:
+        logger.warning("JSON文件 %s 格式无效，已忽略", path)
+        return []
+    return data if isinstance(data, list) else [data]
+
+
+def _read_log(path):
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # 崩溃时写了一半的行
+    return entries
+
+
+def read_rectangles(image_path):
+    """
+    读取图像的全部矩形历史：.json 快照在前，追加日志在后，按 id 去重
+    :param image_path: 图像文件的完整路径
+    :return: 矩形记录列表
+    """
+    rectangles = []
+    seen_ids = set()
+    for entry in _read_snapshot(snapshot_path(image_path)) + _read_log(log_path(image_path)):
+        entry_id = entry.get('id') if isinstance(entry, dict) else None
+        if entry_id is not None:
+            if entry_id in seen_ids:
+                continue
+            seen_ids.add(entry_id)
+        rectangles.append(entry)
+    return rectangles
+
+
+def append_rectangle(image_path, rectangle):
+    """
+    以一行JSON追加一条矩形记录，耗时与已有记录数无关
+    调用方负责对同一图像的并发写入加锁
+    :param image_path: 图像文件的完整路径
+    :param rectangle: 矩形记录字典
+    :return: 写入的记录（带 id）
+    """
+    entry = dict(rectangle)
+    entry.setdefault('id', uuid.uuid4().hex)
+    path = log_path(image_path)
+    with open(path, 'a+b') as f:
+        f.seek(0, os.SEEK_END)
+        prefix = b''
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                prefix = b'\n'  # 上次写入中途崩溃，先结束残缺的行
+        f.write(prefix + json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.getsize(path) > COMPACT_THRESHOLD_BYTES:
+        compact(image_path)
+    return entry
+
+
+def compact(image_path):
+    """
+    将追加日志合并进 .json 快照（临时文件+重命名），然后删除日志
+    合并后、删除日志前崩溃不会丢失或重复记录：读取时按 id 去重
+    调用方负责对同一图像的并发写入加锁
+    :param image_path: 图像文件的完整路径
+    :return: 合并后的矩形数量
+    """
+    path = log_path(image_path)
+    if not os.path.exists(path):
+        return None
+    rectangles = read_rectangles(image_path)
+    target = snapshot_path(image_path)
+    tmp_path = target + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(rectangles, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, target)
+    os.remove(path)
+    return len(rectangles)
@@ -0,0 +1,116 @@
+import numpy as np
+from geo_projection import geodetic_to_local, gimbal_rotations, pixel_rays, project_point
+
+CELL_SIZE_M = 50.0                # 网格单元边长（米）
+MAX_FOOTPRINT_DISTANCE_M = 500.0  # 视线接近水平时，足迹角点沿视线截断的最大距离（米）
+DEFAULT_FLIGHT_HEIGHT_M = 100.0   # 未提供地面高度时，假定最低的拍摄位置距地面的高度（米）
+
+
+def _ground_hits(centers, directions, ground_altitude):
+    """
+    视线与水平地面的交点；不与地面相交或过远的视线在 MAX_FOOTPRINT_DISTANCE_M 处截断
+    :param centers: (N, 3) 视线起点
+    :param directions: (N, 3) 单位视线方向
+    :return: (N, 3) 交点
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (ground_altitude - centers[:, 2]) / directions[:, 2]
+    t = np.where(np.isfinite(t) & (t > 0), np.minimum(t, MAX_FOOTPRINT_DISTANCE_M), MAX_FOOTPRINT_DISTANCE_M)
+    return centers + t[:, None] * directions
+
+
+def _inside_quads(point, quads):
+    """
+    判断点是否在凸四边形内（向量化，两种绕向都可）
+    :param point: (2,) 东-北坐标
+    :param quads: (N, 4, 2) 四边形角点
+    :return: (N,) 布尔数组
+    """
+    edges = np.roll(quads, -1, axis=1) - quads
+    to_point = point[None, None, :] - quads
+    cross = edges[:, :, 0] * to_point[:, :, 1] - edges[:, :, 1] * to_point[:, :, 0]
+    return np.all(cross >= 0, axis=1) | np.all(cross <= 0, axis=1)
+
+
+class FootprintIndex:
+    """
+    整次飞行中每帧图像在地面上的估计覆盖范围（足迹）的网格空间索引
+    由GPS位置、高度和云台姿态把图像四个角投影到水平地面上得到足迹四边形，
+    按外接矩形登记到固定大小的网格单元中，查询一个经纬度时只需检查所在单元的候选帧
+    """
+
+    def __init__(self, flight, cam_matrix, image_size, ground_altitude=None, cell_size=CELL_SIZE_M):
+        """
+        :param flight: 列存储的飞行元数据（见 batch_ingest.build_flight_table）
+        :param cam_matrix: 相机内参矩阵
+        :param image_size: 图像尺寸 (宽, 高)
+        :param ground_altitude: 地面海拔高度（米），默认取最低拍摄高度减去 DEFAULT_FLIGHT_HEIGHT_M
+        :param cell_size: 网格单元边长（米）
+        """
+        columns = [np.asarray(flight[key], dtype=np.float64)
+                   for key in ('Latitude', 'Longitude', 'Altitude', 'GimbalRoll', 'GimbalPitch', 'GimbalYaw')]
+        valid = np.all([np.isfinite(column) for column in columns], axis=0)
+        latitude, longitude, altitude, roll, pitch, yaw = [column[valid] for column in columns]
+        self.filenames = np.asarray(flight['filename'])[valid]
+        self.cam_matrix = np.asarray(cam_matrix, dtype=np.float64)
+        self.image_size = image_size
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        if not valid.any():
+            self.origin = None
+            self.ground_altitude = ground_altitude
+            return
+
+        self.origin = (latitude[0], longitude[0], 0.0)
+        if ground_altitude is None:
+            ground_altitude = float(altitude.min()) - DEFAULT_FLIGHT_HEIGHT_M
+        self.ground_altitude = float(ground_altitude)
+        self.centers = geodetic_to_local(latitude, longitude, altitude, self.origin)
+        self.rotations = gimbal_rotations(roll, pitch, yaw)
+
+        width, height = image_size
+        n = len(self.filenames)
+        corners = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float64)
+        pixels = np.tile(corners, (n, 1))
+        rotations = np.repeat(self.rotations, 4, axis=0)
+        centers = np.repeat(self.centers, 4, axis=0)
+        hits = _ground_hits(centers, pixel_rays(pixels, rotations, self.cam_matrix), self.ground_altitude)
+        self.footprints = hits[:, :2].reshape(n, 4, 2)
+
+        lower = np.floor(self.footprints.min(axis=1) / self.cell_size).astype(int)
+        upper = np.floor(self.footprints.max(axis=1) / self.cell_size).astype(int)
+        for i in range(n):
+            for cx in range(lower[i, 0], upper[i, 0] + 1):
+                for cy in range(lower[i, 1], upper[i, 1] + 1):
+                    self.cells.setdefault((cx, cy), []).append(i)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def query(self, latitude, longitude):
+        """
+        查找足迹包含该经纬度的所有帧
+        :param latitude: 纬度（度）
+        :param longitude: 经度（度）
+        :return: [{'filename', 'pixel': [u, v], 'distance'}, ...] 按到相机的水平距离排序
+        """
+        if self.origin is None:
+            return []
+        point = geodetic_to_local([latitude], [longitude], [self.ground_altitude], self.origin)[0]
+        cell = (int(np.floor(point[0] / self.cell_size)), int(np.floor(point[1] / self.cell_size)))
+        candidates = np.array(self.cells.get(cell, []), dtype=int)
+        if candidates.size == 0:
+            return []
+        candidates = candidates[_inside_quads(point[:2], self.footprints[candidates])]
+        pixels, depth = project_point(point, self.centers[candidates], self.rotations[candidates], self.cam_matrix)
+        distances = np.linalg.norm(self.centers[candidates, :2] - point[None, :2], axis=1)
+        results = []
+        for j in np.argsort(distances):
+            if depth[j] <= 0:
+                continue
+            results.append({
+                'filename': str(self.filenames[candidates[j]]),
+                'pixel': [float(pixels[j, 0]), float(pixels[j, 1])],
+                'distance': float(distances[j])
+            })
+        return results
@@ -6,6 +6,15 @@ let currentGeoInfo = {}; // 当前图像的地理信息
 let currentHeaderLines = []; // 当前图像的头部信息
 let coordinates = []; // 存储标注的坐标，可能包含 null 值
 let originalImageDimensions = { width: 0, height: 0 }; // 原始图像的尺寸
+let tileInfo = null; // 当前图像的瓦片金字塔结构 { tile_size, max_level, levels }
+let tileBaseUrl = ''; // 当前图像的瓦片URL前缀
+let tileImages = new Map(); // 已请求的瓦片，键为 z/x/y
+let representativeIndices = null; // 跳过近重复帧模式（页面URL带 ?dedup=1）下各组代表帧在 imageFiles 中的索引
+let clusterSizes = []; // 各组几乎相同的连续帧的帧数，与 representativeIndices 对应
+const maxCachedTiles = 256; // 浏览器中最多保留的瓦片数
+const clientId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`; // 本标签页的标识，用于取消过期的检测任务
+const jobPollInterval = 300; // 不能使用SSE时轮询任务状态的间隔（毫秒）
+const finishedJobStatuses = ['done', 'failed', 'cancelled'];
 
 // 画布绘制相关的全局变量，单位为物理像素
 let imageDrawInfo = { x: 0, y: 0, width: 0, height: 0, scale: 1 };
@@ -26,6 +35,9 @@ const ctx = canvas.getContext('2d');
 const prevBtn = document.getElementById('prev-btn');
 const nextBtn = document.getElementById('next-btn');
 const undoBtn = document.getElementById('undo-btn');
+const propagateBtn = document.getElementById('propagate-btn');
+const detectAllBtn = document.getElementById('detect-all-btn');
+const copyClusterBtn = document.getElementById('copy-cluster-btn');
 const clearBtn = document.getElementById('clear-btn');
 const quitBtn = document.getElementById('quit-btn');
 const currentImageNameSpan = document.getElementById('current-image-name');
@@ -98,9 +110,67 @@ function drawImageOnCanvas() {
     ctx.fillRect(0, 0, canvas.width, canvas.height);
     if (currentImage.src && imageDrawInfo.width > 0 && imageDrawInfo.height > 0) {
         ctx.drawImage(currentImage, imageDrawInfo.x, imageDrawInfo.y, imageDrawInfo.width, imageDrawInfo.height);
+        drawVisibleTiles();
     }
 }
 
+// 放大后预览图分辨率不足时，在预览图上叠加绘制可见区域的高分辨率瓦片
+function drawVisibleTiles() {
+    if (!tileInfo || !currentImage.naturalWidth) return;
+    const { width: imgWidth } = originalImageDimensions;
+    // 预览图每个像素对应的原图像素数小于画布缩放时无需瓦片
+    if (imageDrawInfo.scale <= currentImage.naturalWidth / imgWidth) return;
+    const maxLevel = tileInfo.max_level;
+    const z = Math.max(0, Math.min(maxLevel, maxLevel + Math.ceil(Math.log2(imageDrawInfo.scale))));
+    const level = tileInfo.levels[z];
+    const factor = Math.pow(2, maxLevel - z); // 该层一个像素对应的原图像素数
+    const tileSpan = tileInfo.tile_size * factor; // 一个瓦片覆盖的原图像素数
+    const visibleX0 = Math.max(0, -imageDrawInfo.x / imageDrawInfo.scale);
+    const visibleY0 = Math.max(0, -imageDrawInfo.y / imageDrawInfo.scale);
+    const visibleX1 = (canvas.width - imageDrawInfo.x) / imageDrawInfo.scale;
+    const visibleY1 = (canvas.height - imageDrawInfo.y) / imageDrawInfo.scale;
+    const col0 = Math.floor(visibleX0 / tileSpan);
+    const row0 = Math.floor(visibleY0 / tileSpan);
+    const col1 = Math.min(level.cols - 1, Math.floor(visibleX1 / tileSpan));
+    const row1 = Math.min(level.rows - 1, Math.floor(visibleY1 / tileSpan));
+    for (let row = row0; row <= row1; row++) {
+        for (let col = col0; col <= col1; col++) {
+            const tile = getTile(z, col, row);
+            if (!tile.complete || !tile.naturalWidth) continue;
+            ctx.drawImage(tile,
+                imageDrawInfo.x + col * tileSpan * imageDrawInfo.scale,
+                imageDrawInfo.y + row * tileSpan * imageDrawInfo.scale,
+                tile.naturalWidth * factor * imageDrawInfo.scale,
+                tile.naturalHeight * factor * imageDrawInfo.scale);
+        }
+    }
+}
+
+// 返回瓦片图像对象，未请求过时发起请求，加载完成后重绘画布
+function getTile(z, x, y) {
+    const key = `${z}/${x}/${y}`;
+    let tile = tileImages.get(key);
+    if (tile) {
+        tileImages.delete(key);
+        tileImages.set(key, tile);
+        return tile;
+    }
+    const requestUrl = tileBaseUrl;
+    tile = new Image();
+    tile.onload = () => {
+        if (requestUrl === tileBaseUrl) drawAnnotations();
+    };
+    tile.onerror = () => {
+        console.error('Tile failed to load:', `${requestUrl}/${key}.jpg`);
+    };
+    tile.src = `${requestUrl}/${key}.jpg`;
+    tileImages.set(key, tile);
+    if (tileImages.size > maxCachedTiles) {
+        tileImages.delete(tileImages.keys().next().value);
+    }
+    return tile;
+}
+
 // 绘制所有标注的坐标点
 // function drawAnnotations() {
     // drawImageOnCanvas();
@@ -131,6 +201,12 @@ function drawImageOnCanvas() {
 // 更新 UI 显示的图像信息、元数据和坐标列表
 function updateUI() {
     currentImageNameSpan.textContent = imageFiles[currentIndex] || 'N/A';
+    if (representativeIndices) {
+        const position = representativeIndices.indexOf(currentIndex);
+        if (position >= 0 && clusterSizes[position] > 1) {
+            currentImageNameSpan.textContent += ` (另有 ${clusterSizes[position] - 1} 张几乎相同的图像)`;
+        }
+    }
     currentImageIndexSpan.textContent = currentIndex + 1;
     totalImagesSpan.textContent = imageFiles.length;
 
@@ -167,39 +243,91 @@ function updateUI() {
     }
 }
 
-// 保存当前图像的坐标和头部信息到后端
-async function saveCoordinates() {
-    let coordsToSend = coordinates;
-    const hasActualMarks = coordinates.some(coord => coord !== null);
-    if (!hasActualMarks && (coordinates.length === 0 || coordinates.every(c => c === null))) {
-        coordsToSend = [null];
-    }
-    loadingSpinner.classList.remove('hidden');
+// 以增量操作修改当前图像的坐标，服务端合并短时间内的多次修改后再写入TXT
+// ops 格式: [{op: 'add', x, y, target}, {op: 'move', index, x, y}, {op: 'delete', index}, {op: 'clear'}]
+async function patchCoordinates(ops, flush = false) {
+    const editingIndex = currentIndex;
     try {
-        const response = await fetch(`/api/save_coordinates/${currentIndex}`, {
-            method: 'POST',
+        const response = await fetch(`/api/coordinates/${editingIndex}`, {
+            method: 'PATCH',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ header_lines: currentHeaderLines, coordinates: coordsToSend })
+            body: JSON.stringify({ ops, flush })
         });
-        if (!response.ok) {
-            throw new Error(`HTTP Error! Status Code: ${response.status}`);
-        }
         const result = await response.json();
-        if (result.error) {
-            throw new Error(result.error);
+        if (!response.ok || result.error) {
+            throw new Error(result.error || `HTTP Error! Status Code: ${response.status}`);
+        }
+        if (result.write_error) {
+            showMessage(`坐标修改尚未写入文件，已保留在服务器内存中: ${result.write_error}`, 'error');
+        }
+        // 以服务端的坐标为准，避免多个标签页或失败的请求导致前后端不一致
+        if (editingIndex === currentIndex) {
+            coordinates = result.coordinates;
+            drawAnnotations();
+            updateUI();
         }
-        // showMessage(result.message, 'success');
     } catch (error) {
         showMessage(`保存坐标失败: ${error.message}`, 'error');
-        console.error('Error saving coordinates:', error);
-    } finally {
-        loadingSpinner.classList.add('hidden');
+        console.error('Error patching coordinates:', error);
     }
 }
 
+// 等待异步任务结束：优先通过SSE接收进度，浏览器不支持或连接中断时改为轮询
+function waitForJob(jobId, onProgress) {
+    return new Promise((resolve, reject) => {
+        let finished = false;
+        const handle = (job) => {
+            if (onProgress) onProgress(job);
+            if (finishedJobStatuses.includes(job.status)) {
+                finished = true;
+                resolve(job);
+            }
+        };
+        const poll = async () => {
+            while (!finished) {
+                try {
+                    const response = await fetch(`/api/jobs/${jobId}`);
+                    const job = await response.json();
+                    if (!response.ok) {
+                        throw new Error(job.error || `HTTP Error! Status Code: ${response.status}`);
+                    }
+                    handle(job);
+                } catch (error) {
+                    finished = true;
+                    reject(error);
+                    return;
+                }
+                if (!finished) await new Promise((r) => setTimeout(r, jobPollInterval));
+            }
+        };
+        if (!window.EventSource) {
+            poll();
+            return;
+        }
+        const source = new EventSource(`/api/jobs/${jobId}/events`);
+        source.onmessage = (event) => {
+            handle(JSON.parse(event.data));
+            if (finished) source.close();
+        };
+        source.onerror = () => {
+            source.close();
+            if (!finished) poll();
+        };
+    });
+}
+
+// 取消本标签页尚未完成的检测任务（切换图像时调用）
+function cancelPendingJobs() {
+    fetch('/api/jobs/cancel', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ client: clientId })
+    }).catch((error) => console.error('Error cancelling jobs:', error));
+}
+
 // 页面关闭前向后端发送退出请求
 window.addEventListener('beforeunload', function(e) {
-    fetch('http://localhost:5000/shutdown', {
+    fetch('/shutdown', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ action: 'shutdown' })
@@ -235,12 +363,18 @@ async function loadImage(index) {
         if (data.error) {
             throw new Error(data.error);
         }
-        currentImage.src = `data:image/jpeg;base64,${data.image_data}`;
         currentGeoInfo = data.geo_info;
         currentHeaderLines = data.header_lines;
         coordinates = data.coordinates;
         originalImageDimensions = data.original_dimensions;
-        currentImage.onload = () => {
+        tileInfo = data.tiles;
+        tileBaseUrl = data.tile_url;
+        tileImages = new Map();
+        const loadingIndex = currentIndex;
+        const previewImage = new Image();
+        previewImage.onload = () => {
+            if (loadingIndex !== currentIndex) return;
+            currentImage = previewImage;
             zoomScale = 1.0;
             panOffsetX = 0;
             panOffsetY = 0;
@@ -250,12 +384,14 @@ async function loadImage(index) {
             loadingSpinner.classList.add('hidden');
             showMessage('图像加载成功！', 'success');
         };
-        currentImage.onerror = () => {
+        previewImage.onerror = () => {
             loadingSpinner.classList.add('hidden');
             showMessage('图像加载失败。', 'error');
             console.error('Image element failed to load.');
             noImagePlaceholder.classList.remove('hidden');
         };
+        // 先加载服务端缩放的预览图以便快速显示，放大时只加载可见区域的高分辨率瓦片
+        previewImage.src = data.preview_url;
     } catch (error) {
         loadingSpinner.classList.add('hidden');
         showMessage(`加载图像数据失败: ${error.message}`, 'error');
@@ -264,163 +400,36 @@ async function loadImage(index) {
     }
 }
 
+// 切换到指定索引的图像：取消本页面尚未完成的检测任务，并先写入尚未提交的坐标修改
+async function navigateToIndex(index) {
+    cancelPendingJobs();
+    await patchCoordinates([], true);
+    coordinates = [];
+    await loadImage(index);
+}
+
 // 上一张图像导航函数
 async function navigateImage_prevBtn(delta) {
-    await saveCoordinates();
     let nextIndex = currentIndex + delta;
-    if (nextIndex < 0) {
+    if (representativeIndices && representativeIndices.length) {
+        // 只在各组代表帧之间切换，当前图像不是代表帧时从其所在组开始计算
+        let position = representativeIndices.findIndex(index => index > currentIndex) - 1;
+        if (position < 0) {
+            position = position === -2 ? representativeIndices.length - 1 : 0;
+        }
+        if (delta < 0 && representativeIndices[position] < currentIndex) {
+            position += 1;
+        }
+        position = (position + delta + representativeIndices.length) % representativeIndices.length;
+        nextIndex = representativeIndices[position];
+    } else if (nextIndex < 0) {
         nextIndex = imageFiles.length - 1;
     } else if (nextIndex >= imageFiles.length) {
         nextIndex = 0;
     }
-    coordinates = [];
-    await loadImage(nextIndex);
+    await navigateToIndex(nextIndex);
 }
 
-// 下一张图像导航函数，显示模态框确认
-// async function navigateImage_nextBtn(delta) {
-//     const elementCount = {};
-//     coordinates.forEach(coord => {
-//         if (coord && typeof coord[2] === 'number') {
-//             const element = coord[2];
-//             elementCount[element] = (elementCount[element] || 0) + 1;
-//         }
-//     });
-
-//     const modal = document.createElement('div');
-//     modal.classList.add('fixed', 'top-1/2', 'left-1/2', '-translate-x-1/2', '-translate-y-1/2', 'bg-white', 'p-6', 'rounded-lg', 'shadow-lg', 'z-50', 'transform', 'opacity-0', 'transition-all', 'duration-300', 'ease-out');
-
-//     const content = document.createElement('div');
-//     for (const [element, count] of Object.entries(elementCount)) {
-//         const p = document.createElement('p');
-//         p.textContent = `靶标${element}, 标注数量 ${count}`;
-//         p.classList.add('mb-2', 'text-gray-700');
-//         content.appendChild(p);
-//     }
-//     modal.appendChild(content);
-
-//     const buttonContainer = document.createElement('div');
-//     buttonContainer.classList.add('flex', 'justify-end', 'mt-4');
-
-//     const confirmButton = document.createElement('button');
-//     confirmButton.textContent = '确定';
-//     confirmButton.classList.add('px-4', 'py-2', 'bg-green-500', 'text-white', 'rounded-md', 'mr-2', 'hover:bg-green-600', 'focus:outline-none', 'focus:ring-2', 'focus:ring-green-400', 'focus:ring-opacity-50');
-//     confirmButton.addEventListener('click', async () => {
-//         await saveCoordinates();
-//         let nextIndex = currentIndex + delta;
-//         if (nextIndex < 0) {
-//             nextIndex = imageFiles.length - 1;
-//         } else if (nextIndex >= imageFiles.length) {
-//             nextIndex = 0;
-//         }
-//         coordinates = [];
-//         await loadImage(nextIndex);
-//         modal.remove();
-//     });
-//     buttonContainer.appendChild(confirmButton);
-
-//     const cancelButton = document.createElement('button');
-//     cancelButton.textContent = '取消';
-//     cancelButton.classList.add('px-4', 'py-2', 'bg-red-500', 'text-white', 'rounded-md', 'hover:bg-red-600', 'focus:outline-none', 'focus:ring-2', 'focus:ring-red-400', 'focus:ring-opacity-50');
-//     cancelButton.addEventListener('click', () => modal.remove());
-//     buttonContainer.appendChild(cancelButton);
-
-//     modal.appendChild(buttonContainer);
-//     document.body.appendChild(modal);
-//     void modal.offsetWidth;
-//     modal.classList.add('opacity-100');
-// }
-
-// // 合并的鼠标按下事件处理器，处理左键标注和中键拖拽
-// canvas.addEventListener('mousedown', async (event) => {
-//     if (event.button === 1) { // 鼠标中键按钮代码为 1
-//         event.preventDefault();
-//         isPanning = true;
-//         lastPanX = event.clientX;
-//         lastPanY = event.clientY;
-//         canvas.style.cursor = 'move';
-//         return;
-//     }
-//     if (event.button === 2) { // 鼠标右键删除标记
-//         if (coordinates.length > 0 && !(coordinates.length === 1 && coordinates[0] === null)) {
-//             const rect = canvas.getBoundingClientRect();
-//             const devicePixelRatio = window.devicePixelRatio || 1;
-//             const clickCanvasX = (event.clientX - rect.left) * devicePixelRatio;
-//             const clickCanvasY = (event.clientY - rect.top) * devicePixelRatio;
-//
-//             let minDistance = Infinity;
-//             let closestIndex = -1;
-//
-//             coordinates.forEach((coord, index) => {
-//                 if (coord && typeof coord[0] === 'number' && typeof coord[1] === 'number') {
-//                     const canvasX = imageDrawInfo.x + coord[0] * imageDrawInfo.scale;
-//                     const canvasY = imageDrawInfo.y + coord[1] * imageDrawInfo.scale;
-//                     const distance = Math.sqrt((canvasX - clickCanvasX) ** 2 + (canvasY - clickCanvasY) ** 2);
-//                     if (distance < minDistance) {
-//                         minDistance = distance;
-//                         closestIndex = index;
-//                     }
-//                 }
-//             });
-//
-//             if (closestIndex !== -1) {
-//                 coordinates.splice(closestIndex, 1);
-//                 if (coordinates.length === 0) {
-//                     coordinates.push(null);
-//                 }
-//                 drawAnnotations();
-//                 await saveCoordinates();
-//                 updateUI();
-//                 showMessage('距离最近的标记已删除。', 'info');
-//             }
-//         } else {
-//             showMessage('没有可删除的标记。', 'info');
-//         }
-//         return;
-//     }
-//     if (event.button !== 0) return;
-//
-//     const rect = canvas.getBoundingClientRect();
-//     const devicePixelRatio = window.devicePixelRatio || 1;
-//     const clickCanvasX = (event.clientX - rect.left) * devicePixelRatio;
-//     const clickCanvasY = (event.clientY - rect.top) * devicePixelRatio;
-//
-//     const isClickInsideImageDrawArea =
-//         clickCanvasX >= imageDrawInfo.x &&
-//         clickCanvasX <= (imageDrawInfo.x + imageDrawInfo.width) &&
-//         clickCanvasY >= imageDrawInfo.y &&
-//         clickCanvasY <= (imageDrawInfo.y + imageDrawInfo.height);
-//
-//     if (isClickInsideImageDrawArea) {
-//         const imgX = Math.round((clickCanvasX - imageDrawInfo.x) / imageDrawInfo.scale);
-//         const imgY = Math.round((clickCanvasY - imageDrawInfo.y) / imageDrawInfo.scale);
-//         if (imgX >= 0 && imgX < originalImageDimensions.width &&
-//             imgY >= 0 && imgY < originalImageDimensions.height) {
-//             const targetNumber = prompt('请输入靶标编号 (数字):');
-//             if (targetNumber === null) {
-//                 // showMessage('标注已取消', 'info');
-//                 return;
-//             }
-//             const targetNum = parseInt(targetNumber);
-//             if (isNaN(targetNum) || targetNum <= 0 || targetNum > 9) {
-//                 showMessage('请输入在范围1~9的整数', 'error');
-//                 return;
-//             }
-//             if (coordinates.length === 1 && coordinates[0] === null) {
-//                 coordinates = [];
-//             }
-//             coordinates.push([imgX, imgY, targetNum]);
-//             drawAnnotations();
-//             await saveCoordinates();
-//             updateUI();
-//             // showMessage(`坐标已记录: X ${imgX}, Y ${imgY}, 靶标 ${targetNum}`, 'success');
-//         } else {
-//             showMessage('点击位置超出图片边界。', 'info');
-//         }
-//     } else {
-//         showMessage('点击区域不在图像内。请直接点击图像。', 'info');
-//     }
-// });
 // 新增全局变量
 // 新增变量，用于标记是否处于绘制矩形框模式
 
@@ -448,6 +457,12 @@ document.addEventListener('keydown', (event) => {
         updateCanvasSizeAndOffsets();
         drawAnnotations();
         showMessage('缩放和平移已重置', 'info');
+    } else if (event.key === 'p' || event.key === 'P') {
+        propagateBtn.click();
+    } else if (event.key === 'a' || event.key === 'A') {
+        detectAllBtn.click();
+    } else if ((event.key === 'c' || event.key === 'C') && representativeIndices) {
+        copyClusterBtn.click();
     } else if (event.key === 'm' || event.key === 'M') { // 新增快捷键 M 进入绘制矩形框模式
         if( isDrawingRectangle == true){
             isDrawingRectangle = false;
@@ -508,8 +523,7 @@ canvas.addEventListener('mousedown', async (event) => {
                     coordinates.push(null);
                 }
                 drawAnnotations();
-                await saveCoordinates();
-                updateUI();
+                await patchCoordinates([{ op: 'delete', index: closestIndex }]);
                 showMessage('距离最近的标记已删除。', 'info');
             }
         } else {
@@ -549,8 +563,7 @@ canvas.addEventListener('mousedown', async (event) => {
             }
             coordinates.push([imgX, imgY, targetNum]);
             drawAnnotations();
-            await saveCoordinates();
-            updateUI();
+            await patchCoordinates([{ op: 'add', x: imgX, y: imgY, target: targetNum }]);
         } else {
             showMessage('点击位置超出图片边界。', 'info');
         }
@@ -613,36 +626,50 @@ canvas.addEventListener('mouseup', async (event) => {
             Math.round((rectangleEnd[1] - imageDrawInfo.y) / imageDrawInfo.scale)
         ];
 
+        // 检测在后台任务中执行，请求立即返回；等待期间可以继续操作，切换图像时任务会被取消
+        const editingIndex = currentIndex;
+        rectangleStart = null;
+        rectangleEnd = null;
+        drawAnnotations(); // 重新绘制标注，移除矩形框
         try {
-            const response = await fetch('/api/process_rectangle', {
+            const response = await fetch('/api/jobs/detect', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ rectangle: [imgRectStart, imgRectEnd] })
+                body: JSON.stringify({
+                    rectangle: [imgRectStart, imgRectEnd],
+                    index: editingIndex,
+                    filename: imageFiles[editingIndex],
+                    target: targetNum,
+                    client: clientId
+                })
             });
-            if (!response.ok) {
-                throw new Error(`HTTP Error! Status Code: ${response.status}`);
+            const submitted = await response.json();
+            if (!response.ok || submitted.error) {
+                throw new Error(submitted.error || `HTTP Error! Status Code: ${response.status}`);
+            }
+            showMessage(`正在检测靶标 ${targetNum} 的角点...`, 'info');
+            const job = await waitForJob(submitted.job_id);
+            if (job.status === 'cancelled' || editingIndex !== currentIndex) {
+                return; // 已被新的矩形取代或已切换图像
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error);
+            }
+            const result = job.result;
+            if (coordinates.length === 1 && coordinates[0] === null) {
+                coordinates = [];
             }
-            const result = await response.json();
-            coordinatesList.innerHTML = '';
             result.forEach((coord) => {
-                const li = document.createElement('li');
-                li.textContent = `靶标 ${targetNum}: (X: ${coord[0]}, Y: ${coord[1]})`;
                 coordinates.push([coord[0], coord[1], targetNum]);
-                coordinatesList.appendChild(li);
             });
             drawAnnotations();
-            await saveCoordinates();
-            updateUI();
+            await patchCoordinates(result.map((coord) => ({ op: 'add', x: coord[0], y: coord[1], target: targetNum })));
 
             showMessage('矩形框数据处理成功', 'success');
         } catch (error) {
             showMessage(`处理矩形框数据失败: ${error.message}`, 'error');
             console.error('Error processing rectangle data:', error);
         }
-
-        rectangleStart = null;
-        rectangleEnd = null;
-        drawAnnotations(); // 重新绘制标注，移除矩形框
     }
 
     if (event.button === 1) { // 鼠标中键按钮代码为 1
@@ -705,16 +732,114 @@ document.addEventListener('contextmenu', function(event) {
 prevBtn.addEventListener('click', () => navigateImage_prevBtn(-1));
 nextBtn.addEventListener('click', () => navigateImage_prevBtn(1));
 
+// 检测全部靶标按钮事件：扫描整幅图像检测所有靶标，自动分配编号后替换同编号的已有点
+detectAllBtn.addEventListener('click', async () => {
+    if (!imageFiles.length) return;
+    const editingIndex = currentIndex;
+    try {
+        const response = await fetch('/api/jobs/detect_all', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ index: editingIndex, filename: imageFiles[editingIndex], client: clientId })
+        });
+        const submitted = await response.json();
+        if (!response.ok || submitted.error) {
+            throw new Error(submitted.error || `HTTP Error! Status Code: ${response.status}`);
+        }
+        showMessage('正在检测整幅图像中的靶标...', 'info');
+        const job = await waitForJob(submitted.job_id);
+        if (job.status === 'cancelled' || editingIndex !== currentIndex) {
+            return;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error);
+        }
+        const boards = job.result.filter((board) => board.target !== null);
+        if (!boards.length) {
+            showMessage(job.result.length ? '靶标编号已用完。' : '没有检测到靶标。', 'info');
+            return;
+        }
+        const ops = [];
+        boards.forEach((board) => {
+            ops.push({ op: 'delete', target: board.target });
+            board.points.forEach((point) => ops.push({ op: 'add', x: point[0], y: point[1], target: board.target }));
+        });
+        await patchCoordinates(ops);
+        showMessage(`检测到 ${boards.length} 个靶标: ${boards.map((board) => board.target).join(', ')}`, 'success');
+    } catch (error) {
+        showMessage(`检测全部靶标失败: ${error.message}`, 'error');
+        console.error('Error detecting all targets:', error);
+    }
+});
+
+// 传播按钮事件：把当前图像中已标注的靶标跟踪到下一张图像并检测角点，成功后切换到下一张
+propagateBtn.addEventListener('click', async () => {
+    if (!imageFiles.length || currentIndex >= imageFiles.length - 1) {
+        showMessage('已经是最后一张图像。', 'info');
+        return;
+    }
+    loadingSpinner.classList.remove('hidden');
+    try {
+        const response = await fetch('/api/propagate', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ index: currentIndex, count: 1 })
+        });
+        const result = await response.json();
+        if (!response.ok || result.error) {
+            throw new Error(result.error || `HTTP Error! Status Code: ${response.status}`);
+        }
+        const failed = result.report.filter(row => row[2] !== 'ok');
+        if (!result.frames.length) {
+            loadingSpinner.classList.add('hidden');
+            showMessage(failed.length ? `传播失败: ${failed.map(row => `靶标${row[1]} ${row[3]}`).join('; ')}`
+                                      : '当前图像没有需要传播的靶标。', failed.length ? 'error' : 'info');
+            return;
+        }
+        // 跳过近重复帧模式下下一张可能不是代表帧，直接切换到传播到的图像以便检查结果
+        await navigateToIndex(result.frames[0].index);
+        const count = Object.keys(result.frames[0].detected).length;
+        showMessage(failed.length ? `已传播 ${count} 个靶标，${failed.length} 个失败` : `已传播 ${count} 个靶标`,
+                    failed.length ? 'info' : 'success');
+    } catch (error) {
+        loadingSpinner.classList.add('hidden');
+        showMessage(`传播靶标失败: ${error.message}`, 'error');
+        console.error('Error propagating targets:', error);
+    }
+});
+
+// 复制按钮事件（跳过近重复帧模式）：把当前图像的靶标点复制到同组几乎相同的其余图像
+copyClusterBtn.addEventListener('click', async () => {
+    if (!imageFiles.length) return;
+    try {
+        await patchCoordinates([], true);
+        const response = await fetch('/api/dedup/copy_annotations', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ index: currentIndex, overwrite: true })
+        });
+        const result = await response.json();
+        if (!response.ok || result.error) {
+            throw new Error(result.error || `HTTP Error! Status Code: ${response.status}`);
+        }
+        showMessage(result.copied.length ? `已复制标注到 ${result.copied.length} 张几乎相同的图像`
+                                         : '没有需要复制标注的图像。', result.copied.length ? 'success' : 'info');
+    } catch (error) {
+        showMessage(`复制标注失败: ${error.message}`, 'error');
+        console.error('Error copying cluster annotations:', error);
+    }
+});
+
 // 撤销按钮事件
 undoBtn.addEventListener('click', async () => {
     if (coordinates.length > 0 && !(coordinates.length === 1 && coordinates[0] === null)) {
+        const lastIndex = coordinates.length - 1;
         coordinates.pop();
         if (coordinates.length === 0) {
             coordinates.push(null);
         }
         drawAnnotations();
-        await saveCoordinates();
-        updateUI();
+        await patchCoordinates([{ op: 'delete', index: lastIndex }]);
         showMessage('最后标记已撤销。', 'info');
     } else {
         showMessage('没有可撤销的标记。', 'info');
@@ -728,8 +853,7 @@ clearAllMarksHandler = async () => {
     clearBtn.onclick = async () => {
         coordinates = [null];
         drawAnnotations();
-        await saveCoordinates();
-        updateUI();
+        await patchCoordinates([{ op: 'clear' }]);
         showMessage('所有标记已清除。', 'success');
         clearBtn.onclick = clearAllMarksHandler;
     };
@@ -846,6 +970,17 @@ async function init() {
             throw new Error(data.error);
         }
         imageFiles = data;
+        if (new URLSearchParams(window.location.search).get('dedup') === '1' && imageFiles.length > 0) {
+            const dedupResponse = await fetch('/api/images?dedup=1');
+            const dedupData = await dedupResponse.json();
+            if (!dedupResponse.ok || dedupData.error) {
+                throw new Error(dedupData.error || `HTTP 错误! 状态码: ${dedupResponse.status}`);
+            }
+            representativeIndices = dedupData.indices;
+            clusterSizes = dedupData.cluster_sizes;
+            copyClusterBtn.classList.remove('hidden');
+            showMessage(`跳过近重复帧: ${dedupData.total} 张图像分为 ${dedupData.files.length} 组`, 'info');
+        }
         if (imageFiles.length > 0) {
             await loadImage(0);
         } else {
@@ -0,0 +1,196 @@
+import os
+import math
+import time
+import shutil
+import logging
+import threading
+import cv2
+import numpy as np
+from PIL import Image
+
+TILES_DIRNAME = 'tiles'
+TILE_SIZE = 512      # 瓦片边长（像素）
+TILE_QUALITY = 85    # 瓦片JPEG质量
+TILE_DISK_BUDGET_BYTES = 2 * 1024 ** 3  # 磁盘上瓦片的总字节预算，超出时按最近访问时间删除整幅图像的瓦片
+EVICT_TARGET_RATIO = 0.9                # 淘汰到预算的该比例以下，避免每写一个瓦片都触发淘汰
+
+logger = logging.getLogger(__name__)
+
+
+def tile_grid(width, height, tile_size=TILE_SIZE):
+    """
+    计算图像金字塔的层级结构：最高层为原始分辨率，每降低一层宽高减半，第0层整幅图像不超过一个瓦片
+    :param width: 原始图像宽度
+    :param height: 原始图像高度
+    :param tile_size: 瓦片边长
+    :return: {'tile_size', 'max_level', 'levels': [{'width', 'height', 'cols', 'rows'}, ...]}
+    """
+    max_level = max(0, math.ceil(math.log2(max(width, height) / tile_size))) if max(width, height) > 0 else 0
+    levels = []
+    for z in range(max_level + 1):
+        factor = 2 ** (max_level - z)
+        level_width = max(1, math.ceil(width / factor))
+        level_height = max(1, math.ceil(height / factor))
+        levels.append({
+            'width': level_width,
+            'height': level_height,
+            'cols': math.ceil(level_width / tile_size),
+            'rows': math.ceil(level_height / tile_size)
+        })
+    return {'tile_size': tile_size, 'max_level': max_level, 'levels': levels}
+
+
+class TileCache:
+    """
+    按需生成并缓存在磁盘上的 z/x/y 图像瓦片
+    瓦片目录以图像文件名、修改时间和大小命名，图像被修改后自动生成新目录并删除旧目录；
+    各层的缩放图像通过解码图像缓存加载，同一图像同一层的并发请求只解码和缩放一次（DecodedImageCache.get 合并并发的未命中）；
+    瓦片总大小超过 max_bytes 时删除最久未访问的图像的瓦片目录
+    """
+
+    def __init__(self, cache_dir, image_cache, tile_size=TILE_SIZE, quality=TILE_QUALITY,
+                 max_bytes=TILE_DISK_BUDGET_BYTES):
+        """
+        :param cache_dir: 缓存目录，瓦片保存在其下的 tiles 子目录
+        :param image_cache: DecodedImageCache 实例
+        :param tile_size: 瓦片边长
+        :param quality: JPEG质量
+        :param max_bytes: 磁盘上瓦片的总字节预算
+        """
+        self.tiles_dir = os.path.join(cache_dir, TILES_DIRNAME)
+        self.image_cache = image_cache
+        self.tile_size = tile_size
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self._known_dirs = set()
+        self._last_access = {}    # 瓦片目录 -> 本进程内最近访问时间，没有记录的目录使用其修改时间
+        self._disk_bytes = None   # 瓦片总字节数，第一次写入瓦片时统计
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _dir_size(path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def _touch(self, image_dir):
+        with self._lock:
+            self._last_access[image_dir] = time.time()
+
+    def _account(self, image_dir, size):
+        """记录新写入的瓦片大小，超出预算时淘汰"""
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._dir_size(self.tiles_dir)  # 已包含刚写入的瓦片
+            else:
+                self._disk_bytes += size
+            if self._disk_bytes > self.max_bytes:
+                self._evict(image_dir)
+
+    def _evict(self, keep_dir):
+        """按最近访问时间删除其他图像的瓦片目录，直到总大小低于预算的 EVICT_TARGET_RATIO（调用时持有锁）"""
+        candidates = []
+        for entry in os.scandir(self.tiles_dir):
+            if entry.is_dir() and entry.path != keep_dir:
+                last_access = self._last_access.get(entry.path)
+                candidates.append((last_access if last_access is not None else entry.stat().st_mtime, entry.path))
+        candidates.sort()
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        for _, path in candidates:
+            if self._disk_bytes <= target:
+                break
+            size = self._dir_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            self._disk_bytes -= size
+            self._known_dirs.discard(path)
+            self._last_access.pop(path, None)
+            self.evictions += 1
+            logger.debug("瓦片缓存超出预算，删除 %s（%s 字节）", path, size)
+
+    def _image_dir(self, image_path):
+        stat = os.stat(image_path)
+        name = os.path.basename(image_path)
+        image_dir = os.path.join(self.tiles_dir, f"{name}-{stat.st_mtime_ns:x}-{stat.st_size:x}")
+        with self._lock:
+            if image_dir in self._known_dirs:
+                return image_dir
+            self._known_dirs.add(image_dir)
+        if os.path.isdir(self.tiles_dir):
+            # 删除同一图像修改前的旧瓦片
+            for entry in os.listdir(self.tiles_dir):
+                path = os.path.join(self.tiles_dir, entry)
+                if entry != os.path.basename(image_dir) and entry.rsplit('-', 2)[0] == name:
+                    shutil.rmtree(path, ignore_errors=True)
+                    with self._lock:
+                        self._disk_bytes = None  # 下次写入时重新统计
+                        self._last_access.pop(path, None)
+        return image_dir
+
+    def _load_level(self, image_path, size, full_size):
+        """读取并缩放到某一层的尺寸；原图未解码时对JPEG使用 draft 模式降采样解码"""
+        decoded = self.image_cache.peek(image_path, 'bgr')
+        if decoded is None and size != full_size:
+            with Image.open(image_path) as img:
+                img.draft('RGB', size)
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                decoded = cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+        if decoded is None:
+            decoded = self.image_cache.get_bgr(image_path)
+            if decoded is None:
+                return None
+        if (decoded.shape[1], decoded.shape[0]) == size:
+            return decoded
+        return cv2.resize(decoded, size, interpolation=cv2.INTER_AREA)
+
+    def tile_path(self, image_path, z, x, y):
+        """
+        返回瓦片文件路径，不存在时生成
+        :param image_path: 图像文件的完整路径
+        :param z: 层级（0为整幅缩略图，max_level为原始分辨率）
+        :param x: 列号
+        :param y: 行号
+        :return: 瓦片JPEG文件路径
+        """
+        image_dir = self._image_dir(image_path)
+        self._touch(image_dir)
+        path = os.path.join(image_dir, str(z), f"{x}_{y}.jpg")
+        if os.path.exists(path):
+            return path
+
+        with Image.open(image_path) as img:
+            full_size = img.size
+        grid = tile_grid(*full_size, tile_size=self.tile_size)
+        if not 0 <= z <= grid['max_level']:
+            raise ValueError(f"瓦片层级 {z} 超出范围 0-{grid['max_level']}")
+        level = grid['levels'][z]
+        if not (0 <= x < level['cols'] and 0 <= y < level['rows']):
+            raise ValueError(f"瓦片 {z}/{x}/{y} 超出范围")
+
+        level_size = (level['width'], level['height'])
+        if z == grid['max_level']:
+            level_img = self._load_level(image_path, level_size, full_size)
+        else:
+            level_img = self.image_cache.get(image_path, f'tile-level-{z}',
+                                             lambda p: self._load_level(p, level_size, full_size))
+        if level_img is None:
+            raise ValueError(f"无法读取图像 {image_path}")
+        x0, y0 = x * self.tile_size, y * self.tile_size
+        tile = level_img[y0:y0 + self.tile_size, x0:x0 + self.tile_size]
+        ok, encoded = cv2.imencode('.jpg', tile, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError(f"瓦片 {z}/{x}/{y} 编码失败")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp_path, path)
+        self._account(image_dir, encoded.nbytes)
+        return path
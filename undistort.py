@@ -0,0 +1,71 @@
+import threading
+import cv2
+import numpy as np
+
+_map_cache = {}
+_map_lock = threading.Lock()
+
+
+def get_undistort_maps(cam_matrix, dist_coeffs, image_size):
+    """
+    返回去畸变重映射表，按 (相机参数, 分辨率) 缓存在内存中，只在第一次使用时计算
+    :param cam_matrix: 相机内参矩阵
+    :param dist_coeffs: 畸变系数
+    :param image_size: 图像尺寸 (宽, 高)
+    :return: (map1, map2)，定点格式 CV_16SC2，供 cv2.remap 使用
+    """
+    key = (cam_matrix.tobytes(), dist_coeffs.tobytes(), tuple(image_size))
+    maps = _map_cache.get(key)
+    if maps is None:
+        with _map_lock:
+            maps = _map_cache.get(key)
+            if maps is None:
+                maps = cv2.initUndistortRectifyMap(cam_matrix, dist_coeffs, None, cam_matrix,
+                                                   tuple(image_size), cv2.CV_16SC2)
+                _map_cache[key] = maps
+    return maps
+
+
+def undistort_image(img, cam_matrix, dist_coeffs):
+    """
+    使用缓存的重映射表对整幅图像去畸变，结果与 cv2.undistort 一致
+    :param img: 输入图像
+    :return: 去畸变后的图像
+    """
+    height, width = img.shape[:2]
+    map1, map2 = get_undistort_maps(cam_matrix, dist_coeffs, (width, height))
+    return cv2.remap(img, map1, map2, cv2.INTER_LINEAR)
+
+
+def roi_bounds(region_vertices, image_size, margin):
+    """
+    计算区域顶点的外接矩形（加边距并裁剪到图像范围内）
+    :param region_vertices: 区域顶点列表 [[x, y], ...]
+    :param image_size: 图像尺寸 (宽, 高)
+    :param margin: 外扩的像素数
+    :return: (x0, y0, x1, y1)
+    """
+    points = np.asarray(region_vertices, dtype=np.float64)
+    width, height = image_size
+    x0 = int(max(0, np.floor(points[:, 0].min()) - margin))
+    y0 = int(max(0, np.floor(points[:, 1].min()) - margin))
+    x1 = int(min(width, np.ceil(points[:, 0].max()) + margin + 1))
+    y1 = int(min(height, np.ceil(points[:, 1].max()) + margin + 1))
+    return x0, y0, x1, y1
+
+
+def undistort_roi(img, cam_matrix, dist_coeffs, region_vertices, margin=64):
+    """
+    只对区域外接矩形（加边距）内的像素去畸变，重映射表直接按去畸变后的坐标切片
+    :param img: 输入图像（原始畸变图像）
+    :param region_vertices: 去畸变坐标系下的区域顶点列表
+    :param margin: 外扩的像素数
+    :return: (去畸变后的局部图像, (x0, y0) 局部图像在整幅去畸变图像中的偏移)
+    """
+    height, width = img.shape[:2]
+    map1, map2 = get_undistort_maps(cam_matrix, dist_coeffs, (width, height))
+    x0, y0, x1, y1 = roi_bounds(region_vertices, (width, height), margin)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError("选择的区域不在图像范围内")
+    crop = cv2.remap(img, map1[y0:y1, x0:x1], map2[y0:y1, x0:x1], cv2.INTER_LINEAR)
+    return crop, (x0, y0)
@@ -0,0 +1,145 @@
+import time
+import logging
+import threading
+
+DEBOUNCE_SECONDS = 0.5   # 最后一次修改后等待多久写入磁盘
+MAX_DELAY_SECONDS = 3.0  # 连续修改时最迟多久写入一次
+RETRY_SECONDS = 3.0      # 写入失败后第一次重试的等待时间，之后每次加倍
+MAX_RETRIES = 5          # 自动重试的最大次数，之后保留在内存中，等下一次修改或显式写入时再尝试
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    按键（图像文件名）合并短时间内的多次修改，延迟写入磁盘
+    修改先作用于内存中的最新状态，最后一次修改 DEBOUNCE_SECONDS 后（连续修改时最迟 MAX_DELAY_SECONDS 后）
+    在后台调用 flush_fn 写入一次；读取时优先返回尚未写入的内存状态
+    每个键有单独的锁，加载和写入文件都在该锁内、全局锁外进行，一张图像写入较慢时不影响其他图像的修改；
+    写入失败的状态保留在内存中，按指数退避最多自动重试 MAX_RETRIES 次，最近一次的错误可通过 error 查询
+    未写入的状态只保存在本进程内存中，因此只能在单进程服务器中使用
+    """
+
+    def __init__(self, flush_fn, debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS, retry_delay=RETRY_SECONDS,
+                 max_retries=MAX_RETRIES):
+        """
+        :param flush_fn: 写入函数 flush_fn(key, state)，失败时应抛出异常
+        :param debounce: 防抖延迟（秒）
+        :param max_delay: 最大延迟（秒）
+        :param retry_delay: 写入失败后第一次重试的等待时间（秒）
+        :param max_retries: 自动重试的最大次数
+        """
+        self.flush_fn = flush_fn
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self._pending = {}    # key -> [状态, 首次修改时间, Timer或None, 连续失败次数, 最近一次错误]
+        self._key_locks = {}  # key -> 该键的修改和写入锁
+        self._lock = threading.Lock()  # 只保护 _pending 和 _key_locks，持有期间不做I/O
+        self.flushes = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _schedule(self, key, delay):
+        timer = threading.Timer(delay, self.flush, args=(key,))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def get(self, key):
+        """返回尚未写入（包括正在写入）的状态，没有时返回None"""
+        with self._lock:
+            entry = self._pending.get(key)
+            return entry[0] if entry else None
+
+    def error(self, key):
+        """返回该键最近一次写入失败的错误信息，没有未写入的状态或尚未失败时返回None"""
+        with self._lock:
+            entry = self._pending.get(key)
+            return entry[4] if entry else None
+
+    def update(self, key, load_fn, apply_fn):
+        """
+        修改一个键的状态并安排延迟写入
+        :param load_fn: 没有未写入状态时加载当前状态的函数
+        :param apply_fn: 接收当前状态、返回新状态的函数，抛出异常时不做任何修改
+        :return: 新状态
+        """
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._pending.get(key)
+            # 持有该键的锁时不会有同一个键的写入在进行，从文件加载的就是最新状态
+            state = apply_fn(entry[0] if entry else load_fn())
+            with self._lock:
+                now = time.monotonic()
+                if entry:
+                    if entry[2] is not None:
+                        entry[2].cancel()
+                    self.coalesced += 1
+                    first_time = entry[1]
+                else:
+                    first_time = now
+                delay = max(0.0, min(self.debounce, first_time + self.max_delay - now))
+                # 新的修改重新开始计算失败次数，但保留错误信息直到写入成功
+                self._pending[key] = [state, first_time, self._schedule(key, delay), 0, entry[4] if entry else None]
+            return state
+
+    def discard(self, key):
+        """丢弃未写入的状态（例如整体保存覆盖了增量修改），正在写入时等待写入完成"""
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._pending.pop(key, None)
+                if entry and entry[2] is not None:
+                    entry[2].cancel()
+
+    def flush(self, key=None):
+        """
+        立即写入一个键（key为None时写入全部）的未写入状态
+        写入在该键的锁内进行，保证同一个键的写入顺序与修改顺序一致；写入期间 get 仍返回该状态，
+        成功后才从内存中移除，失败时保留并按指数退避安排重试，超过 max_retries 次后不再自动重试
+        """
+        if key is None:
+            with self._lock:
+                keys = list(self._pending)
+            for k in keys:
+                self.flush(k)
+            return
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._pending.get(key)
+                if entry is None:
+                    return
+                if entry[2] is not None:
+                    entry[2].cancel()
+                    entry[2] = None
+            try:
+                self.flush_fn(key, entry[0])
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                    entry[3] += 1
+                    entry[4] = str(e) or type(e).__name__
+                    if entry[3] <= self.max_retries:
+                        delay = self.retry_delay * 2 ** (entry[3] - 1)
+                        entry[2] = self._schedule(key, delay)
+                        logger.warning("延迟写入 %s 失败（第 %s 次）: %s，%.1f 秒后重试", key, entry[3], e, delay)
+                    else:
+                        logger.error("延迟写入 %s 连续失败 %s 次，停止自动重试，修改保留在内存中: %s", key, entry[3], e)
+                return
+            with self._lock:
+                self._pending.pop(key, None)
+                self.flushes += 1
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'flushes': self.flushes, 'coalesced': self.coalesced,
+                    'failures': self.failures,
+                    'failing': sum(1 for entry in self._pending.values() if entry[4] is not None)}